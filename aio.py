@@ -0,0 +1,152 @@
+""" Rendering for asyncio applications (e.g. aiohttp services); this module requires python 3.5+ """
+
+__author__ = 'eczech'
+
+from pylfer.manager import VizManager
+from pylfer.template import default_transform
+from pylfer.batch import render_job, split_transform
+from pylfer.instrument import RenderStats, bind, stage
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import tempfile
+import asyncio
+import weakref
+
+
+class AsyncVizManager(VizManager):
+    """ Visualization manager with coroutine versions of its rendering methods
+
+    Data transformation and template saturation run in a configurable executor while all other work that touches
+    the disk (writing renders, data files, caches, etc.) runs in the event loop's default executor, so renders never
+    block the event loop.  The number of renders in progress at once can also be limited so that a few slow, large
+    renders can't occupy every worker while other requests wait.
+
+    Async renders are instrumented like any other (see VizManager.configure), except that no profile is captured
+    since their work is spread over several threads (along with that of any other renders in progress), and the
+    stages run in a process pool executor are not timed (as with VizManager.render_many)
+    """
+
+    def __init__(self, template_path, render_path=tempfile.gettempdir(), executor=None, max_concurrent=None):
+        """ Create an asynchronous manager (see VizManager)
+        :param template_path: Absolute path to HTML template files
+        :param render_path: Absolute path under which rendered results will be stored
+        :param executor: Executor in which data is transformed and templates saturated (see self.configure)
+        :param max_concurrent: Maximum number of renders in progress at once (see self.configure)
+        """
+        self.executor = executor
+        self.max_concurrent = max_concurrent
+        self._semaphores = weakref.WeakKeyDictionary()
+        super(AsyncVizManager, self).__init__(template_path, render_path=render_path)
+
+    def configure(self, executor=None, max_concurrent=None, **kwargs):
+        """ Set properties of the visualization manager
+
+        :param executor: concurrent.futures executor in which data is transformed and templates saturated; with
+                a process pool, renders are run by managers in the worker processes (as with self.render_many)
+                and otherwise this manager is shared by all threads (defaults to the event loop's default executor,
+                which False also restores)
+        :param max_concurrent: Maximum number of renders in progress at once; any further renders wait for one of
+                these to finish before starting (no limit by default)
+        :param kwargs: Any other properties of the manager (see VizManager.configure)
+        :return self
+        """
+        if executor is not None:
+            self.executor = executor or None
+        if max_concurrent is not None:
+            self.max_concurrent = max_concurrent
+            self._semaphores = weakref.WeakKeyDictionary()
+        return super(AsyncVizManager, self).configure(**kwargs)
+
+    def _semaphore(self):
+        # Semaphores belong to a single event loop, so a separate one is created for each loop
+        loop = asyncio.get_event_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphores[loop]
+
+    async def render_async(self, template, data, transform=default_transform, filename=None, live=False, **kwargs):
+        """ Coroutine that renders a visualization without blocking the event loop
+
+        :param template: Name of template to saturate
+        :param data: DataFrame to use in visualization
+        :param transform: Transformation applied to data frame (see VizManager.render)
+        :param filename: Name of file to store render in (see VizManager.render)
+        :param live: Whether or not rows can be appended to the render later on (see VizManager.render)
+        :param kwargs: Arguments for the template
+        :return: Result of render, as returned by VizManager.render
+        :raises batch.RenderError: if the data transformation or template saturation fails
+        """
+        if not self.max_concurrent:
+            return await self._render_async(template, data, transform, filename, live, kwargs)
+        async with self._semaphore():
+            return await self._render_async(template, data, transform, filename, live, kwargs)
+
+    async def _render_async(self, template, data, transform, filename, live, kwargs):
+        # Time the whole render (apart from any wait for a free slot) when instrumentation is enabled
+        if not self._instrumenting():
+            return await self._run_async(template, data, transform, filename, live, kwargs, None)
+        stats = RenderStats(template, filename)
+        with stats.stage('total'):
+            result = await self._run_async(template, data, transform, filename, live, kwargs, stats)
+        self._report(stats, data)
+        return result
+
+    async def _run_async(self, template, data, transform, filename, live, kwargs, stats):
+        loop = asyncio.get_event_loop()
+
+        # Preparing a render may write files (and renders already cached need no further work)
+        result, prepared = await loop.run_in_executor(
+            None, _bound, stats, self._prepare_async, template, data, transform, filename, live, kwargs
+        )
+        if prepared is None:
+            return result
+        transform, key, kwargs = prepared
+
+        # Transform and saturate in the configured executor, streaming straight to the render file if enabled;
+        # stages run in other processes can't be recorded, so only the job itself is sent to those
+        if isinstance(self.executor, ProcessPoolExecutor):
+            config, transform = self._process_config(), split_transform(transform)
+            job = functools.partial(render_job, config)
+        else:
+            job = functools.partial(_bound, stats, render_job, self)
+        path = self._resolve_filename(filename) if filename and self.streaming else None
+        value, error = await loop.run_in_executor(self.executor, job, 0, template, data, transform, kwargs, path)
+        if error is not None:
+            raise error
+
+        # Save and cache the result as self.render would
+        return await loop.run_in_executor(None, _bound, stats, self._finish_job, value, filename, key, kwargs)
+
+    def _prepare_async(self, template, data, transform, filename, live, kwargs):
+        # Prepare a render, completing it immediately if it's already in the cache
+        with stage('prepare'):
+            transform, key, kwargs = self._prepare(template, data, transform, filename, live, kwargs)
+        if key is not None and self.render_cache.get(key) is not None:
+            return self._render_prepared(template, data, transform, filename, key, kwargs), None
+        return None, (transform, key, kwargs)
+
+    async def save_async(self, html, filename='viz.html'):
+        """ Coroutine that saves HTML content in a file without blocking the event loop (see VizManager.save)
+
+        :param html: HTML string to be saved
+        :param filename: Name of file to store render in
+        :return: Path of file in which render was stored
+        """
+        return await asyncio.get_event_loop().run_in_executor(None, self.save, html, filename)
+
+    async def append_async(self, filename, data, transform=default_transform, since=None):
+        """ Coroutine that appends new rows to a live render without blocking the event loop (see VizManager.append)
+
+        :param filename: Name of file containing the live render
+        :param data: DataFrame containing new rows
+        :param transform: Transformation applied to new rows
+        :param since: Only rows with an index value greater than this are appended
+        :return: Number of rows appended
+        """
+        return await asyncio.get_event_loop().run_in_executor(None, self.append, filename, data, transform, since)
+
+
+def _bound(stats, fn, *args):
+    # Run part of a render in an executor thread, recording its stages in the statistics for the render (if any)
+    with bind(stats):
+        return fn(*args)
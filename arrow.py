@@ -0,0 +1,151 @@
+""" Arrow tables and Parquet/Feather files as input for charts and histograms (requires pyarrow)
+
+Data is converted to pandas with one block per column, so numeric columns without missing values are views of
+the Arrow buffers rather than copies, and only the columns selected are ever read from files.  Feather (Arrow IPC)
+files are memory-mapped, so uncompressed columns are read straight from the OS page cache; Parquet columns are
+always decoded into memory since they are stored compressed.
+"""
+
+__author__ = 'eczech'
+
+import os
+
+# Extensions of files read as Parquet or Feather (Arrow IPC) files
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+FEATHER_EXTENSIONS = ('.feather', '.arrow', '.ipc')
+
+# Number of rows per data frame when iterating over Arrow data in batches (see ArrowSource.iter_frames)
+BATCH_SIZE = 65536
+
+
+def _is_path(data):
+    # Strings are only treated as paths of files to read with pyarrow if they have one of the extensions above
+    if not isinstance(data, (str, type(u''))):
+        return False
+    return os.path.splitext(data)[1].lower() in PARQUET_EXTENSIONS + FEATHER_EXTENSIONS
+
+
+def is_arrow(data):
+    """ Determine whether or not the given object is a pyarrow Table or RecordBatch (or a list of record batches)
+
+    This never imports pyarrow, so it can be used to check any input whether or not pyarrow is installed
+    """
+    if isinstance(data, (list, tuple)):
+        return len(data) > 0 and is_arrow(data[0])
+    return type(data).__module__.split('.')[0] == 'pyarrow'
+
+
+class ArrowSource(object):
+    """ Arrow data to be read as data frames, limited to a selection of columns """
+
+    def __init__(self, data, columns=None, index=None):
+        """ Create a new source
+        :param data: pyarrow.Table, pyarrow.RecordBatch, list of record batches or path of a Parquet or Feather file
+        :param columns: Names of columns to read (all columns are read by default)
+        :param index: Name of column to use as the index of data frames (e.g. a timestamp column for time series
+                charts); this column is always read, whether or not it is among the columns selected
+        """
+        if not is_arrow(data) and not _is_path(data):
+            raise ValueError(
+                'Data must be a pyarrow Table, RecordBatch or list of RecordBatches or a path with an extension in {} '
+                '(not "{}")'.format(PARQUET_EXTENSIONS + FEATHER_EXTENSIONS, data)
+            )
+        self.data = data
+        self.columns = columns
+        self.index = index
+
+    def _selected(self):
+        # Names of columns to read, or None for all columns
+        if self.columns is None:
+            return None
+        columns = list(self.columns)
+        if self.index is not None and self.index not in columns:
+            columns.insert(0, self.index)
+        return columns
+
+    def _is_parquet(self):
+        return _is_path(self.data) and os.path.splitext(self.data)[1].lower() in PARQUET_EXTENSIONS
+
+    def read_table(self):
+        """ Read the selected columns as a pyarrow.Table (without copying any Arrow data given) """
+        import pyarrow as pa
+        columns = self._selected()
+        if self._is_parquet():
+            import pyarrow.parquet as pq
+            return pq.read_table(self.data, columns=columns, memory_map=True)
+        if _is_path(self.data):
+            import pyarrow.feather as feather
+            return feather.read_table(self.data, columns=columns, memory_map=True)
+        if isinstance(self.data, (list, tuple)):
+            table = pa.Table.from_batches(self.data)
+        elif isinstance(self.data, pa.RecordBatch):
+            table = pa.Table.from_batches([self.data])
+        else:
+            table = self.data
+        return table.select(columns) if columns is not None else table
+
+    def to_frame(self):
+        """ Read the selected columns as a DataFrame """
+        return _table_to_frame(self.read_table(), self.index)
+
+    def iter_frames(self, batch_size=BATCH_SIZE):
+        """ Read the selected columns as a sequence of DataFrames (e.g. for utilities.get_histograms_chunked)
+
+        Parquet files are read one batch at a time so that only a single batch is ever in memory
+        :param batch_size: Maximum number of rows in each DataFrame
+        :return: Generator of DataFrames
+        """
+        import pyarrow as pa
+        if self._is_parquet():
+            import pyarrow.parquet as pq
+            batches = pq.ParquetFile(self.data, memory_map=True).iter_batches(
+                batch_size=batch_size, columns=self._selected()
+            )
+        else:
+            batches = self.read_table().to_batches(max_chunksize=batch_size)
+        for batch in batches:
+            yield _table_to_frame(pa.Table.from_batches([batch]), self.index)
+
+
+def _table_to_frame(table, index):
+    # Convert a table to a frame with one block per column so that pandas never consolidates (i.e. copies) columns
+    # of the same type together, attaching the index afterwards since DataFrame.set_index would copy every column
+    import pandas as pd
+    if index is None:
+        return table.to_pandas(split_blocks=True)
+    position = table.schema.get_field_index(index)
+    if position < 0:
+        raise ValueError('Index column "{}" not found in data'.format(index))
+    frame = table.remove_column(position).to_pandas(split_blocks=True)
+    frame.index = pd.Index(table.column(position).to_pandas(), name=index)
+    return frame
+
+
+def to_frame(data, columns=None, index=None):
+    """ Get a DataFrame from input given as a DataFrame, as Arrow data or as the path of a Parquet or Feather file
+
+    :param data: DataFrame, ArrowSource or anything an ArrowSource can be created from (see ArrowSource)
+    :param columns: Names of columns to read from Arrow data (see ArrowSource)
+    :param index: Name of column to use as the index for Arrow data (see ArrowSource)
+    :return: DataFrame (data frames given are returned as-is)
+    """
+    if isinstance(data, ArrowSource):
+        return data.to_frame()
+    if is_arrow(data) or _is_path(data):
+        return ArrowSource(data, columns=columns, index=index).to_frame()
+    return data
+
+
+def to_chunks(data, batch_size=BATCH_SIZE):
+    """ Get a function returning an iterable of DataFrames from Arrow data (see utilities.get_histograms_chunked)
+
+    :param data: ArrowSource or anything an ArrowSource can be created from, or any other chunks (which are
+            returned as-is)
+    :param batch_size: Maximum number of rows in each DataFrame
+    :return: Function returning a generator of DataFrames
+    """
+    if not isinstance(data, ArrowSource):
+        if not is_arrow(data) and not _is_path(data):
+            return data
+        data = ArrowSource(data)
+    return lambda: data.iter_frames(batch_size=batch_size)
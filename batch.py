@@ -0,0 +1,189 @@
+__author__ = 'eczech'
+
+from collections import OrderedDict
+import traceback
+import numpy as np
+import pickle
+import os
+
+# Managers created within worker processes, keyed by their configuration, so
+# that templates are only loaded and compiled once per worker
+_worker_managers = {}
+
+
+class RenderError(Exception):
+    """ Error raised while rendering a single job within a batch
+
+    Instances are returned in place of the results for failed jobs (see VizManager.render_many)
+    """
+
+    def __init__(self, index, error, trace):
+        """ Create a new render error
+        :param index: Position of the failed job within the batch
+        :param error: String representation of the original exception
+        :param trace: Formatted traceback of the original exception
+        """
+        super(RenderError, self).__init__('Render job {} failed: {}'.format(index, error))
+        self.index = index
+        self.error = error
+        self.trace = trace
+
+    def __reduce__(self):
+        return RenderError, (self.index, self.error, self.trace)
+
+
+class FrameRef(object):
+    """ Reference to a data frame with columns stored in memory-mapped .npy files
+
+    These are passed to worker processes in place of data frames so that large
+    frames never need to be pickled and sent through a pipe; workers map the column
+    buffers straight from disk instead (usually the OS page cache)
+    """
+
+    def __init__(self, data, path):
+        """ Write the columns of a data frame to the given directory
+        :param data: DataFrame to store
+        :param path: Directory (which must already exist) in which column files will be written
+        """
+        import pandas as pd
+        self.columns = data.columns
+        self.index_name = data.index.name
+        self.index_tz = None
+        self.tz = {}
+        self.files = []
+        self.objects = {}
+
+        # Dates are stored as datetime64 arrays, which keep their resolution (e.g. ms rather than ns), and timezone
+        # aware dates as UTC along with their timezone so that they can be converted back once loaded
+        index = data.index
+        if isinstance(index, pd.DatetimeIndex):
+            self.index_tz = index.tz
+            index = index.values
+        self.index = self._store(np.asarray(index), os.path.join(path, 'index.npy'), 'index')
+
+        for i in range(len(data.columns)):
+            column = data.iloc[:, i]
+            tz = getattr(column.dtype, 'tz', None)
+            if tz is not None:
+                self.tz[i] = tz
+            self.files.append(self._store(column.values, os.path.join(path, '{}.npy'.format(i)), i))
+
+    def _store(self, values, filename, key):
+        # Only plain numeric, boolean and datetime arrays can be memory-mapped; anything
+        # else (e.g. strings or categoricals) is kept on this object and pickled as usual
+        if isinstance(values, np.ndarray) and values.dtype.kind in 'biufcmM':
+            np.save(filename, values)
+            return filename
+        self.objects[key] = values
+        return None
+
+    def _load(self, filename, key):
+        return np.load(filename, mmap_mode='r') if filename else self.objects[key]
+
+    @staticmethod
+    def _localize(values, tz):
+        # Convert UTC dates back to dates in their original timezone
+        import pandas as pd
+        return pd.DatetimeIndex(np.asarray(values)).tz_localize('UTC').tz_convert(tz)
+
+    def column(self, i):
+        """ Get the values of a single column without rebuilding the whole data frame
+        :param i: Position of column
+        :return: Memory-mapped numpy array (or the original values for columns that could not be mapped, or a
+                DatetimeIndex for timezone aware dates)
+        """
+        values = self._load(self.files[i], i)
+        return self._localize(values, self.tz[i]) if i in self.tz else values
+
+    def load(self):
+        """ Rebuild the data frame from memory-mapped column files
+        :return: DataFrame
+        """
+        import pandas as pd
+        index = self._load(self.index, 'index')
+        if self.index_tz is not None:
+            index = self._localize(index, self.index_tz)
+        index = pd.Index(index, name=self.index_name)
+
+        data = pd.DataFrame(
+            OrderedDict((i, self.column(i)) for i in range(len(self.files))),
+            index=index, columns=range(len(self.files))
+        )
+        data.columns = self.columns
+        return data
+
+
+def split_transform(transform):
+    """ Convert a transform into a picklable form (bound methods can't be pickled in all python versions)
+    :return: Tuple of (object, method name) for bound methods or the original transform otherwise
+    """
+    owner = getattr(transform, '__self__', None)
+    if owner is not None:
+        return owner, transform.__name__
+    return transform
+
+
+def join_transform(transform):
+    """ Reverse of split_transform """
+    if isinstance(transform, tuple):
+        return getattr(transform[0], transform[1])
+    return transform
+
+
+def _get_manager(config):
+    from pylfer.manager import VizManager
+    if isinstance(config, VizManager):
+        return config
+    template_path, render_path, template_params, compression, bytecode_dir, assets = config
+    key = (template_path, render_path, pickle.dumps(template_params, protocol=2), compression, bytecode_dir, assets)
+    if key not in _worker_managers:
+        manager = VizManager(template_path, render_path=render_path)
+        _worker_managers[key] = manager.configure(
+            template_params=template_params, compression=compression[0] or False,
+            compression_level=compression[1], compression_only=compression[2],
+            bytecode_cache=bytecode_dir or False, assets=assets
+        )
+    return _worker_managers[key]
+
+
+def _render_error(index, e):
+    return RenderError(index, repr(e), traceback.format_exc())
+
+
+def capture(index, fn, *args):
+    """ Call a function for a single job within a batch, returning any exception it raises as a RenderError
+    so that the job fails alone rather than failing the whole batch (see VizManager.render_many)
+    :param index: Position of job within the batch
+    :param fn: Function to call with the remaining arguments
+    :return: Result of function or RenderError if it failed
+    """
+    try:
+        return fn(*args)
+    except Exception as e:
+        return _render_error(index, e)
+
+
+def render_job(config, index, template, data, transform, kwargs, filename):
+    """ Transform and saturate a single template (this is the function run by batch workers)
+
+    :param config: VizManager instance (for threaded workers) or tuple of (template path, render path,
+            template params, compression settings, bytecode cache directory, asset mode) used to create an
+            equivalent manager in worker processes
+    :param index: Position of job within the batch
+    :param template: Name of template to saturate
+    :param data: DataFrame or FrameRef containing data for the template
+    :param transform: Transform applied to data (see split_transform)
+    :param kwargs: Arguments for the template
+    :param filename: Path to stream render to (see VizManager.stream) or None to return render as a string
+    :return: Tuple of (HTML string or path of file containing render, RenderError or None)
+    """
+    try:
+        manager = _get_manager(config)
+        if isinstance(data, FrameRef):
+            data = data.load()
+        transform = join_transform(transform)
+        if filename is not None:
+            return manager.stream(template, data, filename, transform=transform, **kwargs), None
+        return manager.saturate(template, data=manager._transform(data, transform), **kwargs), None
+    except Exception as e:
+        return None, _render_error(index, e)
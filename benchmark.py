@@ -0,0 +1,321 @@
+""" Benchmarks for the performance critical paths in pylfer
+
+Every benchmark runs against synthetic data frames of several sizes and index types and reports the
+best time over a number of repeats, the peak memory used by a single run and the size of the output
+produced.  Results can be saved as a baseline and later runs compared against it so that regressions
+fail loudly; e.g.:
+
+    python -m pylfer.benchmark --sizes small medium --save baseline.json
+    python -m pylfer.benchmark --sizes small medium --compare baseline.json
+"""
+
+__author__ = 'eczech'
+
+from pylfer.template import default_transform, NVD3LineChart, NVD3StackedAreaChart, HighchartsLineChart
+from pylfer.template import HighchartsConfigurableLineChart, HistogramHeatmaps
+from pylfer.manager import VizManager
+from pylfer.utilities import get_histograms
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+import numpy as np
+import pandas as pd
+import argparse
+import tempfile
+import timeit
+import shutil
+import json
+import sys
+import os
+
+# Frame shapes (rows, columns) benchmarked for each size setting
+SIZES = {
+    'small': [(1000, 5)],
+    'medium': [(100000, 5), (10000, 50)],
+    'large': [(1000000, 10), (100000, 200)]
+}
+
+# Types of index benchmarked for each frame shape
+INDEX_TYPES = ('datetime', 'numeric')
+
+# Default relative increase in time, memory or output size over a baseline considered a regression
+TOLERANCE = .25
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+
+def make_frame(rows, cols, index='datetime', seed=0):
+    """ Create a synthetic data frame of random walks
+    :param rows: Number of rows
+    :param cols: Number of (float) columns
+    :param index: Type of index; one of 'datetime' (timestamps a minute apart) or 'numeric'
+    :param seed: Random seed
+    :return: DataFrame
+    """
+    if index not in INDEX_TYPES:
+        raise ValueError('Index type must be one of {} (not "{}")'.format(INDEX_TYPES, index))
+    values = np.random.RandomState(seed).randn(rows, cols).cumsum(axis=0)
+    if index == 'datetime':
+        idx = pd.date_range('2015-01-01', periods=rows, freq='min')
+    else:
+        idx = pd.Index(np.arange(rows) * .5)
+    return pd.DataFrame(values, index=idx, columns=['c{}'.format(i) for i in range(cols)])
+
+
+def _transform_case(transform):
+    # Benchmark for a transform writing to a buffer, returning the number of bytes written
+    def run(data):
+        output = StringIO()
+        transform(data, output)
+        return len(output.getvalue())
+    return run
+
+
+def _manager_case(method):
+    # Benchmark for a VizManager method, run with a manager rendering to a temporary directory
+    def run(data):
+        path = tempfile.mkdtemp(prefix='pylfer_benchmark_')
+        try:
+            manager = VizManager(TEMPLATE_PATH, render_path=path).configure(display=False)
+            return method(manager, data)
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+    return run
+
+
+def _saturate(manager, data):
+    viz = NVD3LineChart()
+    html = manager.saturate(viz.get_template(), data=manager._transform(data, viz.transform), x_is_date=True)
+    return len(html)
+
+
+def _render(manager, data):
+    viz = NVD3LineChart()
+    return len(manager.render(viz.get_template(), data, transform=viz.transform, x_is_date=True))
+
+
+def _save(manager, data):
+    viz = NVD3LineChart()
+    html = manager.saturate(viz.get_template(), data=manager._transform(data, viz.transform), x_is_date=True)
+    return os.path.getsize(manager.save(html, 'benchmark'))
+
+
+def _make_histograms(data):
+    # Use the first column as the target, with some missing values and sentinels mixed in
+    data = data.reset_index(drop=True)
+    data.iloc[::7, 1:] = np.nan
+    data.iloc[::11, 1:] = -999
+    return get_histograms(data, data.columns[0], sentinels={-999: 'unknown'})
+
+
+def _histograms(data):
+    return sum(h.values.nbytes for h in _make_histograms(data).values())
+
+
+# Histograms of the last frame benchmarked, so that transforms of histograms are timed without computing them
+_histogram_cache = {}
+
+
+def _histogram_case(transform):
+    # Benchmark for a transform of the histograms of a frame, writing to a buffer
+    run = _transform_case(transform)
+
+    def run_histograms(data):
+        if _histogram_cache.get('data') is not data:
+            _histogram_cache.clear()
+            _histogram_cache.update(data=data, hists=_make_histograms(data))
+        return run(_histogram_cache['hists'])
+    return run_histograms
+
+
+# Benchmarks by name, each being a function of a data frame that returns the size of its output in bytes
+BENCHMARKS = [
+    ('default_transform', _transform_case(default_transform)),
+    ('NVD3LineChart.transform', _transform_case(NVD3LineChart().transform)),
+    ('NVD3LineChart.transform[binary]', _transform_case(NVD3LineChart(payload='binary').transform)),
+    ('NVD3LineChart.transform[columnar]', _transform_case(NVD3LineChart(payload='columnar').transform)),
+    ('NVD3StackedAreaChart.transform', _transform_case(NVD3StackedAreaChart().transform)),
+    ('NVD3StackedAreaChart.transform[columnar]', _transform_case(NVD3StackedAreaChart(payload='columnar').transform)),
+    ('HighchartsLineChart.transform', _transform_case(HighchartsLineChart().transform)),
+    ('HighchartsConfigurableLineChart.transform', _transform_case(HighchartsConfigurableLineChart().transform)),
+    ('VizManager.saturate', _manager_case(_saturate)),
+    ('VizManager.render', _manager_case(_render)),
+    ('VizManager.save', _manager_case(_save)),
+    ('utilities.get_histograms', _histograms),
+    ('HistogramHeatmaps.transform', _histogram_case(HistogramHeatmaps().transform)),
+    ('HistogramHeatmaps.transform[binary]', _histogram_case(HistogramHeatmaps(payload='binary').transform))
+]
+
+
+def _peak_memory(fn, data):
+    # Return the peak number of bytes allocated while running a function (or None if this can't be measured)
+    try:
+        import tracemalloc
+    except ImportError:
+        return _peak_rss(fn, data)
+    tracemalloc.start()
+    try:
+        fn(data)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _reset_peak_rss():
+    # Return memory freed by earlier benchmarks to the OS and reset the peak resident set size to the current
+    # size, so that memory reused from the heap counts towards the peak (glibc and Linux only; elsewhere the
+    # peak starts from the size of the process, which can hide reused memory)
+    try:
+        import ctypes
+        import ctypes.util
+        ctypes.CDLL(ctypes.util.find_library('c')).malloc_trim(0)
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (ImportError, AttributeError, OSError, IOError):
+        pass
+
+
+def _get_peak_rss():
+    # Return the peak resident set size of this process in bytes
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    import resource
+    # Resident set sizes are reported in bytes on macOS and in kilobytes everywhere else
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def _peak_rss(fn, data):
+    # Without tracemalloc (i.e. on python 2), run the function in a forked child process and measure how far
+    # its peak resident set size grows beyond the size it started with; unlike tracemalloc, this includes
+    # memory allocated outside of python (e.g. by numpy)
+    if not hasattr(os, 'fork'):
+        return None
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        code = 1
+        try:
+            _reset_peak_rss()
+            start = _get_peak_rss()
+            fn(data)
+            os.write(write, str(_get_peak_rss() - start).encode('ascii'))
+            code = 0
+        finally:
+            os._exit(code)
+    os.close(write)
+    with os.fdopen(read, 'rb') as f:
+        result = f.read()
+    if os.waitpid(pid, 0)[1] != 0 or not result:
+        return None
+    return int(result)
+
+
+def run(sizes=('small',), pattern=None, repeat=3, out=None):
+    """ Run benchmarks
+    :param sizes: Names of sizes of frames to benchmark (see SIZES)
+    :param pattern: Substring of names of benchmarks to run (all benchmarks are run by default)
+    :param repeat: Number of times each benchmark is timed (the fastest time is reported)
+    :param out: Stream to write a line to as each benchmark completes (nothing is written by default)
+    :return: List of dictionaries with the name, frame shape and index type, time (in seconds), peak
+            memory (in bytes; allocated by python 3 or resident on python 2) and output size (in bytes) of each
+            benchmark
+    """
+    results = []
+    for size in sizes:
+        for rows, cols in SIZES[size]:
+            for index in INDEX_TYPES:
+                data = make_frame(rows, cols, index=index)
+                for name, fn in BENCHMARKS:
+                    if pattern and pattern not in name:
+                        continue
+                    times, size_bytes = [], None
+                    for _ in range(repeat):
+                        start = timeit.default_timer()
+                        size_bytes = fn(data)
+                        times.append(timeit.default_timer() - start)
+                    result = {
+                        'name': name, 'rows': rows, 'cols': cols, 'index': index,
+                        'seconds': min(times), 'peak_bytes': _peak_memory(fn, data), 'output_bytes': size_bytes
+                    }
+                    results.append(result)
+                    if out is not None:
+                        out.write(_format(result) + '\n')
+                        out.flush()
+    return results
+
+
+def _case(result):
+    return result['name'], result['rows'], result['cols'], result['index']
+
+
+def _format(result):
+    peak = '{:.1f} MB'.format(result['peak_bytes'] / 1e6) if result['peak_bytes'] is not None else 'n/a'
+    return '{:<45} {:>8} x {:<4} {:<9} {:>10.4f} s  peak {:>10}  output {:>12,} bytes'.format(
+        result['name'], result['rows'], result['cols'], result['index'], result['seconds'], peak,
+        result['output_bytes']
+    )
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """ Compare benchmark results against a baseline
+    :param results: Results returned from run
+    :param baseline: Results returned from an earlier run (e.g. loaded from a file saved by main)
+    :param tolerance: Relative increase in time, peak memory or output size over the baseline considered a
+            regression (e.g. .25 means that anything more than 25% slower or larger is a regression)
+    :return: List of strings describing each regression (empty if there are none)
+    """
+    baseline = dict((_case(r), r) for r in baseline)
+    regressions = []
+    for result in results:
+        base = baseline.get(_case(result))
+        if base is None:
+            continue
+        for metric in ('seconds', 'peak_bytes', 'output_bytes'):
+            new, old = result[metric], base[metric]
+            if new is None or old is None or old == 0:
+                continue
+            if new > old * (1 + tolerance):
+                regressions.append('{} ({} x {}, {} index): {} increased from {} to {} ({:+.0%})'.format(
+                    result['name'], result['rows'], result['cols'], result['index'], metric, old, new,
+                    float(new) / old - 1
+                ))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run pylfer benchmarks')
+    parser.add_argument('--sizes', nargs='+', default=['small'], choices=sorted(SIZES),
+                        help='Sizes of frames to benchmark')
+    parser.add_argument('--filter', default=None, help='Only run benchmarks with names containing this string')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times each benchmark is timed')
+    parser.add_argument('--save', default=None, help='Path of file to save results in (as JSON)')
+    parser.add_argument('--compare', default=None, help='Path of file containing baseline results to compare to')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='Relative increase over baseline results considered a regression')
+    args = parser.parse_args(argv)
+
+    results = run(sizes=args.sizes, pattern=args.filter, repeat=args.repeat, out=sys.stdout)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f), tolerance=args.tolerance)
+        if regressions:
+            sys.stderr.write('{} REGRESSION(S) FOUND:\n'.format(len(regressions)))
+            for regression in regressions:
+                sys.stderr.write('  ' + regression + '\n')
+            return 1
+        sys.stdout.write('No regressions found\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,293 @@
+__author__ = 'eczech'
+
+from collections import OrderedDict
+import functools
+import threading
+import hashlib
+import types
+import pickle
+import shutil
+import os
+
+
+def hash_data(data):
+    """ Compute a fast content hash for data passed to a template render
+
+    Data frames are hashed using pandas' vectorized row hashing over the underlying arrays
+    (including the index), along with column names and types; anything else is pickled
+    :param data: DataFrame (or other picklable object) to hash
+    :return: Hex digest string
+    """
+    import pandas as pd
+    h = hashlib.sha1()
+    if isinstance(data, pd.DataFrame):
+        h.update(pd.util.hash_pandas_object(data, index=True).values.tobytes())
+        h.update(repr([(c, str(t)) for c, t in zip(data.columns, data.dtypes)]).encode('utf-8'))
+        h.update(repr(data.index.name).encode('utf-8'))
+    else:
+        h.update(pickle.dumps(data, protocol=2))
+    return h.hexdigest()
+
+
+class _Undescribable(Exception):
+    # Raised for values that can't be described reliably (see describe)
+    pass
+
+
+def describe(value):
+    """ Produce a stable string representation of a template parameter for use in cache keys
+
+    Functions are described by their code (bytecode, constants and names referenced), default arguments, the
+    values of any variables they close over and the values of any global variables they refer to, so that two
+    lambdas or closures differing only in those are never confused with one another.  Partial functions are
+    also described by their arguments and bound methods by the state of the instance they're bound to (e.g.
+    Viz settings like fill_area_cols)
+    :return: String description, or None if the value (or anything it refers to) can't be described reliably,
+            e.g. objects whose representation depends only on their identity; such values must never be used
+            in cache keys
+    """
+    try:
+        return _describe(value)
+    except (_Undescribable, RuntimeError):
+        # Recursion errors are raised for functions that refer to themselves (e.g. through a closure)
+        return None
+
+
+def _describe(value):
+    if isinstance(value, functools.partial):
+        return 'partial({}, {}, {})'.format(
+            _describe(value.func), _describe(list(value.args)), _describe(value.keywords or {})
+        )
+    if isinstance(value, type):
+        return '{}.{}'.format(value.__module__, value.__name__)
+    if callable(value):
+        return _describe_callable(value)
+    if isinstance(value, dict):
+        return '{' + ', '.join('{}: {}'.format(_describe(k), _describe(value[k])) for k in sorted(value)) + '}'
+    if isinstance(value, (list, tuple)):
+        return '[' + ', '.join(_describe(v) for v in value) + ']'
+    if type(value).__module__.split('.')[0] in ('numpy', 'pandas') and hasattr(value, 'shape'):
+        # Representations of arrays and frames are truncated, so their content is hashed instead
+        return '{}({})'.format(type(value).__name__, hash_data(value))
+    description = repr(value)
+    if ' at 0x' in description:
+        raise _Undescribable()
+    return description
+
+
+def _describe_callable(value):
+    owner = getattr(value, '__self__', None)
+    if isinstance(owner, types.ModuleType):
+        owner = None
+
+    # Bound methods include the state of the instance they're bound to
+    function = getattr(value, '__func__', None)
+    if owner is not None:
+        if function is None or not hasattr(owner, '__dict__'):
+            raise _Undescribable()
+        return '{}:{}:{}'.format(type(owner).__name__, _describe_function(function), _describe(vars(owner)))
+
+    # Builtin functions can only be described by name, while any other
+    # callable objects are described by their state and call method
+    if hasattr(value, '__code__'):
+        return _describe_function(value)
+    if isinstance(value, types.BuiltinFunctionType):
+        return '{}.{}'.format(value.__module__, value.__name__)
+    call = getattr(type(value), '__call__', None)
+    if not hasattr(value, '__dict__') or not hasattr(call, '__code__'):
+        raise _Undescribable()
+    return '{}:{}:{}'.format(type(value).__name__, _describe_function(call), _describe(vars(value)))
+
+
+def _describe_function(function):
+    # Describe a python function by its name, code, defaults, closure and the global variables it refers to
+    code = function.__code__
+    try:
+        closure = [cell.cell_contents for cell in function.__closure__ or ()]
+    except ValueError:
+        # Cells of variables not yet assigned have no contents
+        raise _Undescribable()
+
+    # Global functions, classes and modules are left out since they're described by name only and
+    # could refer back to this function; anything else (e.g. a global constant) is described by value
+    names = getattr(function, '__globals__', {})
+    refs = dict(
+        (k, names[k]) for k in code.co_names
+        if k in names and not callable(names[k]) and not isinstance(names[k], types.ModuleType)
+    )
+    return '{}.{}:{}:{}:{}:{}:{}'.format(
+        function.__module__, function.__name__, _describe_code(code), _describe(function.__defaults__ or ()),
+        _describe(getattr(function, '__kwdefaults__', None) or {}), _describe(closure), _describe(refs)
+    )
+
+
+def _describe_code(code):
+    # Hash the bytecode of a function along with the constants and names it refers to (including nested functions)
+    h = hashlib.sha1(code.co_code)
+    for const in code.co_consts:
+        h.update((_describe_code(const) if isinstance(const, types.CodeType) else _describe(const)).encode('utf-8'))
+        h.update(b'\0')
+    h.update(repr((code.co_names, code.co_varnames, code.co_freevars)).encode('utf-8'))
+    return h.hexdigest()
+
+
+class RenderCache(object):
+    """ Two tier (memory and disk) cache of saturated templates
+
+    Entries are keyed by a hash of everything that determines the content of a render (see VizManager.render)
+    and both tiers evict least recently used entries once their total size exceeds the configured limit
+    """
+
+    def __init__(self, path, max_memory_bytes=64 * 2**20, max_disk_bytes=1024 * 2**20):
+        """ Create a new render cache
+        :param path: Directory in which disk cache entries will be stored
+        :param max_memory_bytes: Maximum total size of renders held in memory (0 to disable memory tier)
+        :param max_disk_bytes: Maximum total size of renders stored on disk (0 to disable disk tier)
+        """
+        self.path = path
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._saved = {}
+        self._lock = threading.Lock()
+
+        if self.max_disk_bytes:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            self._disk_bytes = sum(size for _, _, size in self._disk_entries())
+
+    @staticmethod
+    def key(*parts):
+        """ Combine the given (string) parts into a single cache key """
+        h = hashlib.sha1()
+        for part in parts:
+            h.update(part.encode('utf-8') if not isinstance(part, bytes) else part)
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key + '.html')
+
+    def _disk_entries(self):
+        # Return (path, last access time, size) of every disk entry
+        res = []
+        for name in os.listdir(self.path):
+            if name.endswith('.html'):
+                stat = os.stat(os.path.join(self.path, name))
+                res.append((os.path.join(self.path, name), stat.st_mtime, stat.st_size))
+        return res
+
+    def get(self, key):
+        """ Fetch a cached render
+        :param key: Cache key
+        :return: HTML string for render or None if not present in either tier
+        """
+        with self._lock:
+            if key in self._memory:
+                html = self._memory.pop(key)
+                self._memory[key] = html
+                return html
+
+        if not self.max_disk_bytes:
+            return None
+        path = self._entry_path(key)
+        try:
+            with open(path, 'r') as f:
+                html = f.read()
+        except IOError:
+            return None
+
+        # Touch the file to mark it as recently used and promote it to the memory tier
+        os.utime(path, None)
+        self._put_memory(key, html)
+        return html
+
+    def get_path(self, key):
+        """ Fetch the path of a cached render on disk (without reading it into memory)
+        :param key: Cache key
+        :return: Path to file containing HTML for render or None if not present in the disk tier
+        """
+        path = self._entry_path(key)
+        if not self.max_disk_bytes or not os.path.exists(path):
+            return None
+        os.utime(path, None)
+        return path
+
+    def put(self, key, html):
+        """ Add a render to the cache
+        :param key: Cache key
+        :param html: HTML string for render
+        """
+        self._put_memory(key, html)
+        if not self.max_disk_bytes or len(html) > self.max_disk_bytes:
+            return
+        path = self._entry_path(key)
+        if os.path.exists(path):
+            return
+
+        # Write to a temporary file first so that readers never see partial entries
+        tmp = self._temp_path(path)
+        with open(tmp, 'w') as f:
+            f.write(html)
+        self._add_disk_entry(tmp, path, len(html))
+
+    def put_file(self, key, filename):
+        """ Add a render already stored in a file to the disk tier of the cache
+        :param key: Cache key
+        :param filename: Path of file containing HTML for render
+        """
+        size = os.path.getsize(filename)
+        path = self._entry_path(key)
+        if not self.max_disk_bytes or size > self.max_disk_bytes or os.path.exists(path):
+            return
+        tmp = self._temp_path(path)
+        shutil.copyfile(filename, tmp)
+        self._add_disk_entry(tmp, path, size)
+
+    @staticmethod
+    def _temp_path(path):
+        return '{}.{}.tmp'.format(path, threading.current_thread().ident)
+
+    def _add_disk_entry(self, tmp, path, size):
+        os.rename(tmp, path)
+        with self._lock:
+            self._disk_bytes += size
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _put_memory(self, key, html):
+        if not self.max_memory_bytes or len(html) > self.max_memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= len(self._memory.pop(key))
+            self._memory[key] = html
+            self._memory_bytes += len(html)
+            while self._memory_bytes > self.max_memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _evict_disk(self):
+        # Remove least recently used entries until the disk tier is back under its limit
+        entries = sorted(self._disk_entries(), key=lambda e: e[1])
+        self._disk_bytes = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._disk_bytes -= size
+
+    def is_saved(self, key, filename):
+        """ Determine whether or not the render for the given key is already stored in the given file """
+        stat = self._saved.get(filename)
+        if stat is None or stat[0] != key or not os.path.exists(filename):
+            return False
+        return os.path.getmtime(filename) == stat[1]
+
+    def mark_saved(self, key, filename):
+        """ Record that the render for the given key was written to the given file """
+        self._saved[filename] = (key, os.path.getmtime(filename))
@@ -0,0 +1,96 @@
+__author__ = 'eczech'
+
+import gzip
+
+# File extensions appended to renders for each supported compression method
+EXTENSIONS = {'gzip': '.gz', 'brotli': '.br'}
+
+
+def compressed_path(filename, method='gzip'):
+    """ Get the path of the compressed copy of the given file """
+    return filename + EXTENSIONS[method]
+
+
+class CompressedWriter(object):
+    """ File-like object that compresses text written to it into a file, incrementally
+
+    Compression is streamed so only a small buffer is ever held in memory regardless of
+    how much is written (the 'brotli' method requires the brotli package to be installed)
+    """
+
+    def __init__(self, filename, method='gzip', level=6):
+        """ Create a new compressed writer
+        :param filename: Path of uncompressed file; the extension for the compression method will be appended
+        :param method: Compression method; one of 'gzip' or 'brotli'
+        :param level: Compression level (1-9 for gzip, 0-11 for brotli)
+        """
+        if method not in EXTENSIONS:
+            raise ValueError('Compression method must be one of {} (not "{}")'.format(sorted(EXTENSIONS), method))
+        self.filename = compressed_path(filename, method)
+        self._file = open(self.filename, 'wb')
+        if method == 'gzip':
+            # Fix the timestamp in the gzip header so that identical content compresses identically
+            compressor = gzip.GzipFile(fileobj=self._file, mode='wb', compresslevel=level, mtime=0)
+            self._write, self._finish = compressor.write, compressor.close
+        else:
+            import brotli
+            compressor = brotli.Compressor(quality=level)
+            self._write = lambda b: self._file.write(compressor.process(b))
+            self._finish = lambda: self._file.write(compressor.finish())
+
+    def write(self, text):
+        self._write(text.encode('utf-8') if not isinstance(text, bytes) else text)
+
+    def close(self):
+        self._finish()
+        self._file.close()
+
+    def __iter__(self):
+        # Writers are not readable but pandas only accepts objects that are iterable as file buffers
+        raise TypeError('{} objects are write-only'.format(type(self).__name__))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TeeWriter(object):
+    """ File-like object that writes everything written to it to several other file-like objects """
+
+    def __init__(self, *writers):
+        self.writers = writers
+
+    def write(self, text):
+        for writer in self.writers:
+            writer.write(text)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+    def __iter__(self):
+        # Writers are not readable but pandas only accepts objects that are iterable as file buffers
+        raise TypeError('{} objects are write-only'.format(type(self).__name__))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_compressed(filename, method='gzip'):
+    """ Read the full content of a file written by a CompressedWriter
+    :param filename: Path of uncompressed file (i.e. without the extension for the compression method)
+    :param method: Compression method used to write the file
+    :return: Decompressed content as a string
+    """
+    filename = compressed_path(filename, method)
+    if method == 'gzip':
+        with gzip.open(filename, 'rb') as f:
+            return f.read().decode('utf-8')
+    import brotli
+    with open(filename, 'rb') as f:
+        return brotli.decompress(f.read()).decode('utf-8')
@@ -0,0 +1,191 @@
+__author__ = 'eczech'
+
+import numpy as np
+
+METHODS = ('lttb', 'minmax')
+
+
+def _gap_rows(y, edges):
+    """ Find the first row of a run of missing values within each bucket, for every column
+
+    Retaining these rows keeps gaps in a series visible once it has been downsampled
+    :param y: 2-D float array of series values (rows x columns)
+    :param edges: starting row of each bucket
+    :return: 2-D array of row positions (buckets x columns), with the number of rows in place of a
+            position for buckets that contain no gap
+    """
+    n, k = y.shape
+    missing = np.isnan(y)
+    starts = missing.copy()
+    starts[1:] &= ~missing[:-1]
+    if not starts.any():
+        return np.empty((0, k), dtype=int)
+    pos = np.where(starts, np.arange(n)[:, np.newaxis], n)
+    return np.minimum.reduceat(pos, edges, axis=0)
+
+
+def lttb_rows(x, y, n_out):
+    """ Select rows using the Largest-Triangle-Three-Buckets algorithm
+
+    Each column is downsampled independently; buckets are processed sequentially (as the
+    algorithm requires) but every bucket is evaluated for all columns at once
+    :param x: 1-D numeric array of x values
+    :param y: 2-D float array of series values (rows x columns)
+    :param n_out: number of points to retain per column
+    :return: 2-D array of row positions selected for each column (see _select_rows)
+    """
+    n, k = y.shape
+    cols = np.arange(k)
+
+    # The first and last points are always retained and the rest are
+    # split into n_out - 2 buckets of (nearly) equal size
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    starts = edges[:-1]
+
+    # Average of each bucket, ignoring missing values, which acts as the third
+    # point of the triangle for the bucket preceding it
+    valid = ~np.isnan(y[:n - 1])
+    sums = np.add.reduceat(np.where(valid, y[:n - 1], 0.), starts, axis=0)
+    counts = np.add.reduceat(valid, starts, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_y = np.vstack((sums / counts, y[n - 1:]))
+    avg_x = np.append(np.add.reduceat(x[:n - 1], starts) / np.diff(edges), x[n - 1])
+
+    rows = np.empty((n_out - 2, k), dtype=int)
+    a_x, a_y = np.repeat(x[0], k), y[0].copy()
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        b_x, b_y = x[lo:hi, np.newaxis], y[lo:hi]
+
+        # Fall back on a flat line through the previous point when the next bucket is empty
+        c_x, c_y = avg_x[i + 1], np.where(np.isnan(avg_y[i + 1]), a_y, avg_y[i + 1])
+
+        area = np.abs((a_x - c_x) * (b_y - a_y) - (a_x - b_x) * (c_y - a_y))
+        area[np.isnan(area)] = -1
+        sel = area.argmax(axis=0)
+        rows[i] = lo + sel
+
+        # Only move the anchor point forward if the selected value was present
+        sel_y = b_y[sel, cols]
+        present = ~np.isnan(sel_y)
+        a_x = np.where(present, x[lo + sel], a_x)
+        a_y = np.where(present, sel_y, a_y)
+
+    first, last = np.zeros((1, k), dtype=int), np.full((1, k), n - 1, dtype=int)
+    return np.vstack((first, rows, last, _gap_rows(y, starts)))
+
+
+def minmax_rows(y, n_out):
+    """ Select the rows containing the minimum and maximum value of each bucket, for every column
+
+    :param y: 2-D float array of series values (rows x columns); note that this array is modified in place
+    :param n_out: number of points to retain per column
+    :return: 2-D array of row positions selected for each column (see _select_rows)
+    """
+    n, k = y.shape
+    n_buckets = max(1, (n_out - 2) // 2)
+    size = int(np.ceil(n / float(n_buckets)))
+    edges = np.arange(0, n, size)
+    missing = np.isnan(y)
+    gaps = _gap_rows(y, edges)
+
+    def extremes(fill, arg):
+        # Split rows into full buckets (which can be reshaped and reduced in one step)
+        # and whatever remains at the end as a final, smaller bucket
+        y[missing] = fill
+        n_full = n // size
+        res = [arg(y[:n_full * size].reshape(n_full, size, k), axis=1) + edges[:n_full, np.newaxis]]
+        if n_full * size < n:
+            res.append(arg(y[n_full * size:], axis=0)[np.newaxis] + n_full * size)
+        return np.vstack(res)
+
+    # Missing values are replaced so that they are never selected unless an entire bucket
+    # is missing, in which case the first row of the bucket is taken (preserving the gap)
+    lows = extremes(np.inf, np.argmin)
+    highs = extremes(-np.inf, np.argmax)
+    first, last = np.zeros((1, k), dtype=int), np.full((1, k), n - 1, dtype=int)
+    return np.vstack((first, lows, highs, last, gaps))
+
+
+def _select_rows(x, y, n_out, method):
+    # Select rows for every column with the given method, as a 2-D array (rows x columns) of row
+    # positions that may contain duplicates and the number of rows in y as a placeholder for nothing
+    # (y is always a copy here since columns are selected from it by position, so minmax_rows can modify it)
+    if method == 'lttb':
+        return lttb_rows(x, y, n_out)
+    return minmax_rows(y, n_out)
+
+
+def _thin(rows, max_points):
+    # Keep max_points evenly spaced positions from a sorted array of row positions (including the first and last)
+    return rows[np.unique(np.linspace(0, len(rows) - 1, max_points).round().astype(int))]
+
+
+def downsample_rows(x, y, max_points, method='lttb', shared=False):
+    """ Select rows to retain for each series while preserving the visual shape of that series
+
+    Peaks and gaps (runs of missing values) are retained, but gaps are only kept within the limit on
+    the number of points: series with more gaps than fit are downsampled again with proportionally fewer
+    buckets (and evenly thinned as a last resort)
+    :param x: 1-D numeric array of x values
+    :param y: 2-D float array of series values (rows x columns)
+    :param max_points: maximum number of points to retain for each series (or in total, if shared)
+    :param method: downsampling method; one of:
+            - 'lttb': Largest-Triangle-Three-Buckets (best general purpose visual fidelity)
+            - 'minmax': minimum and maximum value within equally sized buckets (preserves extremes exactly)
+    :param shared: Whether or not all series must keep the same rows (e.g. for stacked charts), in which case
+            each series is given an equal share of max_points and the union of the rows selected is used
+    :return: List with a sorted array of row positions for each column (all arrays being the same if shared)
+    """
+    n, k = y.shape
+    budget = max(3, max_points // k) if shared else max_points
+    rows, pending, n_out = [None] * k, list(range(k)), budget
+    while pending:
+        selected = _select_rows(x, y[:, pending], n_out, method)
+        over, most = [], 0
+        for j, col in enumerate(pending):
+            r = np.unique(selected[:, j])
+            rows[col] = r[r < n]
+            if len(rows[col]) > budget and n_out > 3:
+                over.append(col)
+                most = max(most, len(rows[col]))
+
+        # Scale the number of buckets down by how far over the limit the worst series was
+        pending, n_out = over, max(3, min(n_out - 1, n_out * budget // max(most, 1)))
+    if shared:
+        rows = [np.unique(np.concatenate(rows))] * k
+    return [r if len(r) <= max_points else _thin(r, max_points) for r in rows]
+
+
+def downsample_series(data, x, max_points, method='lttb', shared=False):
+    """ Select the rows of a data frame to retain for each series (column) so that no series has more than
+    max_points points (see downsample_rows)
+
+    :param data: pandas DataFrame with numeric columns
+    :param x: numeric x values for each row (e.g. the result of template.get_data_index)
+    :param max_points: maximum number of points to retain for each series (or in total, if shared)
+    :param method: downsampling method; one of 'lttb' or 'minmax' (see downsample_rows)
+    :param shared: Whether or not all series must keep the same rows (see downsample_rows)
+    :return: List with a sorted array of row positions for each column, or None when data has max_points rows
+            or fewer or no numeric columns (i.e. every row is retained); columns that aren't numeric (e.g. strings)
+            can't be downsampled, so these keep every row (or the rows shared by all series, if shared)
+    """
+    if method not in METHODS:
+        raise ValueError('Downsampling method must be one of {} (not "{}")'.format(METHODS, method))
+    if max_points < 3:
+        raise ValueError('Maximum number of points must be at least 3 (not {})'.format(max_points))
+    numeric = [i for i, dtype in enumerate(data.dtypes) if getattr(dtype, 'kind', 'O') in 'biuf']
+    if len(data) <= max_points or not numeric:
+        return None
+
+    # Fall back on row positions when the index is not numeric
+    x = np.asarray(x)
+    x = x.astype(np.float64) if x.dtype.kind in 'iuf' else np.arange(len(data), dtype=np.float64)
+    y = np.array(data.iloc[:, numeric].values, dtype=np.float64)
+    selected = downsample_rows(x, y, max_points, method=method, shared=shared)
+    if len(numeric) == len(data.columns):
+        return selected
+    rows = [selected[0] if shared else np.arange(len(data))] * len(data.columns)
+    for i, col in enumerate(numeric):
+        rows[col] = selected[i]
+    return rows
@@ -0,0 +1,244 @@
+__author__ = 'eczech'
+
+import numpy as np
+import base64
+import json
+
+# Number of points formatted and written to an output buffer at one time; this bounds
+# the size of the intermediate strings built while encoding very long series
+CHUNK_SIZE = 65536
+
+
+def to_json_literals(values, precision=None):
+    """ Convert an array of values to an array of JSON literal strings
+
+    Numeric arrays are formatted in a single vectorized step and non-finite floats
+    (NaN, inf, -inf) are converted to null since they have no valid JSON representation
+    :param values: 1-D array-like of values to convert
+    :param precision: Number of significant digits floats are written with (all digits
+            necessary to represent each float exactly are written by default)
+    :return: numpy array of JSON literals (as strings) with the same length as values
+    """
+    values = np.asarray(values)
+    kind = values.dtype.kind
+    if kind in 'iu':
+        return values.astype(np.str_)
+    if kind == 'b':
+        return np.where(values, 'true', 'false')
+    if kind == 'f':
+        if precision is None:
+            literals = values.astype(np.str_)
+        else:
+            # Formatting a list of python floats is faster than any of numpy's vectorized string functions
+            fmt = '%.{}g'.format(precision)
+            literals = np.array([fmt % v for v in values.tolist()], dtype=object)
+        literals[~np.isfinite(values)] = 'null'
+        return literals
+
+    # Fall back on the json module for anything that isn't a plain number
+    def literal(v):
+        if isinstance(v, float) and not np.isfinite(v):
+            return 'null'
+        return json.dumps(v)
+    return np.array([literal(v) for v in values.tolist()], dtype=object)
+
+
+def write_points(output, x, y, point_format, precision=None):
+    """ Write a comma separated sequence of (x, y) points to the given buffer
+
+    Values are converted to JSON literals one chunk (of CHUNK_SIZE points) at a time, so the
+    intermediate strings never take up more memory than a single chunk requires
+    :param output: output buffer into which points will be written
+    :param x: array of x values
+    :param y: array of y values with the same length as x
+    :param point_format: format string for a single point containing two "%s" placeholders
+            for the x and y values respectively (e.g. '[%s,%s]' or '{"x":%s,"y":%s}')
+    :param precision: Number of significant digits for float y values (see to_json_literals)
+    """
+    x, y = np.asarray(x), np.asarray(y)
+    for start in range(0, len(y), CHUNK_SIZE):
+        stop = min(start + CHUNK_SIZE, len(y))
+
+        # Interleave x and y literals so that the whole chunk can be
+        # formatted by a single string operation
+        pairs = np.empty((stop - start, 2), dtype=object)
+        pairs[:, 0] = to_json_literals(x[start:stop])
+        pairs[:, 1] = to_json_literals(y[start:stop], precision)
+
+        if start > 0:
+            output.write(',')
+        output.write(','.join([point_format] * (stop - start)) % tuple(pairs.ravel()))
+
+
+def write_literals(output, values, precision=None):
+    """ Write a JSON array of values to the given buffer, converting them to literals one chunk at a time
+    :param output: output buffer into which the array will be written
+    :param values: 1-D array-like of values to write
+    :param precision: Number of significant digits for float values (see to_json_literals)
+    """
+    values = np.asarray(values)
+    output.write('[')
+    for start in range(0, len(values), CHUNK_SIZE):
+        if start > 0:
+            output.write(',')
+        output.write(','.join(to_json_literals(values[start:start + CHUNK_SIZE], precision)))
+    output.write(']')
+
+
+def _select(values, rows, i):
+    # Select the rows of an array to write for the i-th column (see write_series)
+    return np.asarray(values) if rows is None else np.asarray(values)[rows[i]]
+
+
+def _write_props(output, props):
+    # Write the properties of a series as the leading members of a JSON object (without the opening brace)
+    for k in sorted(props):
+        output.write('{}: {}, '.format(json.dumps(k), json.dumps(props[k])))
+
+
+def write_series(output, data, index, series_props, values_key, point_format, precision=None, rows=None):
+    """ Write a JSON array with one object per data frame column to the given buffer
+
+    Generates results in the form:
+        [{<series properties>, <values_key>: [<point>, <point>, ...]}, ...]
+
+    :param output: output buffer into which converted output will be written
+    :param data: pandas DataFrame to be converted
+    :param index: x values shared by all series (e.g. the result of template.get_data_index)
+    :param series_props: function taking a column name and returning a dictionary of (JSON serializable)
+            properties for the series associated with that column (e.g. {'key': col})
+    :param values_key: name of the series property containing the list of points
+    :param point_format: format string for a single point (see write_points)
+    :param precision: Number of significant digits for float values (see to_json_literals)
+    :param rows: List with an array of the positions of rows to write for each column (e.g. the result of
+            downsample.downsample_series); all rows are written by default
+    """
+    output.write('[')
+    for i, col in enumerate(data.columns):
+        if i > 0:
+            output.write(', ')
+        output.write('{')
+        _write_props(output, series_props(col))
+        output.write('{}: ['.format(json.dumps(values_key)))
+        x, y = _select(index, rows, i), _select(data.iloc[:, i].values, rows, i)
+        write_points(output, x, y, point_format, precision)
+        output.write(']}')
+    output.write(']')
+
+
+def write_columnar_series(output, data, index, series_props, precision=None, rows=None):
+    """ Write the index of a data frame once, followed by the values of each column, to the given buffer
+
+    Generates results in the form:
+        {
+            "format": "columnar",
+            "index": [<x>, <x>, ...],
+            "series": [{<series properties>, "values": [<y>, <y>, ...]}, ...]
+        }
+    which is much smaller than the output of write_series for frames with many columns since x values are
+    only written once (the "pylfer.expandSeries" function in templates/_payload.html converts this into the
+    same series objects written by write_series); if rows are given, each series has its own "index" instead
+
+    :param output: output buffer into which converted output will be written
+    :param data: pandas DataFrame to be converted
+    :param index: x values shared by all series (e.g. the result of template.get_data_index)
+    :param series_props: function taking a column name and returning a dictionary of series properties
+    :param precision: Number of significant digits for float values (see to_json_literals); this does not apply
+            to the index, for which full precision is always kept so that no two x values are ever merged
+    :param rows: List with an array of the positions of rows to write for each column (see write_series)
+    """
+    output.write('{"format": "columnar", "index": ')
+    write_literals(output, index if rows is None else [])
+    output.write(', "series": [')
+    for i, col in enumerate(data.columns):
+        if i > 0:
+            output.write(', ')
+        output.write('{')
+        _write_props(output, series_props(col))
+        if rows is not None:
+            output.write('"index": ')
+            write_literals(output, _select(index, rows, i))
+            output.write(', ')
+        output.write('"values": ')
+        write_literals(output, _select(data.iloc[:, i].values, rows, i), precision)
+        output.write('}')
+    output.write(']}')
+
+
+def _binary_type(values):
+    # Return the payload type name and little-endian numpy type for the given array,
+    # or None if the array can't be represented as a binary buffer
+    kind = values.dtype.kind
+    if kind in 'iub':
+        return 'int64', '<i8'
+    if kind == 'f':
+        return 'float64', '<f8'
+    return None
+
+
+def write_binary_array(output, values):
+    """ Write an array to the given buffer as a JSON object containing a base64 encoded binary buffer
+
+    Generates results in the form:
+        {"dtype": "float64", "data": "<base64 little-endian float64 values>"}
+    Integer and boolean arrays are written as int64 and all other numeric arrays as float64; arrays
+    of anything else (e.g. strings) are written as plain JSON lists with a dtype of "json"
+
+    :param output: output buffer into which converted output will be written
+    :param values: 1-D array-like of values to convert
+    """
+    values = np.asarray(values)
+    binary_type = _binary_type(values)
+    if binary_type is None:
+        output.write('{"dtype": "json", "data": ')
+        write_literals(output, values)
+        output.write('}')
+        return
+
+    output.write('{{"dtype": "{}", "data": "'.format(binary_type[0]))
+
+    # Encode a multiple of 3 values at a time so that every chunk is a multiple of 3 bytes long, meaning
+    # that base64 padding only ever appears at the end of the whole buffer (values are converted to the
+    # binary type a chunk at a time too, so that e.g. int32 columns are never copied as a whole)
+    step = CHUNK_SIZE * 3
+    for start in range(0, len(values), step):
+        chunk = values[start:start + step].astype(binary_type[1], copy=False)
+        output.write(base64.b64encode(chunk.tobytes()).decode('ascii'))
+    output.write('"}')
+
+
+def write_binary_series(output, data, index, series_props, rows=None):
+    """ Write the index and columns of a data frame to the given buffer as base64 encoded binary buffers
+
+    Generates results in the form:
+        {
+            "format": "binary",
+            "index": <binary array>,
+            "series": [{<series properties>, "values": <binary array>}, ...]
+        }
+    where each binary array is written by write_binary_array (the "pylfer.expandSeries" function
+    in templates/_payload.html converts these into the same series objects written by write_series);
+    if rows are given, each series has its own "index" instead
+
+    :param output: output buffer into which converted output will be written
+    :param data: pandas DataFrame to be converted
+    :param index: x values shared by all series (e.g. the result of template.get_data_index)
+    :param series_props: function taking a column name and returning a dictionary of series properties
+    :param rows: List with an array of the positions of rows to write for each column (see write_series)
+    """
+    output.write('{"format": "binary", "index": ')
+    write_binary_array(output, np.asarray(index) if rows is None else np.asarray(index)[:0])
+    output.write(', "series": [')
+    for i, col in enumerate(data.columns):
+        if i > 0:
+            output.write(', ')
+        output.write('{')
+        _write_props(output, series_props(col))
+        if rows is not None:
+            output.write('"index": ')
+            write_binary_array(output, _select(index, rows, i))
+            output.write(', ')
+        output.write('"values": ')
+        write_binary_array(output, _select(data.iloc[:, i].values, rows, i))
+        output.write('}')
+    output.write(']}')
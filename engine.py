@@ -1,8 +1,16 @@
 __author__ = 'eczech'
 
 from pylfer.template import NVD3LineChart, NVD3StackedAreaChart, HighchartsLineChart
-from pylfer.template import HighchartsConfigurableLineChart
+from pylfer.template import HighchartsConfigurableLineChart, HistogramHeatmaps
 from pylfer.template import has_date_index
+from pylfer.arrow import to_frame
+
+
+class _JobRecorder(object):
+    """ Stand-in for a VizManager that records render arguments instead of rendering anything """
+
+    def render(self, template, data, **kwargs):
+        return dict(kwargs, template=template, data=data)
 
 
 class VizEngine(object):
@@ -13,12 +21,15 @@ class VizEngine(object):
         """
         self.manager = manager
 
-    def nvd3_line_chart(self, data, fill_area_cols=None, date_format='%Y-%m-%d', height=400, width=1000, filename=None):
+    def nvd3_line_chart(self, data, fill_area_cols=None, date_format='%Y-%m-%d', height=400, width=1000, filename=None,
+                        max_points=None, downsample='lttb', payload='json', precision=None, live=False,
+                        poll_interval=5000):
         """ Render an NVD3 Line Chart "with Focus" or "Zoom"
 
         This template was created based on the example here: http://nvd3.org/examples/lineWithFocus.html
 
-        :param data: Data frame to be rendered
+        :param data: Data frame to be rendered; this can also be a pyarrow Table or RecordBatch, the path of a
+                Parquet or Feather file or an arrow.ArrowSource selecting columns from any of these (see arrow.to_frame)
         :param fill_area_cols (optional): Names of columns that should have the area under them filled; if a column
                 is not specified here, it will simply be plotted as a line instead of an area
         :param date_format (optional): Format for dates on x-axis, if x values are specified as dates
@@ -29,29 +40,51 @@ class VizEngine(object):
                 - if the filename does not have a .html suffix, one will be appended automatically
                 - the full path of the resulting file will be accessible in the IPython.display.HTML
                     instance returned as result.filename (it will be an absolute path and not just a name)
+        :param max_points (optional): Maximum number of points to render per series; series with more points than
+                this are downsampled (before being embedded in the template) in a way that preserves peaks and gaps
+        :param downsample (optional): Downsampling method used when max_points is exceeded; one of 'lttb'
+                (Largest-Triangle-Three-Buckets) or 'minmax' (minimum and maximum values within equal size buckets)
+        :param payload (optional): Format in which data is embedded in the resulting HTML; one of 'json',
+                'binary' (base64 encoded typed arrays, which are several times smaller and faster to load) or
+                'columnar' (JSON with x values written once rather than once per column, which is much smaller
+                for frames with many columns)
+        :param precision (optional): Number of significant digits to write y values with in 'json' and 'columnar'
+                payloads (e.g. 6); all digits are written by default
+        :param live (optional): Whether or not new rows can be appended to the resulting visualization later on
+                (see self.append); a filename must be given for this to apply
+        :param poll_interval (optional): How often, in milliseconds, live visualizations check for new rows
         :return: IPython.display.HTML instance containing plot content (and the absolute path of the resulting
                 HTML render if a filename was specified)
         """
-        viz = NVD3LineChart(fill_area_cols=fill_area_cols)
+        data = to_frame(data)
+        viz = NVD3LineChart(
+            fill_area_cols=fill_area_cols, max_points=max_points, downsample=downsample, payload=payload,
+            precision=precision
+        )
         props = {
             'transform': viz.transform,
             'date_format': date_format,
             'filename': filename,
             'height': height,
             'width': width,
+            'live': live,
+            'poll_interval': poll_interval,
             # Set a flag for the template indicating whether or not the x-axis is a date or number
             'x_is_date': has_date_index(data)
         }
         return self.manager.render(viz.get_template(), data, **props)
 
-    def nvd3_stacked_area_chart(self, data, date_format='%Y-%m-%d', height=400, width=1000, filename=None):
+    def nvd3_stacked_area_chart(self, data, date_format='%Y-%m-%d', height=400, width=1000, filename=None,
+                                max_points=None, downsample='lttb', payload='json', precision=None, live=False,
+                                poll_interval=5000):
         """ Render an NVD3 Stacked Area Chart
 
         This template was created based on the example here: http://nvd3.org/examples/stackedArea.html
 
         It includes radio options to switch between stacked area, streamgraph, and relative area plots
 
-        :param data: Data frame to be rendered
+        :param data: Data frame to be rendered; this can also be a pyarrow Table or RecordBatch, the path of a
+                Parquet or Feather file or an arrow.ArrowSource selecting columns from any of these (see arrow.to_frame)
         :param date_format (optional): Format for dates on x-axis, if x values are specified as dates
         :param height (optional): Height of the resulting visualization
         :param width (optional): Width of the resulting visualization
@@ -60,28 +93,47 @@ class VizEngine(object):
                 - if the filename does not have a .html suffix, one will be appended automatically
                 - the full path of the resulting file will be accessible in the IPython.display.HTML
                     instance returned as result.filename (it will be an absolute path and not just a name)
+        :param max_points (optional): Maximum number of points to render per series; series with more points than
+                this are downsampled (before being embedded in the template) in a way that preserves peaks and gaps
+        :param downsample (optional): Downsampling method used when max_points is exceeded; one of 'lttb'
+                (Largest-Triangle-Three-Buckets) or 'minmax' (minimum and maximum values within equal size buckets)
+        :param payload (optional): Format in which data is embedded in the resulting HTML; one of 'json',
+                'binary' (base64 encoded typed arrays, which are several times smaller and faster to load) or
+                'columnar' (JSON with x values written once rather than once per column, which is much smaller
+                for frames with many columns)
+        :param precision (optional): Number of significant digits to write y values with in 'json' and 'columnar'
+                payloads (e.g. 6); all digits are written by default
+        :param live (optional): Whether or not new rows can be appended to the resulting visualization later on
+                (see self.append); a filename must be given for this to apply
+        :param poll_interval (optional): How often, in milliseconds, live visualizations check for new rows
         :return: IPython.display.HTML instance containing plot content (and the absolute path of the resulting
                 HTML render if a filename was specified)
         """
-        viz = NVD3StackedAreaChart()
+        data = to_frame(data)
+        viz = NVD3StackedAreaChart(max_points=max_points, downsample=downsample, payload=payload, precision=precision)
         props = {
             'transform': viz.transform,
             'date_format': date_format,
             'filename': filename,
             'height': height,
             'width': width,
+            'live': live,
+            'poll_interval': poll_interval,
             # Set a flag for the template indicating whether or not the x-axis is a date or number
             'x_is_date': has_date_index(data)
         }
         return self.manager.render(viz.get_template(), data, **props)
 
 
-    def hc_line_chart(self, data, date_format='%Y-%m-%d', height=400, width=1000, filename=None):
+    def hc_line_chart(self, data, date_format='%Y-%m-%d', height=400, width=1000, filename=None,
+                      max_points=None, downsample='lttb', payload='json', precision=None, live=False,
+                      poll_interval=5000):
         """ Renders a Highcharts Line Chart
 
         This template was created based on the example here: http://nvd3.org/examples/stackedArea.html
 
-        :param data: Data frame to be rendered
+        :param data: Data frame to be rendered; this can also be a pyarrow Table or RecordBatch, the path of a
+                Parquet or Feather file or an arrow.ArrowSource selecting columns from any of these (see arrow.to_frame)
         :param date_format (optional): Format for dates on x-axis, if x values are specified as dates
         :param height (optional): Height of the resulting visualization
         :param width (optional): Width of the resulting visualization
@@ -90,16 +142,32 @@ class VizEngine(object):
                 - if the filename does not have a .html suffix, one will be appended automatically
                 - the full path of the resulting file will be accessible in the IPython.display.HTML
                     instance returned as result.filename (it will be an absolute path and not just a name)
+        :param max_points (optional): Maximum number of points to render per series; series with more points than
+                this are downsampled (before being embedded in the template) in a way that preserves peaks and gaps
+        :param downsample (optional): Downsampling method used when max_points is exceeded; one of 'lttb'
+                (Largest-Triangle-Three-Buckets) or 'minmax' (minimum and maximum values within equal size buckets)
+        :param payload (optional): Format in which data is embedded in the resulting HTML; one of 'json',
+                'binary' (base64 encoded typed arrays, which are several times smaller and faster to load) or
+                'columnar' (JSON with x values written once rather than once per column, which is much smaller
+                for frames with many columns)
+        :param precision (optional): Number of significant digits to write y values with in 'json' and 'columnar'
+                payloads (e.g. 6); all digits are written by default
+        :param live (optional): Whether or not new rows can be appended to the resulting visualization later on
+                (see self.append); a filename must be given for this to apply
+        :param poll_interval (optional): How often, in milliseconds, live visualizations check for new rows
         :return: IPython.display.HTML instance containing plot content (and the absolute path of the resulting
                 HTML render if a filename was specified)
         """
-        viz = HighchartsLineChart()
+        data = to_frame(data)
+        viz = HighchartsLineChart(max_points=max_points, downsample=downsample, payload=payload, precision=precision)
         props = {
             'transform': viz.transform,
             'date_format': date_format,
             'filename': filename,
             'height': height,
             'width': width,
+            'live': live,
+            'poll_interval': poll_interval,
             # Set a flag for the template indicating whether or not the x-axis is a date or number
             'x_is_date': has_date_index(data)
         }
@@ -110,7 +178,8 @@ class VizEngine(object):
 
         This template was created based on the example here: http://nvd3.org/examples/stackedArea.html
 
-        :param data: Data frame to be rendered
+        :param data: Data frame to be rendered; this can also be a pyarrow Table or RecordBatch, the path of a
+                Parquet or Feather file or an arrow.ArrowSource selecting columns from any of these (see arrow.to_frame)
         :param opts: List of javascript options to pass to template for visualization configuration; e.g.:
                     [
                         '.title("Benefitfocus Platform (eE, eB, HRiT) Consumer Growth")',
@@ -128,6 +197,7 @@ class VizEngine(object):
         :return: IPython.display.HTML instance containing plot content (and the absolute path of the resulting
                 HTML render if a filename was specified)
         """
+        data = to_frame(data)
         viz = HighchartsConfigurableLineChart()
         props = {
             'transform': viz.transform,
@@ -137,3 +207,108 @@ class VizEngine(object):
             'options': '\n\t'.join(opts) if opts else ''
         }
         return self.manager.render(viz.get_template(), data, **props)
+
+    def histogram_heatmaps(self, hists, color_scale='linear', cell_size=40, filename=None, payload='json'):
+        """ Render a grid of D3 heatmaps for histograms returned by utilities.get_histograms
+
+        This is a lightweight alternative to utilities.plot_histograms that draws every histogram in a single page
+
+        :param hists: Dictionary of histogram frames returned from utilities.get_histograms
+        :param color_scale (optional): Scale used to color counts; one of 'linear' or 'log'
+        :param cell_size (optional): Width and height of each heatmap cell, in pixels
+        :param filename (optional): Name of html file in which to store the resulting visualization:
+                - if no filename is given, the plot will not be saved and only its content returned
+                - if the filename does not have a .html suffix, one will be appended automatically
+                - the full path of the resulting file will be accessible in the IPython.display.HTML
+                    instance returned as result.filename (it will be an absolute path and not just a name)
+        :param payload (optional): Format in which counts are embedded in the resulting HTML; one of 'json' or
+                'binary' (base64 encoded typed arrays)
+        :return: IPython.display.HTML instance containing plot content (and the absolute path of the resulting
+                HTML render if a filename was specified)
+        """
+        if color_scale not in ('linear', 'log'):
+            raise ValueError('Color scale must be one of "linear" or "log" (not "{}")'.format(color_scale))
+        viz = HistogramHeatmaps(payload=payload)
+        props = {
+            'transform': viz.transform,
+            'filename': filename,
+            'color_scale': color_scale,
+            'cell_size': cell_size
+        }
+        return self.manager.render(viz.get_template(), hists, **props)
+
+    def batch(self, specs, n_jobs=None, executor='process', share_data='mmap'):
+        """ Render many charts in parallel
+
+        :param specs: List of chart specifications, each of which is a dictionary containing the name of the
+                VizEngine method used to render the chart as 'chart' along with all arguments for that method; e.g.
+                    [
+                        {'chart': 'nvd3_line_chart', 'data': df1, 'filename': 'chart1', 'max_points': 5000},
+                        {'chart': 'hc_line_chart', 'data': df2, 'height': 600}
+                    ]
+        :param n_jobs (optional): Number of workers to use (defaults to the number of CPUs)
+        :param executor (optional): Type of worker pool to use; one of 'process' or 'thread'
+        :param share_data (optional): Method used to send data frames to worker processes (see VizManager.render_many)
+        :return: List of results (as would be returned by the individual chart methods) in the same order as
+                the given specs; charts that fail to render have a batch.RenderError in place of their result
+        """
+        jobs = _record_jobs(specs)
+        return self.manager.render_many(jobs, n_jobs=n_jobs, executor=executor, share_data=share_data)
+
+    def render_async(self, spec):
+        """ Render a single chart without blocking the event loop (requires an aio.AsyncVizManager)
+
+        :param spec: Chart specification; a dictionary containing the name of the VizEngine method used to render
+                the chart as 'chart' along with all arguments for that method (see self.batch)
+        :return: Coroutine returning the result of the chart method
+        """
+        return self.manager.render_async(**_record_jobs([spec])[0])
+
+    def append(self, chart, data, filename, since=None, **kwargs):
+        """ Append new rows to a live chart (one created with live=True) without rendering it again
+
+        :param chart: Name of the VizEngine method used to create the chart (e.g. 'nvd3_line_chart')
+        :param data: Data frame containing new rows (rows already in the chart are ignored; see VizManager.append),
+                which can also be given as Arrow data (see arrow.to_frame)
+        :param filename: Name of html file containing the chart
+        :param since (optional): Only rows with an index value greater than this are appended; defaults to
+                the index value of the last row already in the chart
+        :param kwargs: Any other arguments given to the chart method when the chart was created that determine
+                how its data is encoded (e.g. payload, max_points)
+        :return: Number of rows appended
+        """
+        data = to_frame(data)
+        job = _record_jobs([dict(kwargs, chart=chart, data=data, filename=filename)])[0]
+        return self.manager.append(filename, data, transform=job['transform'], since=since)
+
+    def dashboard(self, specs, filename=None, title=None, lazy=True):
+        """ Render many charts into a single page
+
+        Every library used by the charts is loaded once by the page rather than once per chart, and charts are
+        only drawn once scrolled into view (see VizManager.render_dashboard)
+
+        :param specs: List of chart specifications, each of which is a dictionary containing the name of the
+                VizEngine method used to render the chart as 'chart' along with all arguments for that method (see
+                self.batch); charts are laid out in the order given, with the width and height of each
+        :param filename (optional): Name of html file in which to store the resulting dashboard (see
+                self.nvd3_line_chart)
+        :param title (optional): Title for dashboard
+        :param lazy (optional): Whether or not to wait until charts are scrolled into view before drawing them
+        :return: IPython.display.HTML instance containing dashboard content (and the absolute path of the resulting
+                HTML render if a filename was specified)
+        """
+        return self.manager.render_dashboard(_record_jobs(specs), filename=filename, title=title, lazy=lazy)
+
+
+def _record_jobs(specs):
+    # Convert chart specifications into render arguments for each chart (see VizEngine.batch)
+    recorder = VizEngine(_JobRecorder())
+    jobs = []
+    for spec in specs:
+        spec = dict(spec)
+        chart = spec.pop('chart', None)
+        invalid = chart is None or chart.startswith('_') or chart in ('batch', 'dashboard', 'append', 'render_async')
+        if invalid or not hasattr(recorder, chart):
+            raise ValueError('"{}" is not a valid chart type'.format(chart))
+        jobs.append(getattr(recorder, chart)(**spec))
+    return jobs
@@ -0,0 +1,161 @@
+__author__ = 'eczech'
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import importlib
+import threading
+import timeit
+
+# Modes in which a profile can be captured for each render (see VizManager.configure)
+PROFILE_MODES = ('cprofile', 'tracemalloc')
+
+# Statistics for the render in progress in each thread, if it is being instrumented
+_local = threading.local()
+
+
+class RenderStats(object):
+    """ Timings, sizes and (optionally) a profile recorded for a single render
+
+    Timings are kept per stage of the render pipeline, in seconds, in the order stages first ran.  Stages
+    can be nested within one another (e.g. 'index' and 'encode' are part of 'transform') and stages run
+    more than once (e.g. 'url' for renders referencing separate data files) have their times added up:
+        - 'total': the entire render
+        - 'prepare': writing data files and computing cache keys (see VizManager.configure)
+        - 'transform': conversion of the data frame into the payload embedded in the template, of which
+            'downsample', 'index' (date index conversion) and 'encode' (JSON or binary encoding) are parts
+        - 'saturate': template rendering
+        - 'assets': bundling or inlining libraries
+        - 'write': writing the render to disk (or streaming it, in which case this includes everything else)
+        - 'url': conversion of file paths to URLs
+    """
+
+    def __init__(self, template, filename=None):
+        """ Create empty statistics for a render
+        :param template: Name of template rendered
+        :param filename: Name of file render was saved in, if any
+        """
+        self.template = template
+        self.filename = filename
+        self.timings = OrderedDict()
+        self.rows = None
+        self.points = None
+        self.payload_bytes = None
+        self.html_bytes = None
+        self.cached = False
+        self.peak_memory = None
+        self.profile = None
+
+    @contextmanager
+    def stage(self, name):
+        """ Time a stage of the render (see class description for names of stages) """
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.) + timeit.default_timer() - start
+
+    def as_dict(self):
+        """ Convert statistics (other than any profile) to a dictionary, e.g. to send to a metrics system
+        :return: Dictionary with keys 'template', 'filename', 'rows', 'points', 'payload_bytes', 'html_bytes',
+                'cached', 'peak_memory' and 'timings' (itself a dictionary of times in seconds by stage)
+        """
+        return {
+            'template': self.template, 'filename': self.filename, 'rows': self.rows, 'points': self.points,
+            'payload_bytes': self.payload_bytes, 'html_bytes': self.html_bytes, 'cached': self.cached,
+            'peak_memory': self.peak_memory, 'timings': dict(self.timings)
+        }
+
+    def __repr__(self):
+        timings = ', '.join('{}={:.4f}s'.format(k, v) for k, v in self.timings.items())
+        return 'RenderStats(template={}, rows={}, points={}, payload_bytes={}, html_bytes={}, {})'.format(
+            self.template, self.rows, self.points, self.payload_bytes, self.html_bytes, timings
+        )
+
+
+def current():
+    """ Get statistics for the render in progress in this thread (or None if it isn't being instrumented) """
+    return getattr(_local, 'stats', None)
+
+
+@contextmanager
+def stage(name):
+    """ Time a stage of the render in progress in this thread (this does nothing if it isn't being instrumented) """
+    stats = current()
+    if stats is None:
+        yield
+    else:
+        with stats.stage(name):
+            yield
+
+
+def check_profile_mode(profile):
+    """ Validate a profile mode, making sure whatever it needs is available
+    :param profile: One of PROFILE_MODES or None
+    """
+    if profile is None:
+        return
+    if profile not in PROFILE_MODES:
+        raise ValueError('Profile mode must be one of {} (not "{}")'.format(PROFILE_MODES, profile))
+    if profile == 'tracemalloc':
+        try:
+            importlib.import_module('tracemalloc')
+        except ImportError:
+            raise ValueError('Profile mode "tracemalloc" requires python 3.4+')
+
+
+@contextmanager
+def bind(stats):
+    """ Record the stages run in this thread as part of the given render, e.g. for renders whose work is split
+    between several threads (see aio.AsyncVizManager); unlike instrument, this records no total or profile
+    :param stats: RenderStats to record timings and sizes in (or None to record nothing)
+    """
+    outer, _local.stats = current(), stats
+    try:
+        yield stats
+    finally:
+        _local.stats = outer
+
+
+@contextmanager
+def instrument(stats, profile=None):
+    """ Record statistics for the render made within this context, capturing a profile if requested
+
+    :param stats: RenderStats to record timings and sizes in
+    :param profile: Type of profile to capture; one of:
+            - None: no profile is captured
+            - 'cprofile': a pstats.Stats instance for the render is set as stats.profile
+            - 'tracemalloc': the peak memory allocated by the render is set as stats.peak_memory and a
+                tracemalloc.Snapshot taken at the end of the render (before anything is freed) as stats.profile
+    """
+    outer, _local.stats = current(), stats
+    profiler, started = None, False
+    try:
+        if profile == 'cprofile':
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif profile == 'tracemalloc':
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started = True
+            elif hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+
+        with stats.stage('total'):
+            yield stats
+
+        if profiler is not None:
+            profiler.disable()
+            import pstats
+            stats.profile = pstats.Stats(profiler)
+        elif profile == 'tracemalloc':
+            stats.peak_memory = tracemalloc.get_traced_memory()[1] - baseline
+            stats.profile = tracemalloc.take_snapshot()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        if started:
+            tracemalloc.stop()
+        _local.stats = outer
@@ -1,13 +1,93 @@
 __author__ = 'eczech'
 
-from jinja2 import Environment, FileSystemLoader, TemplateNotFound
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, TemplateNotFound, meta
 from pylfer.template import default_transform
-from IPython.display import HTML, IFrame
-from StringIO import StringIO
+from pylfer.cache import RenderCache, hash_data, describe
+from pylfer.batch import FrameRef, RenderError, render_job, split_transform, capture
+from pylfer.compression import CompressedWriter, TeeWriter, compressed_path, read_compressed
+from pylfer.instrument import RenderStats, instrument, stage, current, check_profile_mode
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 import tempfile
+import shutil
+import json
+import uuid
+import re
 import os
 
 
+# Template environments shared by all managers in this process, keyed by template path
+# and bytecode cache directory, so that each template is only ever compiled once
+_environments = {}
+
+
+def _get_environment(template_path, bytecode_dir):
+    key = (os.path.abspath(template_path), bytecode_dir and os.path.abspath(bytecode_dir))
+    if key not in _environments:
+        bytecode_cache = FileSystemBytecodeCache(bytecode_dir) if bytecode_dir else None
+        _environments[key] = Environment(loader=FileSystemLoader(template_path), bytecode_cache=bytecode_cache)
+    return _environments[key]
+
+
+# Names of the variables each template refers to, keyed by template file and modification time
+_template_variables = {}
+
+
+def _get_variables(env, template):
+    # Parse a template to find the variables it refers to (e.g. to check that it supports "data_url")
+    filename = template.filename
+    key = (filename, os.path.getmtime(filename) if filename and os.path.exists(filename) else None)
+    if key not in _template_variables:
+        source = env.loader.get_source(env, template.name)[0]
+        _template_variables[key] = meta.find_undeclared_variables(env.parse(source))
+    return _template_variables[key]
+
+
+# Names of the templates each template refers to, keyed by template file and modification time
+_template_references = {}
+
+
+def _get_dependencies(env, template_path, name):
+    # Find the modification time of a template and of every template it refers to (through include, extends,
+    # import, etc.), directly or indirectly, or None if any of these are only known when rendering
+    found, pending = {}, [name]
+    while pending:
+        name = pending.pop()
+        if name in found:
+            continue
+        path = os.path.join(template_path, name)
+        found[name] = os.path.getmtime(path) if os.path.exists(path) else None
+        key = (path, found[name])
+        if key not in _template_references:
+            source = env.loader.get_source(env, name)[0] if found[name] is not None else ''
+            _template_references[key] = list(meta.find_referenced_templates(env.parse(source)))
+        if None in _template_references[key]:
+            return None
+        pending.extend(_template_references[key])
+    return sorted(found.items())
+
+
+# Ways in which libraries referenced by templates can be included in renders (see VizManager.configure)
+ASSET_MODES = ('link', 'bundle', 'inline')
+
+# Patterns matching script elements sourced from a file and stylesheet links
+_SCRIPT_PATTERN = re.compile(r'<script\b([^>]*?)\bsrc="([^"]*)"([^>]*)>\s*</script>', re.DOTALL)
+_LINK_PATTERN = re.compile(r'<link\b[^>]*\brel="stylesheet"[^>]*>')
+_HREF_PATTERN = re.compile(r'\bhref="([^"]*)"')
+
+# Pattern matching each script, stylesheet link and style element within the asset block of a template
+_ASSET_PATTERN = re.compile(r'<script\b.*?</script>|<link\b[^>]*>|<style\b.*?</style>', re.DOTALL)
+
+
+def _skip_transform(data, output):
+    # Transform used for templates with externalized data (see VizManager.save_data)
+    pass
+
+
 class VizManager(object):
     """ D3 visualization renderer and manager
 
@@ -23,9 +103,22 @@ class VizManager(object):
         :param template_path: Absolute path to HTML template files
         :param render_path: Absolute path under which rendered results will be stored
         """
+        self.bytecode_dir = None
         self.configure(template_path=template_path, render_path=render_path)
         self.url_converter = None
         self.template_params = None
+        self.render_cache = None
+        self.streaming = False
+        self.data_files = False
+        self.compression = None
+        self.compression_level = 6
+        self.compression_only = False
+        self.display = True
+        self.assets = 'link'
+        self._asset_cache = {}
+        self.on_render = None
+        self.profile = None
+        self.last_stats = None
 
     @staticmethod
     def _validate_dir(path):
@@ -44,7 +137,10 @@ class VizManager(object):
             filename += extension
         return filename
 
-    def configure(self, template_path=None, render_path=None, url_converter=None, template_params=None):
+    def configure(self, template_path=None, render_path=None, url_converter=None, template_params=None,
+                  cache_memory_bytes=None, cache_disk_bytes=None, stream=None, data_files=None,
+                  compression=None, compression_level=None, compression_only=None, bytecode_cache=None,
+                  display=None, assets=None, on_render=None, profile=None):
         """ Set properties of the visualization manager
 
         :param template_path: Absolute path to HTML template files
@@ -58,24 +154,116 @@ class VizManager(object):
                     'js_d3' : 'https://cdn.rawgit.com/mbostock/d3/master/d3.min.js',
                     'js_jquery' : 'https://ajax.googleapis.com/ajax/libs/jquery/2.1.3/jquery.min.js'
                 }" but it could also be used for any other shared settings for all template renders
+        :param cache_memory_bytes: Maximum size of renders to keep in an in-memory cache; setting this (or
+                cache_disk_bytes) enables caching of renders so that repeated calls with the same data, template
+                and parameters skip transformation and saturation entirely
+        :param cache_disk_bytes: Maximum size of renders to keep in an on-disk cache (stored under render_path)
+        :param stream: Whether or not renders saved to a file should be streamed to that file rather than
+                being built as strings in memory first (see self.stream); this is recommended for large data
+        :param data_files: Whether or not data for renders saved to a file should be written to a separate,
+                content-addressed file (see self.save_data) that the template fetches by URL instead of being
+                inlined into the HTML; identical data is only ever written once and shared between renders
+                (templates must support the "data_url" parameter for this, so rendering any other template to a
+                file raises a ValueError while this is enabled)
+        :param compression: Compression method used to write a precompressed copy of every render saved to a
+                file alongside that file (e.g. "my_chart.html.gz" next to "my_chart.html"); one of 'gzip' or
+                'brotli' (requires the brotli package), or False to disable compression
+        :param compression_level: Compression level (1-9 for gzip, 0-11 for brotli; defaults to 6)
+        :param compression_only: Whether or not to write only the compressed copy of each render; note that
+                results still refer to the uncompressed path (and URL) so a web server capable of serving
+                precompressed files in its place is necessary for these to be viewable (e.g. nginx gzip_static)
+        :param bytecode_cache: Directory in which compiled templates are cached so that other processes (e.g. short
+                lived scripts or batch workers) can load them without parsing and compiling them again; True will use
+                a directory under the render path and False disables the cache (see also self.precompile)
+        :param display: Whether or not to return renders as IPython display objects; if False, renders are returned
+                as HTML strings or, for renders saved to a file, as the path of that file (IPython is not needed and
+                is never imported in this case)
+        :param assets: How libraries (scripts and stylesheets) referenced by templates are included in renders;
+                one of:
+                - 'link': renders reference libraries wherever templates point to them (e.g. js_lib_root)
+                - 'bundle': local libraries are copied once, under content-hashed names, to an "assets" directory
+                    under the render path that renders saved to files then reference instead
+                - 'inline': the content of local libraries is embedded in renders so that each is self-contained
+                (remote libraries, e.g. those on CDNs, are always referenced rather than bundled or inlined)
+        :param on_render: Function called with an instrument.RenderStats instance after each render (see self.render),
+                containing the time taken by each stage of the render along with the number of rows and points
+                rendered and the size of the data payload and of the render itself (e.g. to send to a metrics system);
+                setting this (or profile) enables instrumentation, and False disables the hook again
+        :param profile: Type of profile to capture for each render, set on the statistics passed to on_render (and
+                kept in self.last_stats); one of 'cprofile', 'tracemalloc' (python 3 only) or False to disable
+                profiling (see instrument.instrument)
         :return self
         """
         if url_converter:
             self.url_converter = url_converter
         if template_path:
             VizManager._validate_dir(template_path)
-            self.env = Environment(loader=FileSystemLoader(template_path))
             self.template_path = template_path
         if render_path:
             VizManager._validate_dir(render_path)
             self.render_path = render_path
+        if bytecode_cache is not None:
+            if bytecode_cache is True:
+                bytecode_cache = os.path.join(self.render_path, '.pylfer_bytecode')
+            if bytecode_cache:
+                VizManager._validate_dir(bytecode_cache)
+            self.bytecode_dir = bytecode_cache or None
+        if template_path or bytecode_cache is not None:
+            self.env = _get_environment(self.template_path, self.bytecode_dir)
         if template_params:
             if not type(template_params) is dict:
                 raise ValueError('Template params value must be a dictionary')
             self.template_params = template_params
+        if cache_memory_bytes is not None or cache_disk_bytes is not None:
+            self.render_cache = RenderCache(
+                os.path.join(self.render_path, '.pylfer_cache'),
+                max_memory_bytes=cache_memory_bytes or 0,
+                max_disk_bytes=cache_disk_bytes or 0
+            )
+        if stream is not None:
+            self.streaming = stream
+        if data_files is not None:
+            self.data_files = data_files
+        if compression is not None:
+            self.compression = compression or None
+        if compression_level is not None:
+            self.compression_level = compression_level
+        if compression_only is not None:
+            self.compression_only = compression_only
+        if display is not None:
+            self.display = display
+        if assets is not None:
+            if assets not in ASSET_MODES:
+                raise ValueError('Asset mode must be one of {} (not "{}")'.format(ASSET_MODES, assets))
+            self.assets = assets
+        if on_render is not None:
+            self.on_render = on_render or None
+        if profile is not None:
+            check_profile_mode(profile or None)
+            self.profile = profile or None
         return self
 
-    def render(self, template, data, transform=DEFAULT_DATA_TRANSFORM, filename=None, **kwargs):
+    def _cache_key(self, template, data, transform, filename, kwargs):
+        # Key renders on everything that can change their content: the data itself, the template (including
+        # its modification time and those of any templates it includes), the transform and all template
+        # parameters (renders are never cached if the templates included, the transform or the parameters
+        # can't be determined reliably),
+        # along with how libraries are included since streamed renders are cached with libraries
+        # already bundled or inlined, relative to the directory they were saved in
+        assets = self.assets
+        if filename and assets != 'link':
+            assets += ':' + os.path.dirname(self._resolve_filename(filename))
+        template = VizManager._ensure_extension(template, '.html')
+        dependencies = _get_dependencies(self.env, self.template_path, template)
+        params = dict(kwargs)
+        if self.template_params:
+            params.update(self.template_params)
+        transform, params = describe(transform), describe(params)
+        if dependencies is None or transform is None or params is None:
+            return None
+        return RenderCache.key(hash_data(data), template, repr(dependencies), transform, params, assets)
+
+    def render(self, template, data, transform=DEFAULT_DATA_TRANSFORM, filename=None, live=False, **kwargs):
         """ Renders a visualization by saturating the given template with the given data
 
         :param template: Name of template to saturate (e.g. 'streamgraph', 'stacked_bar', etc.)
@@ -89,34 +277,534 @@ class VizManager(object):
                     - Name given will be appended to configured render path unless a full path is given,
                       in which case that path will be used instead (i.e. a string with no slashes)
                     - If no filename is specified, the render will not be saved on disk and will instead
-                      be returned as an IPython.display.HTML instance sourced from a raw string
+                      be returned as an IPython.display.HTML instance sourced from a raw string (or as the
+                      raw string itself if display is disabled; see self.configure)
                     - If no .html extension is provided in the file name, one will be added automatically
+                    - If streaming is enabled (see self.configure), the render is written to the file
+                      incrementally without ever being held in memory as a whole
+        :param live: Whether or not rows can be appended to the render later on (see self.append); this only
+                applies to renders saved to a file and the template must support the "delta_url" parameter
         :param kwargs: Arguments for the template (e.g. data, date format, title, etc.)
-        :return: IPython.display.HTML instance containing visualization
+        :return: IPython.display.HTML instance containing visualization (or the HTML content or path of the
+                file containing it if display is disabled)
         """
-        string_data = StringIO()
-        transform(data, string_data)
-        html = self.saturate(template, data=string_data.getvalue(), **kwargs)
+        with self._instrumented(template, data, filename):
+            with stage('prepare'):
+                transform, key, kwargs = self._prepare(template, data, transform, filename, live, kwargs)
+            return self._render_prepared(template, data, transform, filename, key, kwargs)
+
+    @contextmanager
+    def _instrumented(self, template, data, filename):
+        # Record statistics for a render and pass them to the configured hook, if instrumentation is enabled
+        if not self._instrumenting():
+            yield
+            return
+        stats = RenderStats(template, filename)
+        with instrument(stats, profile=self.profile):
+            yield
+        self._report(stats, data)
+
+    def _instrumenting(self):
+        return self.on_render is not None or self.profile is not None
+
+    def _report(self, stats, data):
+        # Count everything in the frame given unless the transform reported how much it embedded (e.g. after
+        # downsampling) or didn't run at all; the data for some visualizations (e.g. histograms) isn't a frame
+        if hasattr(data, 'shape') and len(data.shape) == 2:
+            stats.rows = data.shape[0]
+            if stats.points is None and not stats.cached:
+                stats.points = data.shape[0] * data.shape[1]
+        self.last_stats = stats
+        if self.on_render is not None:
+            self.on_render(stats)
+
+    def _prepare(self, template, data, transform, filename, live, kwargs):
+        # Set up any files a render depends on and determine its cache key, returning the
+        # transform and template arguments to use in place of those originally given
 
+        # Create an empty file for rows appended to the render later on, if necessary
+        if filename and live:
+            kwargs = self._start_live(data, filename, kwargs)
+
+        # Write data to a separate file referenced by the template, if configured to do so
+        if filename and self.data_files:
+            transform, kwargs = self._externalize_data(template, data, transform, filename, kwargs)
+
+        # Check for an identical render in the cache (if enabled) before doing any work
+        key = self._cache_key(template, data, transform, filename, kwargs) if self.render_cache is not None else None
+        return transform, key, kwargs
+
+    def _render_prepared(self, template, data, transform, filename, key, kwargs):
         # Save the content to a file if a filename was provided
         # and return an HTML instance sourced form the saved location;
         # If no filename was given, return the raw HTML content as a string
         if filename:
-            filename = self.save(html, filename)
-            # If a url converter was configured, attempt to instead render the
-            # HTML within an IFrame (usually much better for IPython Notebooks)
-            if self.url_converter:
-                url = self.url_converter(filename)
-            # If a valid URL was returned, wrap it in an IFrame
-            if url:
-                html = IFrame(src=url, width=kwargs.get('width', 1000), height=kwargs.get('height', 400))._repr_html_ ()
-                html = HTML(data=html)    # Create an HTML instance with a raw string but also set the original file
-                html.filename = filename  # path even though it wasn't technically used to source the content
-                return html
+            path = self._resolve_filename(filename)
+
+            # Skip the write if this exact render was already saved to the same file
+            if key is not None and self.render_cache.is_saved(key, self._stored_path(path)):
+                filename = path
+                if current() is not None:
+                    current().cached = True
+            elif self.streaming:
+                filename = self._stream_cached(template, data, transform, path, key, kwargs)
+            else:
+                filename = self.save(self._render_cached(template, data, transform, key, kwargs), path)
+            if key is not None:
+                self.render_cache.mark_saved(key, self._stored_path(filename))
+            return self._display_file(filename, kwargs)
+        else:
+            return self._display_html(self._rewrite_assets(self._render_cached(template, data, transform, key, kwargs)))
+
+    def render_many(self, jobs, n_jobs=None, executor='process', share_data='mmap'):
+        """ Render many visualizations in parallel
+
+        Data transformation and template saturation (the expensive parts of any render) are run in a pool of
+        worker processes or threads while saving results and wrapping them for display happens in this process
+
+        :param jobs: List of dictionaries containing arguments for self.render (e.g.
+                [{'template': 'nvd3_line_zoom', 'data': df, 'filename': 'my_chart', 'height': 400}, ...])
+        :param n_jobs: Number of workers to use (defaults to the number of CPUs)
+        :param executor: Type of worker pool to use; one of 'process' or 'thread'
+        :param share_data: Method used to send data frames to worker processes; one of:
+                - 'mmap': columns are written once (per distinct frame) to .npy files that workers memory-map
+                    rather than having frames pickled and piped to every worker
+                - 'pickle': frames are pickled along with each job
+                (this has no effect when using threads since workers share memory with this process)
+        :return: List of results (as would be returned by self.render) in the same order as the given jobs;
+                jobs that fail have a batch.RenderError in place of their result instead of failing the batch
+        """
+        import pandas as pd
+        if executor == 'process':
+            Executor = ProcessPoolExecutor
+            config = self._process_config()
+        elif executor == 'thread':
+            Executor = ThreadPoolExecutor
+            config = self
+        else:
+            raise ValueError('Executor must be one of "process" or "thread" (not "{}")'.format(executor))
+        if share_data not in ('mmap', 'pickle'):
+            raise ValueError('Data sharing method must be one of "mmap" or "pickle" (not "{}")'.format(share_data))
+
+        specs, results, refs = [None] * len(jobs), [None] * len(jobs), {}
+        data_dir = tempfile.mkdtemp(prefix='pylfer_batch_', dir=self.render_path)
+        try:
+            with Executor(max_workers=n_jobs) as pool:
+                futures = {}
+                for i, job in enumerate(jobs):
+                    # Work done for a job in this process fails only that job, as it does in workers
+                    prepared = capture(i, self._prepare_job, job)
+                    if isinstance(prepared, RenderError):
+                        results[i] = prepared
+                        continue
+                    template, data, transform, filename, key, kwargs = prepared
+                    specs[i] = (filename, key, kwargs)
+
+                    # Renders already in the cache need no further work
+                    if key is not None and self.render_cache.get(key) is not None:
+                        results[i] = capture(i, self._render_prepared, template, data, transform, filename, key, kwargs)
+                        continue
+
+                    # Write each distinct frame to memory-mapped files at most once
+                    if executor == 'process' and share_data == 'mmap' and isinstance(data, pd.DataFrame):
+                        if id(data) not in refs:
+                            path = os.path.join(data_dir, str(len(refs)))
+                            os.mkdir(path)
+                            refs[id(data)] = FrameRef(data, path)
+                        data = refs[id(data)]
+                    if executor == 'process':
+                        transform = split_transform(transform)
+
+                    path = self._resolve_filename(filename) if filename and self.streaming else None
+                    futures[i] = pool.submit(render_job, config, i, template, data, transform, kwargs, path)
+
+                for i in sorted(futures):
+                    # Jobs that can't be sent to a worker (e.g. with transforms that can't be pickled) fail here
+                    result = capture(i, futures[i].result)
+                    if not isinstance(result, RenderError):
+                        value, error = result
+                        result = error if error is not None else capture(i, self._finish_job, value, *specs[i])
+                    results[i] = result
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+        return results
+
+    def _prepare_job(self, job):
+        # Split the arguments of a batch job and prepare it for rendering (see self._prepare)
+        kwargs = dict(job)
+        template, data = kwargs.pop('template'), kwargs.pop('data')
+        transform = kwargs.pop('transform', default_transform)
+        filename = kwargs.pop('filename', None)
+        live = kwargs.pop('live', False)
+        transform, key, kwargs = self._prepare(template, data, transform, filename, live, kwargs)
+        return template, data, transform, filename, key, kwargs
+
+    def _process_config(self):
+        # Settings used to create equivalent managers in worker processes (see batch.render_job)
+        return (
+            self.template_path, self.render_path, self.template_params,
+            (self.compression, self.compression_level, self.compression_only), self.bytecode_dir, self.assets
+        )
+
+    def _finish_job(self, value, filename, key, kwargs):
+        # Cache, save and wrap the result of a batch render job as self.render would
+        if not filename:
+            if current() is not None:
+                current().html_bytes = len(value)
+            if key is not None:
+                self.render_cache.put(key, value)
+            return self._display_html(self._rewrite_assets(value))
+        if self.streaming:
+            filename = value
+            if key is not None and not self.compression_only:
+                self.render_cache.put_file(key, filename)
+        else:
+            filename = self.save(value, filename)
+            if key is not None:
+                self.render_cache.put(key, value)
+        self._report_file_size(filename)
+        if key is not None:
+            self.render_cache.mark_saved(key, self._stored_path(filename))
+        return self._display_file(filename, kwargs)
+
+    def render_dashboard(self, jobs, filename=None, title=None, lazy=True, width='100%', height=800):
+        """ Render many visualizations into a single page that loads every library they need only once
+
+        Templates must define "assets" (library references) and "content" (chart markup and code) blocks to be
+        used in a dashboard; assets from all templates are merged so that each distinct library, stylesheet or
+        script is included only once, followed by the content of each chart (with a unique element id)
+        :param jobs: List of dictionaries containing arguments for self.render (as for self.render_many); any
+                filename given in these is ignored since all charts are saved together
+        :param filename: Name of file to store the dashboard in (see self.render)
+        :param title: Title for dashboard page
+        :param lazy: Whether or not to wait until charts are scrolled into view before drawing them
+        :param width: Width of the IFrame containing a dashboard saved to a file (if a url converter is configured)
+        :param height: Height of the IFrame containing a dashboard saved to a file (if a url converter is configured)
+        :return: IPython.display.HTML instance containing the dashboard (as with self.render)
+        """
+        assets, panels = [], []
+        for i, job in enumerate(jobs):
+            kwargs = dict(job)
+            template, data = kwargs.pop('template'), kwargs.pop('data')
+            transform = kwargs.pop('transform', default_transform)
+            kwargs.pop('filename', None)
+            if filename and self.data_files:
+                transform, kwargs = self._externalize_data(template, data, transform, filename, kwargs)
+
+            tpl = self._get_template(template)
+            if 'assets' not in tpl.blocks or 'content' not in tpl.blocks:
+                raise ValueError('Template "{}" does not support dashboards (no assets and content blocks)'.format(
+                    tpl.name))
+            kwargs['data'] = self._transform(data, transform)
+            kwargs['chart_id'] = 'pylfer_chart_{}'.format(i)
+            context = tpl.new_context(self._template_kwargs(kwargs))
+            assets.extend(_ASSET_PATTERN.findall(''.join(tpl.blocks['assets'](context))))
+            panels.append({
+                'content': ''.join(tpl.blocks['content'](context)),
+                'width': kwargs.get('width'), 'height': kwargs.get('height')
+            })
+
+        # Keep only the first copy of each asset, preserving the order in which they're first referenced
+        unique = []
+        for asset in assets:
+            if asset not in unique:
+                unique.append(asset)
+
+        html = self.saturate('dashboard', assets='\n    '.join(unique), panels=panels, title=title, lazy=lazy)
+        if filename:
+            return self._display_file(self.save(html, filename), {'width': width, 'height': height})
+        return self._display_html(self._rewrite_assets(html))
+
+    def _display_html(self, html):
+        # Wrap an HTML string for display, importing IPython only when it's actually used
+        if not self.display:
+            return html
+        from IPython.display import HTML
+        return HTML(data=html)
+
+    def _display_file(self, filename, kwargs):
+        if not self.display:
+            return filename
+        from IPython.display import HTML, IFrame
+
+        # If a url converter was configured, attempt to instead render the
+        # HTML within an IFrame (usually much better for IPython Notebooks)
+        with stage('url'):
+            url = self.url_converter(filename) if self.url_converter else None
+        # If a valid URL was returned, wrap it in an IFrame
+        if url:
+            html = IFrame(src=url, width=kwargs.get('width', 1000), height=kwargs.get('height', 400))._repr_html_ ()
+            html = HTML(data=html)    # Create an HTML instance with a raw string but also set the original file
+            html.filename = filename  # path even though it wasn't technically used to source the content
+            return html
+        elif self.compression_only:
+            # There is no uncompressed file to source the content from in this case
+            html = HTML(data=read_compressed(filename, self.compression))
+            html.filename = filename
+            return html
+        else:
+            return HTML(filename=filename)
+
+    def _render_cached(self, template, data, transform, key, kwargs):
+        # Return the saturated template as a string, using the render cache if enabled
+        html = self.render_cache.get(key) if key is not None else None
+        stats = current()
+        if html is None:
+            html = self.saturate(template, data=self._transform(data, transform), **kwargs)
+            if key is not None:
+                self.render_cache.put(key, html)
+        elif stats is not None:
+            stats.cached = True
+        if stats is not None:
+            stats.html_bytes = len(html)
+        return html
+
+    @staticmethod
+    def _transform(data, transform):
+        string_data = StringIO()
+        with stage('transform'):
+            transform(data, string_data)
+        result = string_data.getvalue()
+        stats = current()
+        if stats is not None:
+            stats.payload_bytes = (stats.payload_bytes or 0) + len(result)
+        return result
+
+    def _stream_cached(self, template, data, transform, filename, key, kwargs):
+        # Stream the saturated template to a file, copying from the disk cache instead if
+        # possible (the memory tier is bypassed since streamed renders are never held in memory)
+        cached = self.render_cache.get_path(key) if key is not None else None
+        if cached is not None:
+            if current() is not None:
+                current().cached = True
+            with open(cached, 'r') as src, self._open_render(filename) as dst:
+                shutil.copyfileobj(src, dst)
+            self._report_file_size(filename)
+            return filename
+        filename = self.stream(template, data, filename, transform=transform, **kwargs)
+        self._report_file_size(filename)
+        if key is not None and not self.compression_only:
+            self.render_cache.put_file(key, filename)
+        return filename
+
+    def _report_file_size(self, filename):
+        # Report the size of a render saved to a file (streamed renders are never held in memory as a whole)
+        if current() is not None:
+            current().html_bytes = os.path.getsize(self._stored_path(filename))
+
+    def save_data(self, data, transform=DEFAULT_DATA_TRANSFORM):
+        """ Save transformed data in a content-addressed file under the configured render path
+
+        Files are named using a hash of the data and the transform applied to it, so the
+        transform is skipped entirely (and nothing is written) if the same file already exists
+        (transforms that can't be described reliably, see cache.describe, are always run and
+        written to a new file instead)
+
+        :param data: DataFrame to transform and save
+        :param transform: Transformation applied to data frame (see self.render)
+        :return: Path of file in which data was stored
+        """
+        # Transforms belonging to a Viz declare the type of content they produce
+        owner = getattr(transform, '__self__', None)
+        extension = getattr(owner, 'data_extension', 'csv' if transform is default_transform else 'txt')
+
+        data_dir = os.path.join(self.render_path, 'data')
+        VizManager._validate_dir(data_dir)
+        description = describe(transform)
+        if description is not None:
+            name = RenderCache.key(hash_data(data), description)[:20]
+        else:
+            name = uuid.uuid4().hex[:20]
+        filename = os.path.join(data_dir, '{}.{}'.format(name, extension))
+        if not os.path.exists(filename):
+            # Write to a temporary file first so that other renders never see a partial file
+            tmp = '{}.{}.tmp'.format(filename, uuid.uuid4().hex)
+            with open(tmp, 'w') as f, stage('transform'):
+                transform(data, f)
+            os.rename(tmp, filename)
+        stats = current()
+        if stats is not None:
+            stats.payload_bytes = os.path.getsize(filename)
+        return filename
+
+    def _externalize_data(self, template, data, transform, filename, kwargs):
+        # Save data to its own file and pass its URL to the template (relative to the
+        # render itself unless a url converter is configured) in place of the data itself
+        tpl = self._get_template(template)
+        if 'data_url' not in _get_variables(self.env, tpl):
+            raise ValueError(
+                'Template "{}" does not support separate data files (it has no "data_url" parameter); '
+                'disable them with configure(data_files=False) to render it'.format(tpl.name)
+            )
+        path = self.save_data(data, transform)
+        return _skip_transform, dict(kwargs, data_url=self._file_url(path, self._resolve_filename(filename)))
+
+    def append(self, filename, data, transform=DEFAULT_DATA_TRANSFORM, since=None):
+        """ Append new rows to a live render (see self.render) without rendering it again
+
+        Only rows after the last one already in the render are transformed, and the result is appended to a
+        delta file (one transformed payload per line) that the render polls and merges into its charts, so the
+        cost of an append is proportional to the number of new rows rather than to the length of the whole history
+        :param filename: Name of file containing the live render (as given to self.render)
+        :param data: DataFrame containing new rows; this may also contain any number of rows already in the
+                render (e.g. the full history), which are ignored
+        :param transform: Transformation applied to new rows; this should be the same as the transform
+                used to create the render since the render expects payloads in the same format
+        :param since: Only rows with an index value greater than this are appended; defaults to the
+                index value of the last row in the render (or the last row appended to it)
+        :return: Number of rows appended
+        """
+        path = self._resolve_filename(filename)
+        delta = path + '.delta'
+        if not os.path.exists(delta):
+            raise ValueError('Render "{}" was not created with live updates enabled'.format(path))
+        if since is None:
+            since = self._load_last_index(path)
+
+        # Select only rows after the last one in the render
+        if since is not None:
+            if data.index.is_monotonic_increasing:
+                data = data.iloc[data.index.searchsorted(since, side='right'):]
             else:
-                return HTML(filename=filename)
+                data = data[data.index > since]
+        if len(data) == 0:
+            return 0
+
+        # Newlines are only whitespace in the (JSON) payloads expected by live templates
+        # so they can be replaced to keep each payload on a single line
+        with open(delta, 'a') as f:
+            f.write(self._transform(data, transform).replace('\n', ' ') + '\n')
+        self._save_last_index(path, data.index[-1])
+        return len(data)
+
+    def _start_live(self, data, filename, kwargs):
+        # Create an empty delta file for a live render (replacing any rows appended
+        # to a previous render in the same file) and pass its URL to the template
+        path = self._resolve_filename(filename)
+        open(path + '.delta', 'w').close()
+        self._save_last_index(path, data.index[-1] if len(data) else None)
+        return dict(kwargs, delta_url=self._file_url(path + '.delta', path))
+
+    @staticmethod
+    def _save_last_index(path, value):
+        # Record the index value of the last row in a live render so that appends
+        # from other processes know where the render ends
+        import pandas as pd
+        if isinstance(value, pd.Timestamp):
+            state = {'timestamp': value.isoformat()}
         else:
-            return HTML(data=html)
+            state = {'value': value.item() if hasattr(value, 'item') else value}
+        with open(path + '.delta.state', 'w') as f:
+            json.dump(state, f)
+
+    @staticmethod
+    def _load_last_index(path):
+        import pandas as pd
+        if not os.path.exists(path + '.delta.state'):
+            return None
+        with open(path + '.delta.state', 'r') as f:
+            state = json.load(f)
+        return pd.Timestamp(state['timestamp']) if 'timestamp' in state else state['value']
+
+    def _file_url(self, path, filename):
+        # Get the URL of a file referenced by a render saved in filename
+        with stage('url'):
+            url = self.url_converter(path) if self.url_converter else None
+        if not url:
+            url = os.path.relpath(path, os.path.dirname(filename)).replace(os.sep, '/')
+        return url
+
+    def _load_asset(self, path):
+        # Return the content and content hash of a library file, reading it
+        # from disk again only if it has been modified since it was last read
+        mtime = os.path.getmtime(path)
+        entry = self._asset_cache.get(path)
+        if entry is None or entry[0] != mtime:
+            with open(path, 'rb') as f:
+                content = f.read()
+            entry = (mtime, content.decode('utf-8'), RenderCache.key(content)[:12])
+            self._asset_cache[path] = entry
+        return entry[1], entry[2]
+
+    def _bundle_asset(self, path):
+        # Copy a library file into the assets directory under a content-hashed name (unless it's already
+        # there) and return the path of the copy
+        content, digest = self._load_asset(path)
+        stem, extension = os.path.splitext(os.path.basename(path))
+        asset_dir = os.path.join(self.render_path, 'assets')
+        bundled = os.path.join(asset_dir, '{}.{}{}'.format(stem, digest, extension))
+        if not os.path.exists(bundled):
+            VizManager._validate_dir(asset_dir)
+            tmp = '{}.{}.tmp'.format(bundled, uuid.uuid4().hex)
+            shutil.copyfile(path, tmp)
+            os.rename(tmp, bundled)
+        return bundled
+
+    def _rewrite_assets(self, html, filename=None):
+        """ Bundle or inline local libraries referenced in the given HTML, as configured (see self.configure)
+        :param html: HTML content of render (or any part of it containing library references)
+        :param filename: Path of file the render will be saved in, if any (libraries are only bundled for
+                renders saved to files; references are left as-is otherwise)
+        :return: HTML content with references to libraries replaced
+        """
+        if self.assets == 'link' or (self.assets == 'bundle' and not filename):
+            return html
+        with stage('assets'):
+            base = os.path.dirname(filename) if filename else self.render_path
+
+            def local_path(src):
+                # Resolve a reference to a file on disk, relative to the render, or return None for remote references
+                if src.startswith('file://'):
+                    src = src[len('file://'):]
+                elif src.startswith('//') or re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*:', src):
+                    return None
+                path = os.path.normpath(os.path.join(base, src))
+                return path if os.path.isfile(path) else None
+
+            def replace_script(m):
+                path = local_path(m.group(2))
+                if path is None:
+                    return m.group(0)
+                if self.assets == 'bundle':
+                    url = self._file_url(self._bundle_asset(path), filename)
+                    return '<script{}src="{}"{}></script>'.format(m.group(1), url, m.group(3))
+                # Escape closing tags within the script so the browser doesn't end the element early
+                content = self._load_asset(path)[0].replace('</script', '<\\/script')
+                return '<script type="text/javascript">\n{}\n</script>'.format(content)
+
+            def replace_link(m):
+                href = _HREF_PATTERN.search(m.group(0))
+                path = local_path(href.group(1)) if href else None
+                if path is None:
+                    return m.group(0)
+                if self.assets == 'bundle':
+                    url = self._file_url(self._bundle_asset(path), filename)
+                    return m.group(0).replace(href.group(0), 'href="{}"'.format(url))
+                return '<style type="text/css">\n{}\n</style>'.format(self._load_asset(path)[0])
+
+            return _LINK_PATTERN.sub(replace_link, _SCRIPT_PATTERN.sub(replace_script, html))
+
+    def _open_render(self, filename):
+        # Open a file-like object for writing a render, which also (or only)
+        # writes a compressed copy of the render if compression is enabled
+        if not self.compression:
+            return open(filename, 'w')
+        compressed = CompressedWriter(filename, method=self.compression, level=self.compression_level)
+        if self.compression_only:
+            return compressed
+        return TeeWriter(open(filename, 'w'), compressed)
+
+    def _stored_path(self, filename):
+        # Return the path of the file actually written for a render
+        return compressed_path(filename, self.compression) if self.compression_only else filename
+
+    def _resolve_filename(self, filename):
+        # Determine the output path
+        if os.sep not in filename:
+            filename = os.path.join(self.render_path, filename)
+
+        # Add a .html extension to the file name if it is not present
+        return VizManager._ensure_extension(filename, '.html')
 
     def save(self, html, filename='viz.html'):
         """ Save the given HTML content in a file
@@ -128,18 +816,60 @@ class VizManager(object):
                     - If no .html extension is provided in the file name, one will be added automatically
         :return: Path of file in which render was stored
         """
-        # Determine the output path
-        if os.sep not in filename:
-            filename = os.path.join(self.render_path, filename)
+        filename = self._resolve_filename(filename)
 
-        # Add a .html extension to the file name if it is not present
-        filename = VizManager._ensure_extension(filename, '.html')
-
-        # Write the results to a file and return the path for that file
-        with open(filename, 'w') as f:
+        # Write the results to a file (compressing them if configured to do so) and return the path for that file
+        html = self._rewrite_assets(html, filename)
+        with stage('write'), self._open_render(filename) as f:
             f.write(html)
         return filename
 
+    def stream(self, template, data, filename, transform=DEFAULT_DATA_TRANSFORM, **kwargs):
+        """ Render visualization directly to a file without building the full HTML content in memory
+
+        Template content is written to the file chunk by chunk (see jinja2.Template.generate) and the
+        data transformation writes straight into the same file handle where the "data" variable appears
+        in the template.  Viz transforms encode series a chunk of points at a time (see encoding.CHUNK_SIZE),
+        so beyond the data frame itself (and a float copy of it when downsampling), memory used by a streamed
+        render is bounded by chunk size rather than by the size of the data; custom transforms need to write
+        their output incrementally for the same to hold
+
+        :param template: Name of template to saturate (e.g. 'streamgraph.html', 'stacked_bar.html', etc.)
+        :param data: DataFrame to use in visualization
+        :param filename: Name of file to store render in (see self.save)
+        :param transform: Transformation applied to data frame to write it to the file (see self.render)
+        :param kwargs: Arguments for the template (e.g. date format, title, etc.)
+        :return: Path of file in which render was stored
+        """
+        template = self._get_template(template)
+        filename = self._resolve_filename(filename)
+
+        # Render the template with a unique placeholder in place of the data and substitute
+        # the transformed data for that placeholder wherever it appears in the output
+        marker = '__pylfer_data_{}__'.format(uuid.uuid4().hex)
+        with stage('write'), self._open_render(filename) as f:
+            def write(chunk):
+                parts = chunk.split(marker)
+                f.write(parts[0])
+                for part in parts[1:]:
+                    with stage('transform'):
+                        transform(data, f)
+                    f.write(part)
+
+            # Library references are all within the document head, so only that
+            # is buffered (if necessary) in order to bundle or inline them
+            head = [] if self.assets != 'link' else None
+            for chunk in template.generate(**self._template_kwargs(dict(kwargs, data=marker))):
+                if head is not None:
+                    head.append(chunk)
+                    if '</head>' not in chunk:
+                        continue
+                    chunk, head = self._rewrite_assets(''.join(head), filename), None
+                write(chunk)
+            if head:
+                write(self._rewrite_assets(''.join(head), filename))
+        return filename
+
     def saturate(self, template, **kwargs):
         """ Render visualization using given template and return HTML content as a string
 
@@ -147,24 +877,57 @@ class VizManager(object):
         :param kwargs: Arguments for the template (e.g. data, date format, title, etc.)
         :return: HTML string for visualization
         """
+        # Fill in the template variables and return the resulting render
+        with stage('saturate'):
+            return self._get_template(template).render(**self._template_kwargs(kwargs))
+
+    def _template_kwargs(self, kwargs):
+        # Add any global template parameters configured to the
+        # template parameters given for this single template rendering
+        if self.template_params:
+            kwargs.update(self.template_params)
+        return kwargs
+
+    def serve(self, host='127.0.0.1', port=0, verbose=False):
+        """ Serve the render path over HTTP from a background thread and show renders saved to files in IFrames
+        sourced from that server (this replaces any url converter configured)
+
+        Renders, data files and bundled assets (see self.configure) are all served with validators so that unchanged
+        files are never downloaded again, along with compressed copies of renders if compression is enabled
+        :param host: Host name or address to listen on; the default only accepts connections from this machine
+        :param port: Port to listen on (an unused port is chosen if this is 0)
+        :param verbose: Whether or not to log each request to stderr
+        :return: server.RenderServer instance (call stop on this to shut the server down)
+        """
+        from pylfer.server import RenderServer
+        server = RenderServer(self.render_path, host=host, port=port, verbose=verbose).start()
+        self.url_converter = server.url
+        return server
+
+    def precompile(self):
+        """ Compile every template ahead of time
+
+        When a bytecode cache is configured, compiled templates are written to it so that no other process
+        using the same cache ever needs to compile them (e.g. this could be run once at deployment time)
+        :return: List of names of compiled templates
+        """
+        names = self.env.list_templates(extensions=['html'])
+        for name in names:
+            self.env.get_template(name)
+        return names
+
+    def _get_template(self, template):
         # All templates end with a .html extension so add that if it
         # was not already provided as part of the template name
         template = VizManager._ensure_extension(template, '.html')
 
-        # Fetch and render the template
+        # Fetch the template
         try:
             template = self.env.get_template(template)
         except TemplateNotFound:
             raise ValueError(
                 'Failed to find template with the name {} in directory {}'.format(template, self.template_path)
             )
-
-        # Add any global template parameters configured to the
-        # template parameters given for this single template rendering
-        if self.template_params:
-            kwargs.update(self.template_params)
-
-        # Fill in the template variables and return the resulting render
-        return template.render(**kwargs)
+        return template
 
 
@@ -0,0 +1,403 @@
+""" Local web server for renders
+
+Serves the files under a render path (renders, data files, bundled assets, live deltas, etc.) over HTTP so that
+renders can be shown in IFrames (see VizManager.serve) without setting up a separate web server.  Responses
+carry ETag and Last-Modified headers so unchanged files are revalidated rather than downloaded again, ranges
+of files are served on request (e.g. the rows appended to a live render since it last checked),
+compressed copies of renders (see VizManager.configure) are served to clients accepting them (other text
+is gzipped on the fly) and content-hashed files, such as bundled assets, are cached by browsers indefinitely.
+"""
+
+__author__ = 'eczech'
+
+from pylfer.compression import EXTENSIONS, compressed_path, read_compressed
+from email.utils import formatdate, parsedate_tz, mktime_tz
+from collections import OrderedDict
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote, quote
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote, quote
+import mimetypes
+import threading
+import argparse
+import shutil
+import gzip
+import io
+import re
+import os
+
+# Content encodings of precompressed files, in order of preference, along with
+# the compression methods (see compression.CompressedWriter) that produce them
+ENCODINGS = (('br', 'brotli'), ('gzip', 'gzip'))
+
+# Files with content hashes in their names (bundled assets and data files) never change
+_HASHED_PATTERN = re.compile(r'(^|\.)[0-9a-f]{12,}\.[A-Za-z0-9]+$')
+
+# Types of content worth compressing on the fly, when files are at least this many bytes
+_COMPRESSIBLE_PATTERN = re.compile(r'^text/|javascript|json|xml')
+_MIN_COMPRESS_BYTES = 1024
+
+# Types of content for files with extensions unknown to the mimetypes module
+_CONTENT_TYPES = {'.delta': 'application/x-ndjson', '.js': 'application/javascript', '.json': 'application/json'}
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _RenderRequestHandler(BaseHTTPRequestHandler):
+
+    server_version = 'pylfer'
+
+    def do_GET(self):
+        self._serve(True)
+
+    def do_HEAD(self):
+        self._serve(False)
+
+    def log_message(self, format, *args):
+        if self.server.render_server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _serve(self, send_body):
+        server = self.server.render_server
+        path = server.resolve(self.path)
+        if path is None:
+            self.send_error(404, 'File not found')
+            return
+
+        # Pick the content to send: a precompressed copy (if the client accepts it and it's up to date), the file
+        # itself (compressed on the fly if worthwhile, unless only part of it was requested) or, if only a
+        # compressed copy was written, that copy decoded
+        content_type = _content_type(path)
+        accepted = _accepted_encodings(self.headers.get('Accept-Encoding', ''))
+        compressible = _COMPRESSIBLE_PATTERN.search(content_type) is not None
+        encoding, source, decode = None, path, None
+        plain = os.path.isfile(path)
+        for name, method in ENCODINGS:
+            copy = compressed_path(path, method)
+            current = os.path.isfile(copy) and (not plain or os.path.getmtime(copy) >= os.path.getmtime(path))
+            if name in accepted and current:
+                encoding, source = name, copy
+                break
+        if encoding is None and not plain:
+            for name, method in ENCODINGS:
+                if os.path.isfile(compressed_path(path, method)):
+                    source, decode = compressed_path(path, method), method
+                    break
+            if decode is None:
+                self.send_error(404, 'File not found')
+                return
+        ranged = encoding is None and decode is None and self.headers.get('Range') is not None
+        on_the_fly = False
+        if encoding is None and decode is None and compressible and 'gzip' in accepted and not ranged:
+            if os.path.getsize(path) >= _MIN_COMPRESS_BYTES:
+                encoding, on_the_fly = 'gzip', True
+
+        # Validators are derived from the file actually read along with the encoding applied to it, and checked
+        # before anything is compressed or decoded so that revalidating an unchanged file costs nothing
+        stat = os.stat(source)
+        etag = '"{:x}-{:x}{}"'.format(stat.st_size, int(stat.st_mtime * 1e6), '-' + encoding if encoding else '')
+        last_modified = formatdate(int(stat.st_mtime), usegmt=True)
+
+        headers = [
+            ('ETag', etag), ('Last-Modified', last_modified),
+            ('Cache-Control', server.cache_control(path))
+        ]
+        if compressible or encoding:
+            headers.append(('Vary', 'Accept-Encoding'))
+        if encoding is None and decode is None:
+            headers.append(('Accept-Ranges', 'bytes'))
+
+        if self._not_modified(etag, int(stat.st_mtime)):
+            self.send_response(304)
+            for header in headers:
+                self.send_header(*header)
+            self.end_headers()
+            return
+
+        # Ranges of bytes are only served from files sent as they are, e.g. so that live renders read just what
+        # was appended to their delta files since they last checked (see pylfer.poll in templates/_payload.html)
+        byte_range = None
+        if ranged and self.headers.get('If-Range', etag) == etag:
+            byte_range = _byte_range(self.headers.get('Range'), stat.st_size)
+        if byte_range is False:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */{}'.format(stat.st_size))
+            self.send_header('Content-Length', '0')
+            for header in headers:
+                self.send_header(*header)
+            self.end_headers()
+            return
+        if byte_range is not None:
+            first, last = byte_range
+            self.send_response(206)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(first, last, stat.st_size))
+            self.send_header('Content-Length', str(last - first + 1))
+            for header in headers:
+                self.send_header(*header)
+            self.end_headers()
+            if send_body:
+                with open(source, 'rb') as f:
+                    f.seek(first)
+                    _copy(f, self.wfile, last - first + 1)
+            return
+
+        # Files too large to keep compressed in memory are compressed as they're sent, in which case the length
+        # isn't known up front and the end of the response is marked by closing the connection instead
+        body, stream = None, False
+        if decode is not None:
+            body = read_compressed(path, decode).encode('utf-8')
+        elif on_the_fly:
+            body = server.compress(path) if stat.st_size <= server.max_cache_bytes else None
+            stream = body is None
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        if not stream:
+            self.send_header('Content-Length', str(len(body) if body is not None else stat.st_size))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        if not send_body:
+            return
+        if body is not None:
+            self.wfile.write(body)
+        else:
+            with open(source, 'rb') as f:
+                if stream:
+                    _gzip(f, self.wfile)
+                else:
+                    shutil.copyfileobj(f, self.wfile)
+
+    def _not_modified(self, etag, mtime):
+        # If-None-Match takes precedence over If-Modified-Since when both are given
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [t.strip() for t in if_none_match.split(',')]
+            return '*' in tags or etag in tags or 'W/' + etag in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            parsed = parsedate_tz(if_modified_since)
+            return parsed is not None and mtime <= mktime_tz(parsed)
+        return False
+
+
+def _byte_range(header, size):
+    # Parse a Range header for a single range of bytes into the positions of its first and last bytes, returning
+    # None for headers that can't be used (which are ignored, so the whole file is sent) and False for ranges
+    # beyond the end of the file
+    match = re.match(r'^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$', header)
+    if match is None or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # A suffix of the given number of bytes
+        return (max(0, size - int(last)), size - 1) if int(last) > 0 and size > 0 else False
+    first = int(first)
+    if first >= size:
+        return False
+    last = min(int(last), size - 1) if last else size - 1
+    return (first, last) if last >= first else None
+
+
+def _copy(src, dst, length):
+    # Copy the given number of bytes from one file to another
+    while length > 0:
+        chunk = src.read(min(length, 2**16))
+        if not chunk:
+            break
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+def _gzip(src, dst):
+    # Fix the timestamp in the gzip header so that identical content compresses identically
+    gz = gzip.GzipFile(fileobj=dst, mode='wb', mtime=0)
+    shutil.copyfileobj(src, gz)
+    gz.close()
+
+
+def _content_type(path):
+    extension = os.path.splitext(path)[1]
+    content_type = _CONTENT_TYPES.get(extension) or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if content_type.startswith('text/') or content_type in ('application/javascript', 'application/json'):
+        content_type += '; charset=utf-8'
+    return content_type
+
+
+def _accepted_encodings(header):
+    # Parse an Accept-Encoding header into the set of encodings it doesn't explicitly reject (i.e. with q=0)
+    accepted = set()
+    for part in header.split(','):
+        params = [p.strip() for p in part.split(';')]
+        if not params[0]:
+            continue
+        q = [p for p in params[1:] if p.startswith('q=')]
+        try:
+            if q and float(q[0][2:]) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(params[0].lower())
+    return accepted
+
+
+class RenderServer(object):
+    """ Threaded HTTP server for the files under a render path
+
+    Typical usage is through VizManager.serve, which starts a server and configures the manager to convert
+    paths of renders to URLs served by it, although this can also be used directly; e.g.
+
+        server = RenderServer('/tmp/renders').start()
+        manager.configure(url_converter=server.url)
+    """
+
+    def __init__(self, root, host='127.0.0.1', port=0, verbose=False, max_cache_bytes=32 * 2**20):
+        """ Create a server (which doesn't handle requests until started)
+        :param root: Directory containing files to serve (usually the render path of a VizManager)
+        :param host: Host name or address to listen on; the default only accepts connections from this machine
+        :param port: Port to listen on (an unused port is chosen if this is 0)
+        :param verbose: Whether or not to log each request to stderr
+        :param max_cache_bytes: Maximum total size of files gzipped on the fly that are kept in memory for reuse,
+                least recently used first; files larger than this are compressed as they're sent instead (0 to
+                always do so)
+        """
+        self.root = os.path.abspath(root)
+        self.verbose = verbose
+        self.max_cache_bytes = max_cache_bytes
+        self._httpd = _ThreadingHTTPServer((host, port), _RenderRequestHandler)
+        self._httpd.render_server = self
+        self.host = host if host not in ('', '0.0.0.0') else 'localhost'
+        self.port = self._httpd.server_address[1]
+        self._thread = None
+        self._compressed = OrderedDict()
+        self._compressed_bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return 'http://{}:{}/'.format(self.host, self.port)
+
+    def url(self, path):
+        """ Convert the path of a file under the served directory to its URL (this can be used as the url_converter
+        for a VizManager; see VizManager.configure)
+        :param path: Path of file
+        :return: URL of the file or None if it is not under the served directory
+        """
+        path = os.path.abspath(path)
+        if not path.startswith(self.root + os.sep):
+            return None
+        return self.base_url + quote(os.path.relpath(path, self.root).replace(os.sep, '/'))
+
+    def resolve(self, url_path):
+        """ Get the path of the file requested by a URL path (e.g. "/charts/a.html?v=1")
+        :return: Path of file (which may only exist in compressed form) or None if the URL refers to something
+                outside the served directory, a directory or a hidden file (e.g. the render cache)
+        """
+        parts = unquote(url_path.split('?', 1)[0].split('#', 1)[0]).split('/')
+        if any(part in ('..', '.') or part.startswith('.') for part in parts if part):
+            return None
+        path = os.path.join(self.root, *[part for part in parts if part])
+        if os.path.isdir(path):
+            return None
+        if os.path.isfile(path) or any(os.path.isfile(compressed_path(path, m)) for m in EXTENSIONS):
+            return path
+        return None
+
+    def cache_control(self, path):
+        """ Get the Cache-Control header value for a file; content-hashed files are cached indefinitely and anything
+        else (renders, live deltas, etc.) may be cached but is revalidated on every use
+        """
+        if _HASHED_PATTERN.search(os.path.basename(path)):
+            return 'public, max-age=31536000, immutable'
+        return 'no-cache'
+
+    def compress(self, path):
+        """ Gzip a file, reusing the result for as long as the file is unchanged (see max_cache_bytes)
+        :param path: Path of file
+        :return: Compressed content (bytes)
+        """
+        stat = os.stat(path)
+        key = (stat.st_mtime, stat.st_size)
+        with self._lock:
+            entry = self._compressed.pop(path, None)
+            if entry is not None and entry[0] == key:
+                self._compressed[path] = entry
+                return entry[1]
+            if entry is not None:
+                self._compressed_bytes -= len(entry[1])
+        buffer = io.BytesIO()
+        with open(path, 'rb') as src:
+            _gzip(src, buffer)
+        content = buffer.getvalue()
+        if len(content) > self.max_cache_bytes:
+            return content
+        with self._lock:
+            entry = self._compressed.pop(path, None)
+            if entry is not None:
+                self._compressed_bytes -= len(entry[1])
+            self._compressed[path] = (key, content)
+            self._compressed_bytes += len(content)
+            while self._compressed_bytes > self.max_cache_bytes:
+                _, (_, evicted) = self._compressed.popitem(last=False)
+                self._compressed_bytes -= len(evicted)
+        return content
+
+    def start(self):
+        """ Start handling requests in a background (daemon) thread
+        :return: self
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever, name='pylfer-server')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop handling requests and close the server """
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def serve_forever(self):
+        """ Handle requests in the current thread until interrupted """
+        try:
+            self._httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve a directory of pylfer renders')
+    parser.add_argument('root', help='Directory to serve (e.g. the render path of a VizManager)')
+    parser.add_argument('--host', default='127.0.0.1', help='Host name or address to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on')
+    parser.add_argument('--verbose', action='store_true', help='Log each request')
+    args = parser.parse_args(argv)
+
+    server = RenderServer(args.root, host=args.host, port=args.port, verbose=args.verbose)
+    print('Serving {} at {}'.format(server.root, server.base_url))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
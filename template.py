@@ -1,14 +1,90 @@
 __author__ = 'eczech'
 
-import pandas as pd
+import numpy as np
+import weakref
 import json
+from pylfer.encoding import write_series, write_binary_series, write_columnar_series, write_binary_array
+from pylfer.encoding import write_literals
+from pylfer.downsample import downsample_series
+from pylfer.instrument import stage, current
 
 ###########################
 # Abstractions & Defaults #
 ###########################
 
+# Formats in which series data can be embedded in templates (see Viz.write_series)
+PAYLOADS = ('json', 'binary', 'columnar')
+
 
 class Viz(object):
+
+    # Maximum number of points per series to embed in a render (None means no limit)
+    # along with the method used to downsample series that exceed it
+    max_points = None
+    downsample = 'lttb'
+
+    # Whether or not all series must have points at the same x values (e.g. for stacking), in which case
+    # max_points limits the number of points shared by all series rather than the number in each one
+    shared_rows = False
+
+    # Format in which series data is embedded in templates (one of PAYLOADS) along with the
+    # number of significant digits float values are written with (None means full precision)
+    payload = 'json'
+    precision = None
+
+    # Extension for files containing transformed data (see VizManager.save_data)
+    data_extension = 'json'
+
+    def select_rows(self, data, index):
+        """ Select the rows to embed for each series so that no series has more than self.max_points points
+        :param data: pandas DataFrame to be reduced
+        :param index: numeric x values for each row (see get_data_index)
+        :return: List with an array of row positions for each column (see downsample.downsample_series), or
+                None if every row is to be embedded
+        """
+        if self.max_points is None:
+            return None
+        return downsample_series(data, index, self.max_points, method=self.downsample, shared=self.shared_rows)
+
+    def write_series(self, data, output, series_props, values_key, point_format):
+        """ Write one series per data frame column to given output buffer in the configured payload format
+
+        :param data: pandas DataFrame to be converted (this will be downsampled first if necessary)
+        :param output: output buffer into which converted output will be written
+        :param series_props: function taking a column name and returning a dictionary of series properties
+        :param values_key: name of the series property containing the list of points (json payloads only)
+        :param point_format: format string for a single point (json payloads only; see encoding.write_points)
+        """
+        if self.payload not in PAYLOADS:
+            raise ValueError('Payload format must be one of {} (not "{}")'.format(PAYLOADS, self.payload))
+
+        # Get the numeric index of the data (possibly converted from dates) and
+        # downsample each series if necessary
+        with stage('index'):
+            idx = get_data_index(data)
+        with stage('downsample'):
+            rows = self.select_rows(data, idx)
+
+            # Rows shared by all series are simply selected from the frame so that the index is still only written once
+            if rows is not None and self.shared_rows:
+                data, idx, rows = data.iloc[rows[0]], np.asarray(idx)[rows[0]], None
+
+        # Report the number of points actually embedded if the render is being instrumented
+        stats = current()
+        if stats is not None:
+            stats.points = data.shape[0] * data.shape[1] if rows is None else sum(len(r) for r in rows)
+
+        # Write each series in the frame directly to the given buffer
+        with stage('encode'):
+            if self.payload == 'binary':
+                write_binary_series(output, data, idx, series_props, rows=rows)
+            elif self.payload == 'columnar':
+                write_columnar_series(output, data, idx, series_props, precision=self.precision, rows=rows)
+            else:
+                write_series(
+                    output, data, idx, series_props, values_key, point_format, precision=self.precision, rows=rows
+                )
+
     def transform(self, data, output):
         """ Encodes data frames as csv/json and writes results to given output buffer
         :param data: pandas DataFrame to be converted
@@ -31,21 +107,51 @@ class Viz(object):
 
 def default_transform(data, output):
     """ Default CSV transformation (assumes no data in index) """
-    data.to_csv(output, index=False, line_terminator='\\n', sep=',')
+    # The line terminator argument was renamed in pandas 1.5 and the old name removed in 2.0
+    try:
+        data.to_csv(output, index=False, lineterminator='\\n', sep=',')
+    except TypeError:
+        data.to_csv(output, index=False, line_terminator='\\n', sep=',')
 
 
 def has_date_index(data):
+    import pandas as pd
     return type(data.index) is pd.DatetimeIndex
 
 
+# Date indexes converted to UTC ms, keyed by the id of the original index object; entries are
+# dropped as soon as the index they were computed from is garbage collected
+_epoch_ms_cache = {}
+
+
+def _to_epoch_ms(index):
+    # Timezone aware indexes are stored internally as UTC and naive indexes are interpreted as UTC already, so
+    # the underlying int64 values can be used for both once converted to ms; the resolution of those values
+    # isn't always ns (pandas 2+ supports s, ms and us too), so the conversion is made explicitly
+    import pandas as pd
+    if hasattr(index, 'as_unit'):
+        return pd.Index(index.as_unit('ms').asi8)
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+    return pd.Index(index.values.astype('datetime64[ms]').view('i8'))
+
+
 def get_data_index(data):
     # If the index is a date, transform it to UTC ms and make sure
     # to copy the result to a new index object so as not to alter
     # the original index
-    if has_date_index(data):
-        idx = data.index.map(lambda d: int(pd.to_datetime(d, utc=True).value / 1E6))
-    else:
-        idx = data.index
+    if not has_date_index(data):
+        return data.index
+
+    # Indexes are immutable so a conversion can be reused for as long
+    # as the same index object is attached to the frame
+    key = id(data.index)
+    entry = _epoch_ms_cache.get(key)
+    if entry is not None and entry[0]() is data.index:
+        return entry[1]
+    idx = _to_epoch_ms(data.index)
+    ref = weakref.ref(data.index, lambda _: _epoch_ms_cache.pop(key, None))
+    _epoch_ms_cache[key] = (ref, idx)
     return idx
 
 ############################
@@ -58,11 +164,22 @@ class NVD3LineChart(Viz):
     Taken from http://nvd3.org/examples/lineWithFocus.html
     """
 
-    def __init__(self, fill_area_cols=None):
+    def __init__(self, fill_area_cols=None, max_points=None, downsample='lttb', payload='json', precision=None):
         """ Create a new NVD3 Line Chart instance
         :param fill_area_cols: The names of the columns/series that should have their area filled under
+        :param max_points: Maximum number of points to render per series (see downsample.downsample_series)
+        :param downsample: Method used to reduce series with more than max_points points ('lttb' or 'minmax')
+        :param payload: Format in which data is embedded in the template; one of 'json', 'binary' (base64
+                encoded typed arrays which are smaller and faster for browsers to load) or 'columnar' (JSON
+                with the index written only once rather than once per series; see Viz.write_series)
+        :param precision: Number of significant digits to write float values with in 'json' and 'columnar'
+                payloads (all digits are written by default)
         """
         self.fill_area_cols = fill_area_cols if fill_area_cols else []
+        self.max_points = max_points
+        self.downsample = downsample
+        self.payload = payload
+        self.precision = precision
 
     def get_name(self):
         return 'NVD3 Line Chart'
@@ -76,21 +193,11 @@ class NVD3LineChart(Viz):
         Generates json results in the form:
             [{'area': False, 'key': 'Series A', 'values': [{'x': <x_value>, 'y': <y_value>}, ...]}, ...]
         """
-
-        # Get numeric data index (possibly converted from dates)
-        idx = get_data_index(data)
-
-        # Create a json object for each series in the frame and write the resulting
-        # json object to the given buffer
-        res = []
-        for col in data:
-            series = {
-                'area': col in self.fill_area_cols,
-                'key': col,
-                'values': [{'x': x, 'y': y} for (x, y) in zip(idx, data[col])]
-            }
-            res.append(series)
-        output.write(json.dumps(res))
+        self.write_series(
+            data, output,
+            lambda col: {'area': col in self.fill_area_cols, 'key': col},
+            'values', '{"x":%s,"y":%s}'
+        )
 
 
 ###########################
@@ -102,8 +209,24 @@ class NVD3StackedAreaChart(Viz):
 
     Taken from http://nvd3.org/examples/stackedArea.html
     """
-    def __init__(self):
-        pass
+
+    # Series are stacked, so they must all have points at the same x values
+    shared_rows = True
+
+    def __init__(self, max_points=None, downsample='lttb', payload='json', precision=None):
+        """ Create a new NVD3 Stacked Area Chart instance
+        :param max_points: Maximum number of points to render per series (see downsample.downsample_series)
+        :param downsample: Method used to reduce series with more than max_points points ('lttb' or 'minmax')
+        :param payload: Format in which data is embedded in the template; one of 'json', 'binary' (base64
+                encoded typed arrays which are smaller and faster for browsers to load) or 'columnar' (JSON
+                with the index written only once rather than once per series; see Viz.write_series)
+        :param precision: Number of significant digits to write float values with in 'json' and 'columnar'
+                payloads (all digits are written by default)
+        """
+        self.max_points = max_points
+        self.downsample = downsample
+        self.payload = payload
+        self.precision = precision
 
     def get_name(self):
         return 'NVD3 Stacked Area Chart'
@@ -117,20 +240,7 @@ class NVD3StackedAreaChart(Viz):
         Generates results in the form:
             [ { 'key': 'Series Name', values: [ [<timestamp>, <value>], ...] }, ... ]
         """
-
-        # Get numeric data index (possibly converted from dates)
-        idx = get_data_index(data)
-
-        # Create a json object for each series in the frame and write the resulting
-        # json object to the given buffer
-        res = []
-        for col in data:
-            series = {
-                'key': col,
-                'values': [[x, y] for (x, y) in zip(idx, data[col])]
-            }
-            res.append(series)
-        output.write(json.dumps(res))
+        self.write_series(data, output, lambda col: {'key': col}, 'values', '[%s,%s]')
 
 
 #########################
@@ -138,8 +248,8 @@ class NVD3StackedAreaChart(Viz):
 #########################
 
 
-def _highcharts_series(data, series_types={}):
-    """ Convert data frame to Highcharts compatible json
+def _write_highcharts_series(viz, data, output, series_types=None):
+    """ Convert data frame to Highcharts compatible json and write results to given output buffer
 
     Generates results in the form:
         [{
@@ -149,26 +259,13 @@ def _highcharts_series(data, series_types={}):
             data: [ <value>, <value>, ... ]
         }, ...]
     """
-
-    # If the index is a date, transform it to UTC ms making sure
-    # to copy the result to a new index object so as not to alter
-    # the original index
-    if has_date_index(data):
-        idx = data.index.map(lambda d: int(pd.to_datetime(d, utc=True).value / 1E6))
-    else:
-        idx = data.index
-
-    # Create a json object for each series in the frame and write the resulting
-    # json object to the given buffer
-    res = []
-    for col in data:
-        series = {
-            'type': series_types[col] if col in series_types.keys() else 'line',
-            'name': col,
-            'data': [[x, y] for (x, y) in zip(idx, data[col])]
-        }
-        res.append(series)
-    return res
+    if series_types is None:
+        series_types = {}
+    viz.write_series(
+        data, output,
+        lambda col: {'type': series_types.get(col, 'line'), 'name': col},
+        'data', '[%s,%s]'
+    )
 
 
 class HighchartsLineChart(Viz):
@@ -176,14 +273,26 @@ class HighchartsLineChart(Viz):
 
     Taken from http://www.highcharts.com/demo/line-time-series
     """
-    def __init__(self, fill_area_cols=None, chart_props=None):
+    def __init__(self, fill_area_cols=None, chart_props=None, max_points=None, downsample='lttb',
+                 payload='json', precision=None):
         """ Create a new Highcharts Line Chart instance
         :param fill_area_cols: The names of the columns/series that should have their area filled under
         :param chart_props: Chart configuration properties (these are Highcharts specific and would include
                 anything like xAxis, subtitle, title, legend, or plotOptions)
+        :param max_points: Maximum number of points to render per series (see downsample.downsample_series)
+        :param downsample: Method used to reduce series with more than max_points points ('lttb' or 'minmax')
+        :param payload: Format in which data is embedded in the template; one of 'json', 'binary' (base64
+                encoded typed arrays which are smaller and faster for browsers to load) or 'columnar' (JSON
+                with the index written only once rather than once per series; see Viz.write_series)
+        :param precision: Number of significant digits to write float values with in 'json' and 'columnar'
+                payloads (all digits are written by default)
         """
         self.fill_area_cols = dict([(c, 'area') for c in fill_area_cols]) if fill_area_cols else {}
         self.chart_props = chart_props
+        self.max_points = max_points
+        self.downsample = downsample
+        self.payload = payload
+        self.precision = precision
 
     def get_name(self):
         return 'Highcharts Line Chart'
@@ -202,11 +311,17 @@ class HighchartsLineChart(Viz):
                 data: [ <value>, <value>, ... ]
             }, ...]
         """
-        res = _highcharts_series(data, series_types=self.fill_area_cols)
-        res = {'series': res}
-        if self.chart_props:
-            res.update(self.chart_props)
-        output.write(json.dumps(res))
+        # Chart properties may override the series list entirely, in which case there is nothing to encode
+        chart_props = self.chart_props if self.chart_props else {}
+        if 'series' in chart_props:
+            output.write(json.dumps(chart_props))
+            return
+
+        output.write('{"series": ')
+        _write_highcharts_series(self, data, output, series_types=self.fill_area_cols)
+        for k in sorted(chart_props):
+            output.write(', {}: {}'.format(json.dumps(k), json.dumps(chart_props[k])))
+        output.write('}')
 
 class HighchartsConfigurableLineChart(Viz):
     """ Configurable Highcharts Line Chart Model
@@ -233,5 +348,60 @@ class HighchartsConfigurableLineChart(Viz):
                 data: [ <value>, <value>, ... ]
             }, ...]
         """
-        res = _highcharts_series(data)
-        output.write(json.dumps(res))
+        _write_highcharts_series(self, data, output)
+
+
+######################
+# Histogram Heatmaps #
+######################
+
+
+class HistogramHeatmaps(Viz):
+    """ Grid of heatmaps for 2-D histograms (as returned by utilities.get_histograms) drawn with D3 """
+
+    def __init__(self, payload='json'):
+        """ Create a new Histogram Heatmaps instance
+        :param payload: Format in which counts are embedded in the template; one of 'json' or 'binary' ('columnar'
+                is the same as 'json' here since counts are already written as a single array per histogram)
+        """
+        self.payload = payload
+
+    def get_name(self):
+        return 'Histogram Heatmaps'
+
+    def get_template(self):
+        return 'histogram_heatmaps.html'
+
+    def transform(self, data, output):
+        """ Convert dictionary of histogram frames to json
+
+        Generates results in the form:
+            [{
+                'name': 'Column name', 'target': 'Target name',
+                'rows': ['<target bin>', ...], 'cols': ['<column bin>', ...],
+                'counts': [<row-major counts>] or <binary array> (see encoding.write_binary_array)
+            }, ...]
+        Empty (NaN) cells are written as zero counts and counts are written as integers when possible
+        """
+        if self.payload not in PAYLOADS:
+            raise ValueError('Payload format must be one of {} (not "{}")'.format(PAYLOADS, self.payload))
+
+        output.write('[')
+        for i, col in enumerate(sorted(data, key=str)):
+            d = data[col]
+            counts = np.nan_to_num(d.values.astype('float64')).ravel()
+            if (counts == counts.round()).all():
+                counts = counts.astype('int64')
+
+            if i > 0:
+                output.write(', ')
+            output.write('{{"name": {}, "target": {}, "rows": {}, "cols": {}, "counts": '.format(
+                json.dumps(str(col)), json.dumps(str(d.index.name)),
+                json.dumps([str(v) for v in d.index]), json.dumps([str(v) for v in d.columns])
+            ))
+            if self.payload == 'binary':
+                write_binary_array(output, counts)
+            else:
+                write_literals(output, counts)
+            output.write('}')
+        output.write(']')
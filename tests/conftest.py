@@ -0,0 +1,27 @@
+import importlib
+import pytest
+import sys
+import os
+
+# The repository is the pylfer package itself, so it's imported from the directory containing it (or by path, if
+# the repository was checked out under some other name)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(ROOT))
+try:
+    importlib.import_module('pylfer')
+except ImportError:
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(
+        'pylfer', os.path.join(ROOT, '__init__.py'), submodule_search_locations=[ROOT]
+    )
+    sys.modules['pylfer'] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(sys.modules['pylfer'])
+
+TEMPLATE_PATH = os.path.join(ROOT, 'templates')
+
+
+@pytest.fixture
+def manager(tmpdir):
+    """ Manager rendering the bundled templates to a temporary directory and returning raw HTML or file paths """
+    from pylfer.manager import VizManager
+    return VizManager(TEMPLATE_PATH, render_path=str(tmpdir)).configure(display=False)
@@ -0,0 +1,49 @@
+import asyncio
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import TEMPLATE_PATH
+from pylfer.aio import AsyncVizManager
+from pylfer.template import NVD3LineChart
+
+
+def _frame():
+    return pd.DataFrame({'a': np.arange(100.), 'b': np.arange(100.) ** 2}, index=np.arange(100))
+
+
+def _manager(tmpdir, **kwargs):
+    stats = []
+    manager = AsyncVizManager(TEMPLATE_PATH, render_path=str(tmpdir)).configure(
+        display=False, on_render=stats.append, **kwargs
+    )
+    return manager, stats
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_async_render_to_file_reports_html_size(tmpdir, stream):
+    manager, stats = _manager(tmpdir, stream=stream)
+    filename = asyncio.run(manager.render_async(
+        'nvd3_line_zoom', _frame(), transform=NVD3LineChart().transform, filename='chart'
+    ))
+    assert [s.html_bytes for s in stats] == [os.path.getsize(filename)]
+    assert stats[0].rows == 100
+
+    # The size matches that reported for the same render made synchronously
+    manager.render('nvd3_line_zoom', _frame(), transform=NVD3LineChart().transform, filename='sync_chart')
+    assert stats[1].html_bytes == stats[0].html_bytes
+
+
+def test_async_render_without_file_reports_html_size(tmpdir):
+    manager, stats = _manager(tmpdir)
+    html = asyncio.run(manager.render_async('nvd3_line_zoom', _frame(), transform=NVD3LineChart().transform))
+    assert [s.html_bytes for s in stats] == [len(html)]
+    assert html == manager.render('nvd3_line_zoom', _frame(), transform=NVD3LineChart().transform)
+
+
+def test_async_render_errors_raised(tmpdir):
+    def fail(data, output):
+        raise ValueError('bad transform')
+    manager, stats = _manager(tmpdir)
+    with pytest.raises(Exception, match='bad transform'):
+        asyncio.run(manager.render_async('nvd3_line_zoom', _frame(), transform=fail, filename='chart'))
@@ -0,0 +1,81 @@
+import io
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from pylfer.arrow import ArrowSource, to_frame
+from pylfer.engine import VizEngine
+from pylfer.template import NVD3LineChart
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+feather = pytest.importorskip('pyarrow.feather')
+
+# 2020-01-01 00:00 UTC, the first timestamp of every table below
+START_MS = 1577836800000
+
+
+def _table(unit):
+    ts = pa.array(START_MS + np.arange(3, dtype='int64') * 60000, pa.int64()).cast(pa.timestamp('ms')).cast(
+        pa.timestamp(unit)
+    )
+    return pa.table({'ts': ts, 'a': [1., 2., 3.], 'b': [4, 5, 6], 'c': ['x', 'y', 'z']})
+
+
+def _x_values(data):
+    output = io.StringIO()
+    NVD3LineChart().transform(data, output)
+    return [[point['x'] for point in series['values']] for series in json.loads(output.getvalue())]
+
+
+@pytest.mark.parametrize('unit', ['s', 'ms', 'us', 'ns'])
+def test_timestamp_index_written_as_epoch_ms(unit):
+    data = to_frame(ArrowSource(_table(unit), columns=['a'], index='ts'))
+    assert list(data.columns) == ['a']
+    assert _x_values(data) == [[START_MS, START_MS + 60000, START_MS + 120000]]
+
+
+@pytest.mark.parametrize('unit', ['ms', 'us'])
+def test_render_from_parquet_file(manager, tmpdir, unit):
+    path = str(tmpdir.join('data.parquet'))
+    pq.write_table(_table(unit), path, coerce_timestamps=unit)
+    assert pq.read_schema(path).field('ts').type == pa.timestamp(unit)
+
+    html = VizEngine(manager).nvd3_line_chart(ArrowSource(path, columns=['a', 'b'], index='ts'))
+    assert '{"x":%d,"y":1.0}' % START_MS in html
+    assert '{"x":%d,"y":6}' % (START_MS + 120000) in html
+    assert '"x":0,' not in html
+
+
+def test_feather_file_and_table_match_data_frame(tmpdir):
+    table = _table('ms')
+    path = str(tmpdir.join('data.feather'))
+    feather.write_feather(table, path, compression='uncompressed')
+    expected = pd.DataFrame(
+        {'a': [1., 2., 3.], 'b': [4, 5, 6]},
+        index=pd.Index(pd.to_datetime(START_MS + np.arange(3) * 60000, unit='ms'), name='ts')
+    )
+    for source in (path, table, table.to_batches()):
+        data = to_frame(source, columns=['a', 'b'], index='ts')
+        assert list(data.columns) == ['a', 'b']
+        assert list(data.index.astype('datetime64[ns]')) == list(expected.index)
+        assert _x_values(data) == _x_values(expected)
+
+
+def test_missing_index_column_raises():
+    with pytest.raises(ValueError):
+        to_frame(_table('ms'), index='missing')
+
+
+def test_paths_without_arrow_extensions_rejected():
+    assert to_frame('data.csv') == 'data.csv'
+    with pytest.raises(ValueError):
+        ArrowSource('data.csv')
+
+
+def test_iter_frames_reads_batches(tmpdir):
+    path = str(tmpdir.join('data.parquet'))
+    pq.write_table(_table('ms'), path)
+    frames = list(ArrowSource(path, columns=['a'], index='ts').iter_frames(batch_size=2))
+    assert [len(frame) for frame in frames] == [2, 1]
+    assert pd.concat(frames)['a'].tolist() == [1., 2., 3.]
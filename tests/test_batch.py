@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pylfer.batch import FrameRef, RenderError, split_transform, join_transform
+from pylfer.template import NVD3LineChart
+
+
+def _frame(index):
+    return pd.DataFrame({
+        'value': np.arange(4.),
+        'count': np.arange(4),
+        'label': list('abcd'),
+        'local': pd.date_range('2021-03-27', periods=4, freq='D', tz='Europe/Paris'),
+        'naive': pd.date_range('2021-03-27', periods=4, freq='D')
+    }, index=pd.Index(index, name='when'))
+
+
+@pytest.mark.parametrize('index', [
+    pd.date_range('2020-01-01', periods=4, freq='h'),
+    pd.date_range('2020-01-01', periods=4, freq='h', tz='US/Eastern'),
+    np.arange(4) * .5
+])
+def test_frame_ref_round_trip(tmpdir, index):
+    data = _frame(index)
+    ref = FrameRef(data, str(tmpdir))
+    pd.testing.assert_frame_equal(ref.load(), data, check_freq=False)
+    assert (ref.column(0) == data['value'].values).all()
+    assert (ref.column(3) == data['local']).all()
+
+
+@pytest.mark.parametrize('unit', ['s', 'ms', 'us'])
+def test_frame_ref_keeps_date_resolution(tmpdir, unit):
+    if not hasattr(pd.DatetimeIndex, 'as_unit'):
+        pytest.skip('Dates only have a resolution other than ns from pandas 2 onwards')
+    data = _frame(pd.date_range('2020-01-01', periods=4, freq='h', tz='UTC').as_unit(unit))
+    data['local'] = data['local'].dt.as_unit(unit)
+    loaded = FrameRef(data, str(tmpdir)).load()
+    pd.testing.assert_frame_equal(loaded, data, check_freq=False)
+    assert loaded.index[0] == pd.Timestamp('2020-01-01', tz='UTC')
+
+
+def test_transforms_survive_split():
+    viz = NVD3LineChart(payload='binary')
+    transform = join_transform(split_transform(viz.transform))
+    assert transform.__self__ is viz and transform.__name__ == 'transform'
+
+
+def test_render_error_pickles():
+    import pickle
+    error = pickle.loads(pickle.dumps(RenderError(3, 'ValueError()', 'trace')))
+    assert (error.index, error.error, error.trace) == (3, 'ValueError()', 'trace')
+
+
+def _failing_transform(data, output):
+    raise ValueError('Bad data')
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_render_many_fails_bad_jobs_alone(manager, tmpdir, executor):
+    # Jobs fail while being prepared (streamgraph doesn't support data files), in a worker (the transform
+    # raises) and while being saved (the directory doesn't exist), in between jobs that succeed
+    manager.configure(data_files=True)
+    viz = NVD3LineChart()
+    data = pd.DataFrame({'a': np.arange(10.)}, index=pd.date_range('2020-01-01', periods=10, freq='h'))
+    good = {'template': viz.get_template(), 'data': data, 'transform': viz.transform, 'x_is_date': True}
+    jobs = [
+        dict(good, filename='first'),
+        {'template': 'streamgraph', 'data': data, 'filename': 'stream'},
+        dict(good, filename='failed', transform=_failing_transform),
+        dict(good, filename=str(tmpdir.join('missing', 'chart'))),
+        dict(good, filename='last')
+    ]
+    results = manager.render_many(jobs, n_jobs=2, executor=executor)
+    assert results[0] == str(tmpdir.join('first.html')) and results[4] == str(tmpdir.join('last.html'))
+    assert [r.index for r in results[1:4]] == [1, 2, 3]
+    assert all(isinstance(r, RenderError) for r in results[1:4])
+    assert 'data_url' in results[1].error and 'Bad data' in results[2].error
+
+
+def test_render_many_matches_render(manager):
+    viz = NVD3LineChart(payload='binary')
+    index = pd.date_range('2020-01-01', periods=10, freq='h')
+    data = pd.DataFrame({'a': np.arange(10.)}, index=index.as_unit('ms') if hasattr(index, 'as_unit') else index)
+    job = {'template': viz.get_template(), 'data': data, 'transform': viz.transform, 'x_is_date': True}
+    expected = manager.render(**job)
+    assert manager.render_many([job, job], n_jobs=2, executor='process') == [expected, expected]
@@ -0,0 +1,83 @@
+import functools
+import shutil
+import os
+import numpy as np
+import pandas as pd
+from conftest import TEMPLATE_PATH
+from pylfer.cache import RenderCache, describe, hash_data
+from pylfer.manager import VizManager
+from pylfer.template import NVD3LineChart
+
+
+def _frame():
+    return pd.DataFrame({'a': np.arange(10.)}, index=np.arange(10))
+
+
+def _scale(factor):
+    return lambda data, output: output.write(str(data * factor))
+
+
+def _write(data, output, factor=1):
+    output.write(str(data * factor))
+
+
+def test_describe_distinguishes_closures_lambdas_and_partials():
+    assert describe(_scale(1)) == describe(_scale(1))
+    assert describe(_scale(1)) != describe(_scale(2))
+    assert describe(lambda d, o: o.write('a')) != describe(lambda d, o: o.write('b'))
+    assert describe(functools.partial(_write, factor=1)) != describe(functools.partial(_write, factor=2))
+    assert describe(NVD3LineChart().transform) != describe(NVD3LineChart(payload='binary').transform)
+
+
+def test_describe_rejects_values_identified_only_by_address():
+    assert describe(object()) is None
+    assert describe({'key': object()}) is None
+
+
+def test_hash_data_depends_on_content_and_index():
+    data = _frame()
+    assert hash_data(data) == hash_data(data.copy())
+    assert hash_data(data) != hash_data(data + 1)
+    assert hash_data(data) != hash_data(data.set_axis(np.arange(1, 11)))
+
+
+def test_memory_tier_evicts_least_recently_used(tmpdir):
+    cache = RenderCache(str(tmpdir), max_memory_bytes=10, max_disk_bytes=0)
+    cache.put('a', 'aaaa')
+    cache.put('b', 'bbbb')
+    assert cache.get('a') == 'aaaa'
+    cache.put('c', 'cccc')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'aaaa' and cache.get('c') == 'cccc'
+
+
+def test_disk_tier_shared_between_caches(tmpdir):
+    RenderCache(str(tmpdir), max_memory_bytes=0).put('a', 'content')
+    assert RenderCache(str(tmpdir), max_memory_bytes=0).get('a') == 'content'
+
+
+def test_render_reuses_cached_content(manager):
+    stats = []
+    manager.configure(cache_memory_bytes=2**20, on_render=stats.append)
+    viz, data = NVD3LineChart(), _frame()
+    first = manager.render(viz.get_template(), data, transform=viz.transform, x_is_date=False)
+    assert manager.render(viz.get_template(), data, transform=viz.transform, x_is_date=False) == first
+    manager.render(viz.get_template(), data + 1, transform=viz.transform, x_is_date=False)
+    assert [s.cached for s in stats] == [False, True, False]
+
+
+def test_changes_to_included_templates_invalidate_cache(tmpdir):
+    templates = str(tmpdir.join('templates'))
+    shutil.copytree(TEMPLATE_PATH, templates)
+    viz, data = NVD3LineChart(), _frame()
+
+    def render():
+        manager = VizManager(templates, render_path=str(tmpdir)).configure(display=False, cache_disk_bytes=2**20)
+        return manager.render(viz.get_template(), data, transform=viz.transform, x_is_date=False)
+
+    assert '<!-- changed -->' not in render()
+    payload = os.path.join(templates, '_payload.html')
+    with open(payload, 'a') as f:
+        f.write('<!-- changed -->\n')
+    os.utime(payload, (os.path.getmtime(payload) + 10,) * 2)
+    assert '<!-- changed -->' in render()
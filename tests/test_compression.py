@@ -0,0 +1,40 @@
+import gzip
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from pylfer.compression import CompressedWriter, TeeWriter, compressed_path, read_compressed
+from pylfer.template import NVD3LineChart
+
+
+def test_compressed_writer_round_trip_and_deterministic(tmpdir):
+    paths = [str(tmpdir.mkdir(name).join('chart.html')) for name in ('a', 'b')]
+    for path in paths:
+        with CompressedWriter(path, level=9) as f:
+            f.write(u'<p>caf\xe9</p>' * 100)
+            f.write(b'<p>bytes</p>')
+    assert read_compressed(paths[0]) == u'<p>caf\xe9</p>' * 100 + u'<p>bytes</p>'
+    with open(compressed_path(paths[0]), 'rb') as a, open(compressed_path(paths[1]), 'rb') as b:
+        assert a.read() == b.read()
+    assert not os.path.exists(paths[0])
+
+
+def test_writers_reject_iteration_and_unknown_methods(tmpdir):
+    path = str(tmpdir.join('a.html'))
+    with CompressedWriter(path) as f, TeeWriter(f) as tee:
+        with pytest.raises(TypeError):
+            iter(tee)
+    with pytest.raises(ValueError):
+        CompressedWriter(path, method='zip')
+
+
+@pytest.mark.parametrize('stream', [False, True])
+@pytest.mark.parametrize('compression_only', [False, True])
+def test_render_writes_compressed_copy(manager, stream, compression_only):
+    manager.configure(stream=stream, compression='gzip', compression_only=compression_only)
+    data = pd.DataFrame({'a': np.arange(100.)}, index=np.arange(100))
+    html = manager.render('nvd3_line_zoom', data, transform=NVD3LineChart().transform)
+    filename = manager.render('nvd3_line_zoom', data, transform=NVD3LineChart().transform, filename='chart')
+    with gzip.open(filename + '.gz', 'rb') as f:
+        assert f.read().decode('utf-8') == html
+    assert os.path.exists(filename) != compression_only
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+import json
+import io
+from pylfer.downsample import downsample_series
+from pylfer.template import NVD3LineChart, NVD3StackedAreaChart
+
+
+def _frame(n=10000, k=3, seed=0):
+    values = np.random.RandomState(seed).randn(n, k).cumsum(axis=0)
+    return pd.DataFrame(values, columns=['c{}'.format(i) for i in range(k)], index=np.arange(n) * .5)
+
+
+@pytest.mark.parametrize('method', ['lttb', 'minmax'])
+def test_each_series_within_max_points(method):
+    data = _frame()
+    data.iloc[np.random.RandomState(1).rand(len(data)) < .05, 1] = np.nan
+    rows = downsample_series(data, data.index, 100, method=method)
+    assert len(rows) == 3
+    for r in rows:
+        assert 3 <= len(r) <= 100
+        assert r[0] == 0 and r[-1] == len(data) - 1
+        assert (np.diff(r) > 0).all()
+
+
+def test_minmax_keeps_extremes():
+    data = _frame()
+    rows = downsample_series(data, data.index, 200, method='minmax')
+    for i, r in enumerate(rows):
+        assert data.iloc[:, i].values.argmax() in r
+        assert data.iloc[:, i].values.argmin() in r
+
+
+def test_shared_rows_within_max_points_in_total():
+    data = _frame()
+    rows = downsample_series(data, data.index, 99, shared=True)
+    assert all(r is rows[0] for r in rows)
+    assert len(rows[0]) <= 99
+
+
+def test_small_frames_not_downsampled():
+    data = _frame(n=50)
+    assert downsample_series(data, data.index, 50) is None
+
+
+def test_invalid_arguments():
+    data = _frame()
+    with pytest.raises(ValueError):
+        downsample_series(data, data.index, 100, method='mean')
+    with pytest.raises(ValueError):
+        downsample_series(data, data.index, 2)
+
+
+def test_non_numeric_columns_keep_every_row():
+    data = _frame(n=1000, k=2)
+    data['label'] = ['row {}'.format(i) for i in range(len(data))]
+    rows = downsample_series(data, data.index, 50)
+    assert all(len(r) <= 50 for r in rows[:2])
+    assert list(rows[2]) == list(range(len(data)))
+
+    shared = downsample_series(data, data.index, 50, shared=True)
+    assert all(list(r) == list(shared[0]) for r in shared)
+    assert downsample_series(data[['label']], data.index, 50) is None
+
+
+def test_transform_with_non_numeric_column():
+    data = _frame(n=1000, k=1)
+    data['label'] = 'a'
+    for viz in (NVD3LineChart(max_points=50), NVD3StackedAreaChart(max_points=50)):
+        output = io.StringIO()
+        viz.transform(data, output)
+        series = json.loads(output.getvalue())
+        assert len(series[0]['values']) <= 50
+        assert {p['y'] if isinstance(p, dict) else p[1] for p in series[1]['values']} == {'a'}
@@ -0,0 +1,129 @@
+import base64
+import io
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from pylfer import encoding
+from pylfer.encoding import (
+    to_json_literals, write_points, write_literals, write_series, write_columnar_series, write_binary_array,
+    write_binary_series
+)
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    """ Encode a few values at a time so that chunk boundaries are crossed by small arrays """
+    monkeypatch.setattr(encoding, 'CHUNK_SIZE', 4)
+
+
+def _frame():
+    return pd.DataFrame({
+        'a': [1.5, np.nan, -np.inf, 1e-20, 2.25, 1. / 3, 7., 8., 9., 10.],
+        'b': np.arange(10, dtype='int32'),
+        'c': [True, False] * 5
+    }, index=np.arange(10) * 1000)
+
+
+def _props(col):
+    return {'key': col}
+
+
+def _write(fn, *args, **kwargs):
+    output = io.StringIO()
+    fn(output, *args, **kwargs)
+    return output.getvalue()
+
+
+def _decode(array):
+    # Decode a binary array written by write_binary_array
+    if array['dtype'] == 'json':
+        return array['data']
+    return np.frombuffer(base64.b64decode(array['data']), dtype='<i8' if array['dtype'] == 'int64' else '<f8')
+
+
+def test_literals_for_each_type():
+    assert list(to_json_literals([1, -2])) == ['1', '-2']
+    assert list(to_json_literals([True, False])) == ['true', 'false']
+    assert list(to_json_literals([.5, np.nan, np.inf, -np.inf])) == ['0.5', 'null', 'null', 'null']
+    assert list(to_json_literals(['a', None, 'q"uote'])) == ['"a"', 'null', '"q\\"uote"']
+    assert list(to_json_literals(np.array([1., np.nan], dtype=object))) == ['1.0', 'null']
+
+
+def test_literals_keep_full_precision_unless_limited():
+    values = [1. / 3, 123456.789, 1e-20]
+    assert [float(v) for v in to_json_literals(values)] == values
+    assert list(to_json_literals(values, precision=3)) == ['0.333', '1.23e+05', '1e-20']
+    assert list(to_json_literals([np.nan, 2.], precision=3)) == ['null', '2']
+
+
+@pytest.mark.parametrize('point_format', ['[%s,%s]', '{"x":%s,"y":%s}'])
+def test_points_across_chunks(small_chunks, point_format):
+    data = _frame()
+    for n in (0, 1, 4, 5, 10):
+        points = json.loads('[' + _write(write_points, data.index[:n], data['a'][:n], point_format) + ']')
+        assert len(points) == n
+        pairs = [p if isinstance(p, list) else [p['x'], p['y']] for p in points]
+        expected = [y if np.isfinite(y) else None for y in data['a'][:n]]
+        assert pairs == [[x, y] for x, y in zip(data.index[:n], expected)]
+
+
+def test_literals_across_chunks(small_chunks):
+    for n in (0, 3, 4, 9):
+        assert json.loads(_write(write_literals, np.arange(n))) == list(range(n))
+
+
+def test_json_series(small_chunks):
+    data = _frame()
+    series = json.loads(_write(write_series, data, data.index.values, _props, 'values', '{"x":%s,"y":%s}'))
+    assert [s['key'] for s in series] == ['a', 'b', 'c']
+    assert [p['y'] for p in series[0]['values']][:3] == [1.5, None, None]
+    assert [p['y'] for p in series[2]['values']][:2] == [True, False]
+    assert [p['x'] for p in series[1]['values']] == list(data.index)
+
+
+@pytest.mark.parametrize('rows', [None, [np.array([0, 9]), np.arange(10), np.array([], dtype=int)]])
+def test_columnar_series_matches_json_series(small_chunks, rows):
+    data = _frame()
+    expected = json.loads(_write(
+        write_series, data, data.index.values, _props, 'values', '[%s,%s]', precision=4, rows=rows
+    ))
+    columnar = json.loads(_write(write_columnar_series, data, data.index.values, _props, precision=4, rows=rows))
+    assert columnar['format'] == 'columnar'
+    for s, e in zip(columnar['series'], expected):
+        index = columnar['index'] if rows is None else s['index']
+        assert s['key'] == e['key']
+        assert [list(p) for p in zip(index, s['values'])] == e['values']
+
+
+def test_columnar_index_never_loses_precision():
+    data = pd.DataFrame({'a': [1., 2.]}, index=[1577836800000, 1577836800001])
+    columnar = json.loads(_write(write_columnar_series, data, data.index.values, _props, precision=3))
+    assert columnar['index'] == [1577836800000, 1577836800001]
+    assert columnar['series'][0]['values'] == [1., 2.]
+
+
+@pytest.mark.parametrize('n', [0, 1, 11, 12, 13, 25])
+def test_binary_arrays_round_trip_across_chunks(small_chunks, n):
+    for values in (np.random.RandomState(n).randn(n), np.arange(n, dtype='int32'), np.arange(n) % 2 == 0):
+        array = json.loads(_write(write_binary_array, values))
+        assert '=' not in array['data'].rstrip('=')
+        assert array['dtype'] == ('float64' if values.dtype.kind == 'f' else 'int64')
+        assert np.array_equal(_decode(array), values)
+
+
+def test_binary_arrays_of_strings_written_as_json():
+    assert json.loads(_write(write_binary_array, np.array(['a', 'b']))) == {'dtype': 'json', 'data': ['a', 'b']}
+
+
+@pytest.mark.parametrize('rows', [None, [np.array([0, 9]), np.arange(10), np.array([], dtype=int)]])
+def test_binary_series_matches_data(small_chunks, rows):
+    data = _frame()
+    binary = json.loads(_write(write_binary_series, data, data.index.values, _props, rows=rows))
+    assert binary['format'] == 'binary'
+    for i, s in enumerate(binary['series']):
+        selected = slice(None) if rows is None else rows[i]
+        index = _decode(binary['index'] if rows is None else s['index'])
+        assert s['key'] == data.columns[i]
+        assert np.array_equal(index, data.index.values[selected])
+        assert np.array_equal(_decode(s['values']), data.iloc[:, i].values[selected], equal_nan=True)
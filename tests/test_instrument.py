@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pylfer.instrument import RenderStats, bind, check_profile_mode, current, instrument, stage
+from pylfer.template import NVD3LineChart
+
+
+def test_check_profile_mode():
+    check_profile_mode(None)
+    check_profile_mode('cprofile')
+    check_profile_mode('tracemalloc')
+    with pytest.raises(ValueError):
+        check_profile_mode('line_profiler')
+
+
+def test_stages_recorded_only_while_instrumented():
+    stats = RenderStats('chart')
+    with stage('transform'):
+        pass
+    with instrument(stats):
+        with stage('transform'):
+            with stage('encode'):
+                pass
+        with stage('transform'):
+            pass
+        assert current() is stats
+    assert current() is None
+    assert list(stats.timings) == ['encode', 'transform', 'total']
+    assert stats.timings['total'] >= stats.timings['transform'] >= stats.timings['encode'] >= 0
+
+
+def test_bind_nests_and_restores_stats():
+    outer, inner = RenderStats('outer'), RenderStats('inner')
+    with bind(outer):
+        with bind(inner):
+            with stage('write'):
+                pass
+        assert current() is outer
+    assert current() is None
+    assert 'write' in inner.timings and not outer.timings
+
+
+@pytest.mark.parametrize('profile', ['cprofile', 'tracemalloc'])
+def test_render_stats_with_profile(manager, profile):
+    stats = []
+    manager.configure(on_render=stats.append, profile=profile)
+    data = pd.DataFrame({'a': np.arange(10.), 'b': np.arange(10.)}, index=np.arange(10))
+    html = manager.render('nvd3_line_zoom', data, transform=NVD3LineChart().transform)
+    assert len(stats) == 1 and manager.last_stats is stats[0]
+    assert stats[0].rows == 10 and stats[0].points == 20
+    assert stats[0].html_bytes == len(html)
+    assert stats[0].profile is not None
+    assert set(stats[0].as_dict()) == {
+        'template', 'filename', 'rows', 'points', 'payload_bytes', 'html_bytes', 'cached', 'peak_memory', 'timings'
+    }
@@ -0,0 +1,68 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from pylfer.template import NVD3LineChart
+
+
+def _frame(start, stop, dates=False):
+    index = pd.date_range('2020-01-01', periods=stop, freq='60s')[start:] if dates else np.arange(start, stop)
+    return pd.DataFrame({'a': np.arange(start, stop, dtype=float)}, index=index)
+
+
+def _deltas(filename):
+    with open(filename + '.delta') as f:
+        return [json.loads(line) for line in f.read().splitlines()]
+
+
+def _x_values(payload):
+    return [point['x'] for point in payload[0]['values']]
+
+
+@pytest.mark.parametrize('dates', [False, True])
+def test_append_writes_only_new_rows(manager, dates):
+    transform = NVD3LineChart().transform
+    filename = manager.render('nvd3_line_zoom', _frame(0, 5, dates), transform=transform, filename='live', live=True)
+    assert os.path.getsize(filename + '.delta') == 0
+    assert 'live.html.delta' in open(filename).read()
+
+    # The full history can be given each time, along with rows already appended
+    assert manager.append('live', _frame(0, 8, dates), transform=transform) == 3
+    assert manager.append('live', _frame(0, 8, dates), transform=transform) == 0
+    assert manager.append('live', _frame(6, 10, dates), transform=transform) == 2
+
+    deltas = _deltas(filename)
+    assert [len(_x_values(d)) for d in deltas] == [3, 2]
+    expected = [int(t.value // 10 ** 6) for t in _frame(5, 10, dates).index] if dates else list(range(5, 10))
+    assert _x_values(deltas[0]) + _x_values(deltas[1]) == expected
+
+
+def test_append_since_and_unsorted_rows(manager):
+    transform = NVD3LineChart().transform
+    filename = manager.render('nvd3_line_zoom', _frame(0, 3), transform=transform, filename='live', live=True)
+    assert manager.append('live', _frame(0, 10).iloc[::-1], transform=transform, since=7) == 2
+    assert sorted(_x_values(_deltas(filename)[0])) == [8, 9]
+
+
+def test_append_state_shared_between_managers(manager, tmpdir):
+    from pylfer.manager import VizManager
+    transform = NVD3LineChart().transform
+    manager.render('nvd3_line_zoom', _frame(0, 3, True), transform=transform, filename='live', live=True)
+    other = VizManager(manager.template_path, render_path=str(tmpdir)).configure(display=False)
+    assert other.append('live', _frame(0, 4, True), transform=transform) == 1
+    assert manager.append('live', _frame(0, 4, True), transform=transform) == 0
+
+
+def test_render_again_resets_deltas(manager):
+    transform = NVD3LineChart().transform
+    filename = manager.render('nvd3_line_zoom', _frame(0, 3), transform=transform, filename='live', live=True)
+    manager.append('live', _frame(0, 5), transform=transform)
+    manager.render('nvd3_line_zoom', _frame(0, 5), transform=transform, filename='live', live=True)
+    assert _deltas(filename) == []
+
+
+def test_append_requires_live_render(manager):
+    manager.render('nvd3_line_zoom', _frame(0, 3), transform=NVD3LineChart().transform, filename='static')
+    with pytest.raises(ValueError):
+        manager.append('static', _frame(0, 5))
@@ -0,0 +1,112 @@
+import gzip
+import io
+import os
+import pytest
+from pylfer.server import RenderServer
+try:
+    from http.client import HTTPConnection
+except ImportError:
+    from httplib import HTTPConnection
+
+CONTENT = ''.join('<p>row {}</p>\n'.format(i) for i in range(500)).encode('utf-8')
+
+
+@pytest.fixture
+def server(tmpdir):
+    with open(str(tmpdir.join('chart.html')), 'wb') as f:
+        f.write(CONTENT)
+    with open(str(tmpdir.join('chart.html.delta')), 'wb') as f:
+        f.write(b'{"n": 1}\n{"n": 2}\n')
+    server = RenderServer(str(tmpdir), max_cache_bytes=2**20).start()
+    yield server
+    server.stop()
+
+
+def _get(server, path, method='GET', **headers):
+    connection = HTTPConnection(server.host, server.port)
+    connection.request(method, path, headers=dict((k.replace('_', '-'), v) for k, v in headers.items()))
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+    return response.status, dict((k.lower(), v) for k, v in response.getheaders()), body
+
+
+def test_plain_and_gzip_responses(server):
+    status, headers, body = _get(server, '/chart.html')
+    assert status == 200 and body == CONTENT and 'content-encoding' not in headers
+    assert headers['content-length'] == str(len(CONTENT))
+
+    status, headers, body = _get(server, '/chart.html', Accept_Encoding='gzip')
+    assert status == 200 and headers['content-encoding'] == 'gzip'
+    assert gzip.GzipFile(fileobj=io.BytesIO(body)).read() == CONTENT
+    assert headers['vary'] == 'Accept-Encoding'
+
+
+def test_revalidation(server):
+    for encoding in ('identity', 'gzip'):
+        status, headers, _ = _get(server, '/chart.html', Accept_Encoding=encoding)
+        status, _, body = _get(server, '/chart.html', Accept_Encoding=encoding, If_None_Match=headers['etag'])
+        assert status == 304 and body == b''
+        status, _, body = _get(server, '/chart.html', Accept_Encoding=encoding,
+                               If_Modified_Since=headers['last-modified'])
+        assert status == 304 and body == b''
+    status, _, _ = _get(server, '/chart.html', If_None_Match='"stale"')
+    assert status == 200
+
+
+def test_revalidation_does_not_compress(server):
+    _, headers, _ = _get(server, '/chart.html', Accept_Encoding='gzip')
+    server._compressed.clear()
+    status, _, _ = _get(server, '/chart.html', Accept_Encoding='gzip', If_None_Match=headers['etag'])
+    assert status == 304 and len(server._compressed) == 0
+
+
+def test_large_files_streamed(server):
+    server.max_cache_bytes = 100
+    status, headers, body = _get(server, '/chart.html', Accept_Encoding='gzip')
+    assert status == 200 and 'content-length' not in headers
+    assert gzip.GzipFile(fileobj=io.BytesIO(body)).read() == CONTENT
+    assert len(server._compressed) == 0
+
+
+def test_compressed_cache_bounded(tmpdir):
+    # Room for two compressed files but not three
+    server = RenderServer(str(tmpdir), max_cache_bytes=int(len(gzip.compress(CONTENT)) * 2.5))
+    for name in ('a.html', 'b.html', 'c.html', 'a.html'):
+        with open(str(tmpdir.join(name)), 'wb') as f:
+            f.write(CONTENT + name.encode('utf-8'))
+        server.compress(str(tmpdir.join(name)))
+    assert sorted(os.path.basename(p) for p in server._compressed) == ['a.html', 'c.html']
+    assert server._compressed_bytes <= server.max_cache_bytes
+    server.stop()
+
+
+def test_byte_ranges(server):
+    status, headers, body = _get(server, '/chart.html.delta', Accept_Encoding='gzip', Range='bytes=9-')
+    assert status == 206 and body == b'{"n": 2}\n' and 'content-encoding' not in headers
+    assert headers['content-range'] == 'bytes 9-17/18'
+
+    assert _get(server, '/chart.html.delta', Range='bytes=-4')[2] == b' 2}\n'
+    assert _get(server, '/chart.html.delta', Range='bytes=0-3')[2] == b'{"n"'
+
+    # Nothing has been appended beyond the end of the file
+    status, headers, body = _get(server, '/chart.html.delta', Range='bytes=18-')
+    assert status == 416 and headers['content-range'] == 'bytes */18' and body == b''
+
+    # Ranges that can't be parsed, or that are conditional on another version of the file, are ignored
+    assert _get(server, '/chart.html.delta', Range='lines=1-')[0] == 200
+    assert _get(server, '/chart.html.delta', Range='bytes=9-', If_Range='"stale"')[0] == 200
+
+
+def test_hidden_and_missing_files(server, tmpdir):
+    tmpdir.mkdir('.pylfer_cache')
+    with open(str(tmpdir.join('.pylfer_cache', 'entry.html')), 'wb') as f:
+        f.write(b'secret')
+    assert _get(server, '/.pylfer_cache/entry.html')[0] == 404
+    assert _get(server, '/../chart.html')[0] == 404
+    assert _get(server, '/missing.html')[0] == 404
+
+
+def test_url(server, tmpdir):
+    assert server.url(str(tmpdir.join('a b.html'))) == server.base_url + 'a%20b.html'
+    assert server.url('/elsewhere/chart.html') is None
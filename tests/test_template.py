@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+import io
+from pylfer.template import get_data_index, NVD3LineChart
+
+# 2020-01-01 05:00 UTC, the first timestamp of every index below
+START_MS = 1577854800000
+
+
+def _as_unit(index, unit):
+    if unit is None:
+        return index
+    if not hasattr(index, 'as_unit'):
+        pytest.skip('Date indexes only have a resolution other than ns from pandas 2 onwards')
+    return index.as_unit(unit)
+
+
+@pytest.mark.parametrize('unit', [None, 's', 'ms', 'us', 'ns'])
+def test_date_index_converted_to_epoch_ms(unit):
+    index = _as_unit(pd.date_range('2020-01-01 05:00', periods=3, freq='60s'), unit)
+    data = pd.DataFrame({'a': [1., 2., 3.]}, index=index)
+    assert list(get_data_index(data)) == [START_MS, START_MS + 60000, START_MS + 120000]
+
+
+@pytest.mark.parametrize('unit', [None, 's', 'ms', 'us', 'ns'])
+def test_timezone_aware_date_index_converted_to_utc_epoch_ms(unit):
+    index = _as_unit(pd.date_range('2020-01-01 00:00', periods=3, freq='60s', tz='US/Eastern'), unit)
+    data = pd.DataFrame({'a': [1., 2., 3.]}, index=index)
+    assert list(get_data_index(data)) == [START_MS, START_MS + 60000, START_MS + 120000]
+
+
+def test_numeric_index_unchanged():
+    data = pd.DataFrame({'a': [1., 2., 3.]}, index=[.5, 1., 1.5])
+    assert list(get_data_index(data)) == [.5, 1., 1.5]
+
+
+def test_transform_writes_epoch_ms_for_second_resolution_index():
+    index = _as_unit(pd.date_range('2020-01-01 05:00', periods=2, freq='60s'), 's')
+    output = io.StringIO()
+    NVD3LineChart().transform(pd.DataFrame({'a': [1., np.nan]}, index=index), output)
+    assert output.getvalue() == (
+        '[{"area": false, "key": "a", "values": [{"x":1577854800000,"y":1.0},{"x":1577854860000,"y":null}]}]'
+    )
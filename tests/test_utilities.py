@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pylfer.utilities import get_histograms, get_histograms_chunked
+
+
+def _frame():
+    state = np.random.RandomState(0)
+    data = pd.DataFrame(state.randn(200, 4), columns=['t', 'a', 'b', 'c'])
+    data.iloc[::7, 1] = np.nan
+    data.iloc[::11, 2] = -999
+    data.iloc[::13, 3] = np.inf
+    return data
+
+
+def _assert_same(actual, expected):
+    assert sorted(actual) == sorted(expected)
+    for col in expected:
+        pd.testing.assert_frame_equal(actual[col], expected[col])
+
+
+def test_histograms_count_every_row():
+    hists = get_histograms(_frame(), 't', sentinels={-999: 'unknown'})
+    assert sorted(hists) == ['a', 'b', 'c']
+    for hist in hists.values():
+        assert hist.sum().sum() == 200
+    assert hists['b'].filter(like='unknown').sum().sum() == len(range(0, 200, 11))
+
+
+def test_chunked_histograms_match():
+    data = _frame()
+    expected = get_histograms(data, 't', sentinels={-999: 'unknown'})
+    chunks = [data.iloc[start:start + 30] for start in range(0, len(data), 30)]
+    _assert_same(get_histograms_chunked(chunks, 't', sentinels={-999: 'unknown'}), expected)
+    _assert_same(get_histograms_chunked(lambda: iter(chunks), 't', sentinels={-999: 'unknown'}), expected)
+
+
+def test_parallel_histograms_match():
+    data = _frame()
+    _assert_same(get_histograms(data, 't', n_jobs=2), get_histograms(data, 't'))
+
+
+def test_chunked_histograms_reject_iterators():
+    with pytest.raises(ValueError):
+        get_histograms_chunked(iter([_frame()]), 't')
+    with pytest.raises(ValueError):
+        get_histograms_chunked([], 't')
@@ -1,68 +1,318 @@
 __author__ = 'eczech'
 
+from pylfer.batch import FrameRef
+from pylfer.arrow import to_frame, to_chunks
+import multiprocessing
 import numpy as np
-import pandas as pd
-from matplotlib import pyplot as plt
-import matplotlib
+import tempfile
+import shutil
+import os
 
 
-def get_histograms(data, target, sentinels=None, bins=5):
-    cols = [col for col in data if col != target]
+# Maximum number of cells binned at once; columns are processed in blocks
+# no larger than this to bound the size of intermediate code arrays
+BLOCK_CELLS = 2 ** 24
+
+# Label for missing values in histogram results
+NAN_LABEL = 'nan'
+
+# State shared by every task run within a histogram worker process (see _init_histogram_worker)
+_histogram_worker = {}
+
+# Figure shared by every heatmap exported within a process (see _init_export_worker)
+_export_worker = {}
+
+
+def _sort_labels(labels):
+    # Sort labels for non-numeric values the way an index containing them would be
+    # sorted, falling back on string order when the labels are not comparable
+    try:
+        return sorted(labels)
+    except TypeError:
+        return sorted(labels, key=str)
+
+
+def _extra_labels(sentinels):
+    # Labels for every kind of value not placed in a numeric bin: sentinels,
+    # missing values, and infinite values (which are labeled as themselves)
+    labels = []
+    for label in list(sentinels.values()) + [NAN_LABEL, -np.inf, np.inf]:
+        if label not in labels:
+            labels.append(label)
+    return labels
+
+
+def _numeric_mask(values, sentinels):
+    # Return a mask of finite, non-sentinel values
+    mask = np.isfinite(values)
+    for value in sentinels:
+        mask &= values != value
+    return mask
+
+
+def _value_range(values, sentinels):
+    """ Get the range of numeric (finite and non-sentinel) values in each column of a 2-D array
+    :param values: 2-D float array
+    :param sentinels: Dictionary of sentinel values to labels
+    :return: Tuple of arrays (min, max) with one value per column (+/-inf for columns with no numeric values)
+    """
+    mask = _numeric_mask(values, sentinels)
+    return np.where(mask, values, np.inf).min(axis=0), np.where(mask, values, -np.inf).max(axis=0)
+
+
+def _bin_edges(lo, hi, bins):
+    """ Get equal-width bin edges spanning the given range (these are identical to those chosen by pd.cut)
+    :param lo: Minimum numeric value
+    :param hi: Maximum numeric value
+    :param bins: Number of bins
+    :return: Array of bins + 1 edges
+    """
+    if not np.isfinite(lo) or not np.isfinite(hi):
+        raise ValueError('Cannot bin a column with no numeric values')
+    lo, hi = lo + 0.0, hi + 0.0
+    if lo == hi:
+        lo -= .001 * abs(lo) if lo != 0 else .001
+        hi += .001 * abs(hi) if hi != 0 else .001
+        return np.linspace(lo, hi, bins + 1, endpoint=True)
+    edges = np.linspace(lo, hi, bins + 1, endpoint=True)
+    edges[0] -= (hi - lo) * 0.001
+    return edges
+
+
+def _bin_labels(edges):
+    # Get the interval labels pd.cut assigns to the bins with the given edges
+    import pandas as pd
+    return list(pd.cut(edges[1:], edges, include_lowest=True, right=True).categories)
+
+
+def _bin_codes(values, edges, sentinels, extras):
+    """ Assign an integer code to every value in a 2-D array
+
+    Numeric values are assigned the index of their (right-closed) bin and any other value is
+    assigned the number of bins plus the index of its label in the given list of extra labels
+    :param values: 2-D float array
+    :param edges: List of bin edge arrays with one entry per column of values
+    :param sentinels: Dictionary of sentinel values to labels
+    :param extras: List of labels for non-numeric values (see _extra_labels)
+    :return: 2-D int array of codes with the same shape as values
+    """
+    bins = len(edges[0]) - 1
+    codes = np.empty(values.shape, dtype=np.int64, order='F')
+    for j, e in enumerate(edges):
+        codes[:, j] = np.searchsorted(e, values[:, j], side='left') - 1
+    np.clip(codes, 0, bins - 1, out=codes)
+
+    # Overwrite codes for non-numeric values with those for their labels
+    codes[np.isnan(values)] = bins + extras.index(NAN_LABEL)
+    codes[values == -np.inf] = bins + extras.index(-np.inf)
+    codes[values == np.inf] = bins + extras.index(np.inf)
+    for value, label in sentinels.items():
+        codes[values == value] = bins + extras.index(label)
+    return codes
+
+
+def _count_codes(codes, target_codes, size):
+    """ Count co-occurrences of codes in each column with target codes
+    :param codes: 2-D int array of codes for feature columns (see _bin_codes)
+    :param target_codes: 1-D int array of codes for the target
+    :param size: Total number of possible codes
+    :return: 3-D int array of counts with shape (columns, target codes, feature codes)
+    """
+    # Combine column, target and feature codes into a single code so
+    # that every histogram for the block is computed in one pass
+    m = codes.shape[1]
+    combined = (np.arange(m, dtype=np.int64) * size + target_codes[:, np.newaxis]) * size + codes
+    return np.bincount(combined.ravel(), minlength=m * size * size).reshape((m, size, size))
+
+
+def _histogram_frame(counts, col, target, col_edges, target_edges, extras):
+    """ Convert a matrix of counts into a labeled histogram frame
+    :param counts: 2-D count array with target codes for rows and feature codes for columns
+    :return: DataFrame of counts (as floats, with NaN for empty cells) indexed by target bin and feature bin;
+            bins are labeled by interval and only labels for non-numeric values that actually occur are included
+    """
+    import pandas as pd
+    bins = len(col_edges) - 1
+
+    def select(edges, present):
+        # Keep every bin and the non-numeric labels present, ordered as they would be in a sorted index
+        labels = dict((bins + i, label) for i, label in enumerate(extras) if present[bins + i])
+        ranks = _sort_labels(labels.values())
+        order = sorted(labels, key=lambda i: ranks.index(labels[i]))
+        return list(range(bins)) + order, _bin_labels(edges) + [labels[i] for i in order]
+
+    rows, row_labels = select(target_edges, counts.sum(axis=1) > 0)
+    cols, col_labels = select(col_edges, counts.sum(axis=0) > 0)
+    r = counts[np.ix_(rows, cols)].astype(np.float64)
+    r[r == 0] = np.nan
+    return pd.DataFrame(r, index=pd.Index(row_labels, name=target), columns=pd.Index(col_labels, name=col))
+
+
+def _blocks(n_cols, n_rows, n_blocks=1):
+    # Generate (start, stop) column ranges for at least n_blocks blocks of at most BLOCK_CELLS values
+    step = max(1, min(BLOCK_CELLS // max(n_rows, 1), -(-n_cols // n_blocks)))
+    for start in range(0, n_cols, step):
+        yield start, min(start + step, n_cols)
+
+
+def _block_histograms(values, target_codes, sentinels, extras, bins):
+    """ Bin a block of columns and count bins against target bins
+    :param values: 2-D float array of column values
+    :return: Tuple of (list of bin edges, 3-D array of counts) with one entry per column (see _count_codes)
+    """
+    edges = [_bin_edges(lo, hi, bins) for lo, hi in zip(*_value_range(values, sentinels))]
+    counts = _count_codes(_bin_codes(values, edges, sentinels, extras), target_codes, bins + len(extras))
+    return edges, counts
+
+
+def _init_histogram_worker(ref, target_codes, sentinels, extras, bins):
+    # Load the data and target codes for every task once per worker process rather than sending
+    # them with each task; both are memory-mapped so the data is never copied between processes
+    _histogram_worker.update(
+        ref=ref, target_codes=np.load(target_codes, mmap_mode='r'),
+        sentinels=sentinels, extras=extras, bins=bins
+    )
+
+
+def _histogram_task(positions):
+    # Compute histograms for the columns at the given positions within a worker process
+    w = _histogram_worker
+    values = np.column_stack([np.asarray(w['ref'].column(i), dtype=np.float64) for i in positions])
+    return _block_histograms(values, w['target_codes'], w['sentinels'], w['extras'], w['bins'])
 
+
+def get_histograms(data, target, sentinels=None, bins=5, n_jobs=1):
+    """ Compute 2-D histograms of every column in a data frame against a target column
+
+    Numeric values in each column are split into equal-width bins while missing values, infinite values and
+    sentinels (special values, like -999 for "unknown") are counted under their own labels instead
+    :param data: DataFrame of numeric columns; this can also be Arrow data or the path of a Parquet or Feather
+            file, in which case the columns are read without copying wherever possible (see arrow.to_frame)
+    :param target: Name of target column
+    :param sentinels: Dictionary of sentinel values to labels (e.g. {-999: 'unknown'})
+    :param bins: Number of bins for numeric values
+    :param n_jobs: Number of processes over which columns are distributed; defaults to 1, meaning that all
+            columns are processed within this process (None will use one process per CPU)
+    :return: Dictionary of DataFrames keyed by column name, each containing counts for that column (in columns)
+            against the target (in rows); combinations of bins that don't occur have a count of NaN
+    """
     if sentinels is None:
         sentinels = {}
+    data = to_frame(data)
+    cols = [col for col in data if col != target]
+    extras = _extra_labels(sentinels)
+
+    values = np.asarray(data[target].values, dtype=np.float64)[:, np.newaxis]
+    target_edges = _bin_edges(*[v[0] for v in _value_range(values, sentinels)], bins=bins)
+    target_codes = _bin_codes(values, [target_edges], sentinels, extras)[:, 0]
 
-    placeholders = sentinels.values() + ['nan']
-
-    def is_numeric(x):
-        return x not in placeholders and np.isfinite(x)
-
-    data = data.applymap(lambda x: 'nan' if np.isnan(x) else sentinels.get(x, x))
-
-    def cut(x):
-        x = x.order()
-        x_mask = x.apply(is_numeric)
-        q = pd.cut(x.loc[x_mask], bins, retbins=True, include_lowest=True, right=True)
-        x_cut = pd.cut(x, q[1], labels=[i for i in range(bins)], include_lowest=True, right=True)
-        x_cut = x.where(~x_mask, x_cut)
-        return {'values': x_cut, 'levels': q[0]}
-
-    res = {}
-    target_bins = cut(data[target])
-    for col in cols:
-        col_bins = cut(data[col])
-        r = pd.DataFrame({col: col_bins['values'], target: target_bins['values']},  index=np.arange(0, len(data[col])))
-        unique_col = r[col].unique()
-        unique_tgt = r[target].unique()
-
-        r = r.groupby([target, col]).size().unstack()
-        bin_set = np.array(range(bins), dtype=np.float)
-
-        for i in np.setdiff1d(bin_set, unique_tgt):
-            r.loc[i, :] = np.nan
-        for i in np.setdiff1d(bin_set, unique_col):
-            r.loc[:, i] = np.nan
-        for i in [0, 1]:
-            r.sort_index(axis=i, inplace=True)
-
-        cols = [col_bins['levels'].levels[int(x)] if x in bin_set else x for x in r.columns]
-        r.columns = pd.Index(cols, name=r.columns.name)
-        rows = [target_bins['levels'].levels[int(x)] if x in bin_set else x for x in r.index]
-        r.index = pd.Index(rows, name=r.index.name)
-
-        res[col] = r
+    if n_jobs == 1:
+        results = (
+            _block_histograms(np.asarray(data[cols[start:stop]].values, dtype=np.float64),
+                              target_codes, sentinels, extras, bins)
+            for start, stop in _blocks(len(cols), len(data))
+        )
+    else:
+        results = _get_histograms_parallel(data, target, target_codes, sentinels, extras, bins, n_jobs)
+
+    res, j = {}, 0
+    for edges, counts in results:
+        for k in range(len(edges)):
+            res[cols[j]] = _histogram_frame(counts[k], cols[j], target, edges[k], target_edges, extras)
+            j += 1
     return res
 
 
-def plot_histograms(hists, cnorm=None, cmap=matplotlib.cm.GnBu_r, transform=None):
+def _get_histograms_parallel(data, target, target_codes, sentinels, extras, bins, n_jobs):
+    # Compute histograms for blocks of columns in a pool of worker processes, returning results in column order
+    positions = [i for i, col in enumerate(data.columns) if col != target]
+    n_blocks = 4 * (n_jobs or multiprocessing.cpu_count())
+    tasks = [positions[start:stop] for start, stop in _blocks(len(positions), len(data), n_blocks)]
+
+    # Write columns to memory-mapped files (see batch.FrameRef) shared by all workers
+    path = tempfile.mkdtemp(prefix='pylfer_histograms_')
+    try:
+        ref = FrameRef(data, path)
+        target_file = os.path.join(path, 'target_codes.npy')
+        np.save(target_file, target_codes)
+        pool = multiprocessing.Pool(n_jobs, _init_histogram_worker, (ref, target_file, sentinels, extras, bins))
+        try:
+            return pool.map(_histogram_task, tasks, chunksize=1)
+        finally:
+            pool.terminate()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def get_histograms_chunked(chunks, target, sentinels=None, bins=5):
+    """ Compute the same histograms as get_histograms from data split across many data frames
+
+    This is meant for data too large to fit in memory since only one chunk is loaded at a time and
+    counts are accumulated as each chunk is processed; chunks are read twice, once to determine the
+    range of every column (and therefore its bin edges) and again to count values within those bins
+    :param chunks: Function returning an iterable of DataFrames with identical columns (e.g.
+            lambda: pd.read_csv('data.csv', chunksize=100000)) or a collection of DataFrames that
+            can be iterated over more than once (iterators and generators cannot be used directly); Arrow data
+            or the path of a Parquet or Feather file can also be given, which is then read in batches (for Parquet
+            files, only one batch is ever in memory at a time; see arrow.to_chunks)
+    :param target: Name of target column
+    :param sentinels: Dictionary of sentinel values to labels (e.g. {-999: 'unknown'})
+    :param bins: Number of bins for numeric values
+    :return: Dictionary of DataFrames as returned by get_histograms
+    """
+    if sentinels is None:
+        sentinels = {}
+    chunks = to_chunks(chunks)
+    if not callable(chunks):
+        if iter(chunks) is chunks:
+            raise ValueError('Chunks must be a function or a collection of DataFrames (not a single-use iterator)')
+        collection = chunks
+        chunks = lambda: collection
+    extras = _extra_labels(sentinels)
+    size = bins + len(extras)
+
+    # Find the range of numeric values in the target and every other column
+    columns, lo, hi = None, None, None
+    for chunk in chunks():
+        if columns is None:
+            columns = [target] + [col for col in chunk if col != target]
+            lo, hi = np.full(len(columns), np.inf), np.full(len(columns), -np.inf)
+        for start, stop in _blocks(len(columns), len(chunk)):
+            values = np.asarray(chunk[columns[start:stop]].values, dtype=np.float64)
+            chunk_lo, chunk_hi = _value_range(values, sentinels)
+            lo[start:stop] = np.minimum(lo[start:stop], chunk_lo)
+            hi[start:stop] = np.maximum(hi[start:stop], chunk_hi)
+    if columns is None:
+        raise ValueError('No data frames were given to compute histograms for')
+    edges = [_bin_edges(l, h, bins) for l, h in zip(lo, hi)]
+    target_edges, edges, cols = edges[0], edges[1:], columns[1:]
+
+    # Accumulate counts within the bins for each column
+    counts = np.zeros((len(cols), size, size), dtype=np.int64)
+    for chunk in chunks():
+        values = np.asarray(chunk[target].values, dtype=np.float64)[:, np.newaxis]
+        target_codes = _bin_codes(values, [target_edges], sentinels, extras)[:, 0]
+        for start, stop in _blocks(len(cols), len(chunk)):
+            values = np.asarray(chunk[cols[start:stop]].values, dtype=np.float64)
+            codes = _bin_codes(values, edges[start:stop], sentinels, extras)
+            counts[start:stop] += _count_codes(codes, target_codes, size)
+
+    return dict(
+        (col, _histogram_frame(counts[j], col, target, edges[j], target_edges, extras))
+        for j, col in enumerate(cols)
+    )
+
+
+def plot_histograms(hists, cnorm=None, cmap='GnBu_r', transform=None):
     """ Plots histogram results returned from self.get_histograms method
     :param hists: Dictionary returned from self.get_histograms
     :param cnorm: Color scale; commonly one of matplotlib.colors.{LogNorm, SymLogNorm}
-    :param cmap: Colormap used in heatmap color scheme
+    :param cmap: Colormap (or name of colormap) used in heatmap color scheme
     :param transform: Transformation to be applied to each histogram count value
     :return: List of tuples containing matplotlib objects for each heatmap plot;
             each tuple has the form: (figure, plotaxis, coloraxis)
     """
+    from matplotlib import pyplot as plt
     res = []
     for col in hists:
         d = hists[col]
@@ -72,20 +322,103 @@ def plot_histograms(hists, cnorm=None, cmap=matplotlib.cm.GnBu_r, transform=None
 
         fig = plt.figure()
         ax = fig.add_subplot(111)
-        ax.set_title(d.columns.name+' vs '+d.index.name)
-
-        cax = ax.matshow(d, interpolation='nearest', norm=cnorm, cmap=cmap)
+        cax = _draw_histogram(fig, ax, d, cnorm, cmap)
         fig.colorbar(cax, shrink=.7)
+        fig.set_size_inches((10, 10))
 
-        ax.set_xticks(np.arange(len(d.columns)))
-        ax.set_xticklabels(map(str, d.columns), rotation=16, rotation_mode="anchor")
-        ax.set_xlabel(d.columns.name)
+        res.append((fig, ax, cax))
+    return res
 
-        ax.set_yticklabels(map(str, d.index))
-        ax.set_yticks(np.arange(len(d.index)))
-        ax.set_ylabel(d.index.name)
 
-        fig.set_size_inches((10, 10))
+def _draw_histogram(fig, ax, d, cnorm, cmap):
+    # Draw a single histogram heatmap on the given axes, returning the resulting image
+    ax.set_title(d.columns.name+' vs '+d.index.name)
 
-        res.append((fig, ax, cax))
-    return res
\ No newline at end of file
+    cax = ax.matshow(d, interpolation='nearest', norm=cnorm, cmap=cmap)
+
+    ax.set_xticks(np.arange(len(d.columns)))
+    ax.set_xticklabels(map(str, d.columns), rotation=16, rotation_mode="anchor")
+    ax.set_xlabel(d.columns.name)
+
+    ax.set_yticklabels(map(str, d.index))
+    ax.set_yticks(np.arange(len(d.index)))
+    ax.set_ylabel(d.index.name)
+    return cax
+
+
+def _init_export_worker(cnorm, cmap, size, dpi):
+    # Create the single figure (and axes) that every heatmap exported by this process is drawn on; the figure
+    # is attached to an Agg canvas directly so that it is never registered with (and retained by) pyplot
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=size, dpi=dpi)
+    FigureCanvasAgg(fig)
+    _export_worker.update(fig=fig, ax=fig.add_subplot(111), colorbar_ax=None, cnorm=cnorm, cmap=cmap)
+
+
+def _export_task(task):
+    # Draw a histogram on the figure for this process and save it to the given file (or PdfPages instance)
+    d, output, format = task
+    w = _export_worker
+    w['ax'].clear()
+    cax = _draw_histogram(w['fig'], w['ax'], d, w['cnorm'], w['cmap'])
+    if w['colorbar_ax'] is None:
+        w['colorbar_ax'] = w['fig'].colorbar(cax, shrink=.7).ax
+    else:
+        w['colorbar_ax'].clear()
+        w['fig'].colorbar(cax, cax=w['colorbar_ax'])
+    w['fig'].savefig(output, format=format)
+    return output
+
+
+def export_histograms(hists, path, format='png', cnorm=None, cmap='GnBu_r', transform=None,
+                      n_jobs=1, size=(10, 10), dpi=100):
+    """ Saves heatmaps of histogram results returned from self.get_histograms to files
+
+    Unlike plot_histograms, this does not use pyplot and draws every heatmap on the same figure (one per
+    process) so that memory usage is constant regardless of the number of histograms exported
+    :param hists: Dictionary returned from self.get_histograms
+    :param path: Directory in which to save one file per heatmap (named by column) for 'png' and 'svg'
+            formats, or path of the single multi-page file to save all heatmaps in for the 'pdf' format
+    :param format: Output format; one of 'png', 'svg' or 'pdf'
+    :param cnorm: Color scale; commonly one of matplotlib.colors.{LogNorm, SymLogNorm}
+    :param cmap: Colormap (or name of colormap) used in heatmap color scheme
+    :param transform: Transformation to be applied to each histogram count value
+    :param n_jobs: Number of processes over which heatmaps are distributed for 'png' and 'svg' formats;
+            defaults to 1, meaning that all heatmaps are drawn in this process (None will use one per CPU)
+    :param size: Size of each heatmap in inches
+    :param dpi: Resolution of each heatmap in dots per inch
+    :return: List of paths of saved files
+    """
+    if format not in ('png', 'svg', 'pdf'):
+        raise ValueError('Format must be one of "png", "svg" or "pdf" (not "{}")'.format(format))
+    hists = [(col, hists[col] if transform is None else transform(hists[col])) for col in hists]
+
+    # Pages of a single PDF can only be written in sequence, by one process
+    if format == 'pdf':
+        from matplotlib.backends.backend_pdf import PdfPages
+        _init_export_worker(cnorm, cmap, size, dpi)
+        pages = PdfPages(path)
+        try:
+            for col, d in hists:
+                _export_task((d, pages, format))
+        finally:
+            pages.close()
+            _export_worker.clear()
+        return [path]
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+    tasks = [(d, os.path.join(path, '{}.{}'.format(col, format)), format) for col, d in hists]
+    if n_jobs == 1:
+        _init_export_worker(cnorm, cmap, size, dpi)
+        try:
+            return [_export_task(task) for task in tasks]
+        finally:
+            _export_worker.clear()
+
+    pool = multiprocessing.Pool(n_jobs, _init_export_worker, (cnorm, cmap, size, dpi))
+    try:
+        return pool.map(_export_task, tasks, chunksize=1)
+    finally:
+        pool.terminate()